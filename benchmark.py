@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import psutil
+except ImportError:  # Without psutil peak RSS covers the Python process only, not its browsers
+    psutil = None
+
+from fixture_server import FixtureConfig, start_server
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = Path(__file__).resolve().parent
+
+
+class Scenario(NamedTuple):
+    name: str
+    script: str
+    args: List[str]
+    # Runs that download documents need the manifest a discovery run produced
+    needs_manifest: bool = False
+
+
+def scenarios(base_url: str) -> List[Scenario]:
+    """Every run the suite measures, all pointed at the fixture server at base_url."""
+    archives = f"{base_url}/Archives/edgar/data"
+    discovery = ["--sec-url", base_url, "--efts-url", base_url, "--archives-url", archives,
+                 "--checkpoint", "checkpoint.db", "--rate", "10"]
+    return [
+        Scenario("sec.py http", "sec.py", ["--backend", "http"] + discovery),
+        Scenario("sec.py browser", "sec.py", ["--backend", "browser"] + discovery),
+        Scenario("improved_sec.py raw", "improved_sec.py",
+                 ["--fetch-mode", "raw", "--sec-url", base_url, "--archives-url", archives]),
+        Scenario("sec_doc.py raw", "sec_doc.py", ["--mode", "raw", "--concurrency", "4", "--rate", "10"],
+                 needs_manifest=True),
+        Scenario("sec_doc.py pdf", "sec_doc.py", ["--mode", "pdf", "--rate", "10"], needs_manifest=True),
+    ]
+
+
+def _watch_rss(pid: int, peak: Dict[str, float], done: threading.Event) -> None:
+    """Poll the resident memory of a process and all its children (browsers included)."""
+    while not done.wait(0.2):
+        try:
+            root = psutil.Process(pid)
+            rss = sum(p.memory_info().rss for p in [root] + root.children(recursive=True))
+        except psutil.Error:
+            continue
+        peak["rss"] = max(peak.get("rss", 0), rss)
+
+
+def run_scenario(scenario: Scenario, workdir: Path, timeout: float) -> Dict:
+    """Run one script in workdir and collect wall time, peak RSS and its metrics snapshot."""
+    metrics_file = workdir / "metrics.json"
+    command = [sys.executable, str(REPO_DIR / scenario.script)] + scenario.args + ["--metrics-file", str(metrics_file)]
+    logger.info(f"Running {scenario.name}: {' '.join(command)}")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    peak: Dict[str, float] = {}
+    done = threading.Event()
+    if psutil is not None:
+        threading.Thread(target=_watch_rss, args=(process.pid, peak, done), daemon=True).start()
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        _, stderr = process.communicate()
+        logger.error(f"{scenario.name} did not finish within {timeout:.0f}s")
+    finally:
+        done.set()
+    elapsed = time.perf_counter() - started
+    if psutil is None:
+        import resource
+        # Max over every child waited for so far; good enough when scenarios run in increasing size
+        peak["rss"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    if process.returncode:
+        logger.error(f"{scenario.name} exited with {process.returncode}: {stderr.decode(errors='replace')[-2000:]}")
+
+    snapshot = json.loads(metrics_file.read_text()) if metrics_file.exists() else {"stages": {}, "counters": []}
+    outputs = sum(counter["value"] for counter in snapshot["counters"]
+                  if counter["name"] in ("documents_total", "rows_total"))
+    return {
+        "scenario": scenario.name,
+        "exit_code": process.returncode,
+        "seconds": round(elapsed, 3),
+        "outputs": int(outputs),
+        "docs_per_second": round(outputs / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": round(peak.get("rss", 0) / (1024 * 1024), 1),
+        "stages": snapshot["stages"],
+        "counters": snapshot["counters"],
+    }
+
+
+def _limit_manifest(source: Path, target: Path, documents: int) -> None:
+    """Copy the first `documents` rows of a CSV manifest so download runs take a bounded time."""
+    with open(source, encoding="utf-8") as src, open(target, "w", encoding="utf-8") as dst:
+        for index, line in enumerate(src):
+            if index > documents:
+                break
+            dst.write(line)
+
+
+def run_suite(config: FixtureConfig, names: Optional[List[str]] = None, documents: int = 200,
+              timeout: float = 1800.0) -> List[Dict]:
+    server = start_server(config)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    results = []
+    manifest: Optional[Path] = None
+    with tempfile.TemporaryDirectory(prefix="sec-bench-") as tmp:
+        try:
+            for scenario in scenarios(base_url):
+                if names and scenario.name not in names and scenario.script not in names:
+                    continue
+                workdir = Path(tmp) / scenario.name.replace(" ", "_")
+                workdir.mkdir()
+                if scenario.needs_manifest:
+                    if manifest is None:
+                        logger.warning(f"Skipping {scenario.name}: no discovery run produced a manifest")
+                        continue
+                    _limit_manifest(manifest, workdir / "Master_file.csv", documents)
+                results.append(run_scenario(scenario, workdir, timeout))
+                if scenario.script == "sec.py" and (workdir / "Master_file.csv").exists():
+                    manifest = workdir / "Master_file.csv"
+        finally:
+            server.shutdown()
+    return results
+
+
+def format_report(results: List[Dict]) -> str:
+    rows = [("scenario", "docs", "seconds", "docs/s", "peak RSS MB", "stage", "p50 ms", "p99 ms")]
+    for result in results:
+        stages = sorted(result["stages"].items(), key=lambda item: -item[1]["total_seconds"]) or [("-", None)]
+        for index, (stage, values) in enumerate(stages):
+            head = (result["scenario"], str(result["outputs"]), f"{result['seconds']:.1f}",
+                    f"{result['docs_per_second']:.2f}", f"{result['peak_rss_mb']:.0f}") if index == 0 else ("",) * 5
+            tail = (stage, f"{values['p50'] * 1000:.0f}", f"{values['p99'] * 1000:.0f}") if values else ("-", "", "")
+            rows.append(head + tail)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local stand-in for EDGAR")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="scenario names or scripts to run, e.g. 'sec.py http' or sec_doc.py")
+    parser.add_argument("--hits", type=int, default=250, help="search results per query")
+    parser.add_argument("--documents", type=int, default=200, help="manifest rows handed to each download run")
+    parser.add_argument("--document-size", type=int, default=20000, help="bytes per synthetic filing")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--lockout-rate", type=float, default=0.0,
+                        help="fraction of requests answered with the 403 rate-threshold page")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="seconds allowed per scenario")
+    parser.add_argument("--json", default=None, help="also write the full results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = FixtureConfig(args.hits, args.document_size, args.latency_ms, args.jitter_ms,
+                           args.throttle_rate, args.lockout_rate)
+    results = run_suite(config, args.only, args.documents, args.timeout)
+    print(format_report(results))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import logging
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import http_cache
+
+logger = logging.getLogger(__name__)
+
+# Nothing the scrapers read lives in these; search pages render fine without them
+DEFAULT_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+TRACKING_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "analytics.usa.gov",
+    "dap.digitalgov.gov",
+)
+DEFAULT_VIEWPORT = {"width": 1920, "height": 1080}
+
+
+def should_block(request, blocked_resource_types: Iterable[str]) -> bool:
+    """Return True for requests a scraper never needs: analytics beacons and blocked resource types."""
+    host = urlsplit(request.url).hostname or ""
+    if any(host == tracker or host.endswith(f".{tracker}") for tracker in TRACKING_HOSTS):
+        return True
+    return request.resource_type in blocked_resource_types
+
+
+def install_resource_blocking(context, blocked_resource_types: Iterable[str] = DEFAULT_BLOCKED_RESOURCE_TYPES) -> None:
+    """Abort unneeded requests on a sync Playwright context through route interception."""
+    blocked = frozenset(blocked_resource_types)
+
+    def handle(route):
+        if should_block(route.request, blocked):
+            route.abort()
+        else:
+            route.continue_()
+
+    context.route("**/*", handle)
+
+
+async def install_resource_blocking_async(context,
+                                          blocked_resource_types: Iterable[str] = DEFAULT_BLOCKED_RESOURCE_TYPES) -> None:
+    """Async counterpart of install_resource_blocking for async Playwright contexts."""
+    blocked = frozenset(blocked_resource_types)
+
+    async def handle(route):
+        if should_block(route.request, blocked):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", handle)
+
+
+class BrowserPool:
+    """One long-lived Chromium whose context is recycled after `max_uses` pages.
+
+    Launching a browser costs seconds, so it is started once per run; contexts are
+    cheap and are replaced periodically so cookies, caches and leaked memory from
+    long crawls do not accumulate.
+    """
+
+    def __init__(self, playwright, headless: bool = True, max_uses: int = 50,
+                 blocked_resource_types: Iterable[str] = DEFAULT_BLOCKED_RESOURCE_TYPES,
+                 viewport: Optional[dict] = None):
+        self.playwright = playwright
+        self.headless = headless
+        self.max_uses = max_uses
+        self.blocked_resource_types = frozenset(blocked_resource_types)
+        self.viewport = viewport or DEFAULT_VIEWPORT
+        self._browser = None
+        self._context = None
+        self._uses = 0
+
+    def _ensure_browser(self):
+        if self._browser is None or not self._browser.is_connected():
+            logger.info(f"Launching {'headless ' if self.headless else ''}Chromium")
+            self._browser = self.playwright.chromium.launch(headless=self.headless)
+            self._context = None
+        return self._browser
+
+    def _ensure_context(self):
+        browser = self._ensure_browser()
+        if self._context is not None and self._uses >= self.max_uses:
+            logger.info(f"Recycling browser context after {self._uses} uses")
+            self._close_context()
+        if self._context is None:
+            self._context = browser.new_context(viewport=self.viewport)
+            install_resource_blocking(self._context, self.blocked_resource_types)
+            if http_cache.default_cache is not None:
+                http_cache.install_http_cache(self._context, http_cache.default_cache)
+            self._uses = 0
+        return self._context
+
+    def _close_context(self) -> None:
+        try:
+            if self._context is not None:
+                self._context.close()
+        except Exception as e:
+            logger.error(f"Error closing browser context: {e}")
+        self._context = None
+
+    @contextmanager
+    def page(self) -> Iterator:
+        """Borrow a fresh page from the current context; it is closed when the block exits."""
+        context = self._ensure_context()
+        self._uses += 1
+        page = context.new_page()
+        try:
+            yield page
+        finally:
+            try:
+                page.close()
+            except Exception as e:
+                logger.error(f"Error closing page: {e}")
+
+    def close(self) -> None:
+        self._close_context()
+        try:
+            if self._browser is not None:
+                self._browser.close()
+        except Exception as e:
+            logger.error(f"Error closing browser: {e}")
+        self._browser = None
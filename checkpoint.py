@@ -0,0 +1,119 @@
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_progress (
+    query_url TEXT PRIMARY KEY,
+    last_page INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captured_rows (
+    accession TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    query_url TEXT NOT NULL,
+    PRIMARY KEY (accession, file_name)
+);
+CREATE TABLE IF NOT EXISTS sync_watermarks (
+    query_url TEXT PRIMARY KEY,
+    filed TEXT NOT NULL,
+    accession TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class CrawlCheckpoint:
+    """SQLite record of crawl progress so an interrupted sec.py run resumes where it stopped.
+
+    Per query URL it keeps the last fully processed result page and whether the query
+    ran out of results; per document it keeps the (accession, file name) already written
+    to Master_file.csv so those rows are skipped before the browser touches them.
+    Incremental syncs (sync.py) also keep a per-query watermark: the latest filed date
+    and accession number seen.
+    """
+
+    def __init__(self, db_path: str = "crawl_checkpoint.db"):
+        self.db_path = Path(db_path)
+        # Planner worker processes share one checkpoint file, so wait on each other's locks;
+        # pipeline.py opens it on the main thread and uses it from its discovery thread
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def last_page(self, query_url: str) -> int:
+        row = self.conn.execute(
+            "SELECT last_page FROM query_progress WHERE query_url = ?", (query_url,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def is_query_done(self, query_url: str) -> bool:
+        row = self.conn.execute(
+            "SELECT completed FROM query_progress WHERE query_url = ?", (query_url,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def mark_page_done(self, query_url: str, page_number: int) -> None:
+        self.conn.execute(
+            """INSERT INTO query_progress (query_url, last_page, updated_at) VALUES (?, ?, ?)
+               ON CONFLICT(query_url) DO UPDATE SET
+                   last_page = MAX(last_page, excluded.last_page), updated_at = excluded.updated_at""",
+            (query_url, page_number, time.time()),
+        )
+        self.conn.commit()
+
+    def mark_query_done(self, query_url: str) -> None:
+        self.conn.execute(
+            """INSERT INTO query_progress (query_url, completed, updated_at) VALUES (?, 1, ?)
+               ON CONFLICT(query_url) DO UPDATE SET completed = 1, updated_at = excluded.updated_at""",
+            (query_url, time.time()),
+        )
+        self.conn.commit()
+
+    def has_row(self, accession: Optional[str], file_name: Optional[str]) -> bool:
+        if not accession or not file_name:
+            return False
+        row = self.conn.execute(
+            "SELECT 1 FROM captured_rows WHERE accession = ? AND file_name = ?", (accession, file_name)
+        ).fetchone()
+        return row is not None
+
+    def add_rows(self, query_url: str, rows: Iterable[Tuple[Optional[str], Optional[str]]]) -> None:
+        """Remember (accession, file name) pairs once their rows have been flushed to the manifest."""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO captured_rows (accession, file_name, query_url) VALUES (?, ?, ?)",
+            [(accession, file_name, query_url) for accession, file_name in rows if accession and file_name],
+        )
+        self.conn.commit()
+
+    def watermark(self, query_url: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Return the (filed date, accession) high-water mark of a query, or None before its first sync."""
+        row = self.conn.execute(
+            "SELECT filed, accession FROM sync_watermarks WHERE query_url = ?", (query_url,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_watermark(self, query_url: str, filed: str, accession: Optional[str]) -> None:
+        self.conn.execute(
+            """INSERT INTO sync_watermarks (query_url, filed, accession, updated_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(query_url) DO UPDATE SET
+                   filed = excluded.filed, accession = excluded.accession, updated_at = excluded.updated_at""",
+            (query_url, filed, accession, time.time()),
+        )
+        self.conn.commit()
+
+    def reset(self) -> None:
+        self.conn.execute("DELETE FROM query_progress")
+        self.conn.execute("DELETE FROM captured_rows")
+        self.conn.execute("DELETE FROM sync_watermarks")
+        self.conn.commit()
+        logger.info(f"Cleared crawl checkpoint {self.db_path}")
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
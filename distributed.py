@@ -0,0 +1,278 @@
+import argparse
+import logging
+import os
+import socket
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from playwright.sync_api import sync_playwright
+
+import http_cache
+import sec
+import sec_doc
+from browser_pool import BrowserPool
+from doc_store import DocumentStore
+from efts import (ARCHIVES_BASE_URL, EFTS_BASE_URL, PAGE_SIZE, SEC_BASE_URL, EFTSClient, archive_url,
+                  parse_search_payload, rebase_url_groups, search_params_from_url, total_hits)
+from http_client import create_session
+from metrics import metrics
+from planner import merge_manifests
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from sinks import create_sink, read_rows
+from work_queue import DEFAULT_MAX_ATTEMPTS, DEFAULT_VISIBILITY_TIMEOUT, Heartbeat, WorkQueue, open_queue
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE = "search_page"
+DOCUMENT = "document"
+
+
+def search_page_key(url: str, page_number: int) -> str:
+    return f"{SEARCH_PAGE}:{url}#{page_number}"
+
+
+def enqueue_searches(queue: WorkQueue, url_groups: Dict[str, list]) -> int:
+    """Seed page 1 of every search URL; workers enqueue each following page as they reach it."""
+    return queue.put_many(SEARCH_PAGE, (
+        ({"url": url, "url_type": url_type, "page": 1}, search_page_key(url, 1))
+        for url_type, urls in url_groups.items() for url in urls
+    ))
+
+
+def enqueue_documents(queue: WorkQueue, manifest) -> int:
+    """One unit per manifest row, keyed by document URL so re-seeding adds only new rows."""
+    return queue.put_many(DOCUMENT, (
+        (row, f"{DOCUMENT}:{row['file_url']}") for row in read_rows(manifest) if row.get('file_url')
+    ))
+
+
+class NodeWorker:
+    """Runs the units one node claims from a shared WorkQueue.
+
+    Search pages append their rows to this node's part of the search manifest and
+    enqueue the page after them; documents are fetched and appended to this node's
+    part of the updated manifest. Parts are named after the worker id and merged once
+    the queue is drained. Every node paces itself with its own RateLimiter, since
+    SEC's limit is per egress IP and each node has its own.
+    """
+
+    def __init__(self, queue: WorkQueue, worker_id: str, parts_dir: str = "distributed",
+                 backend: str = "http", fetch: str = "raw", rate_limiter: Optional[RateLimiter] = None,
+                 store: Optional[DocumentStore] = None, efts_url: str = EFTS_BASE_URL,
+                 archives_url: str = ARCHIVES_BASE_URL, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.backend = backend
+        self.fetch = fetch
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.store = store
+        self.visibility_timeout = visibility_timeout
+        self.parts_dir = Path(parts_dir)
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        self.efts_url = efts_url
+        self.archives_url = archives_url
+        self._stack = ExitStack()
+        self._scraper = None
+        self._client = None
+        self._sink = None
+        self._session = None
+        self._pool = None
+        self._playwright = None
+        self.handlers: Dict[str, Callable[[Dict], None]] = {
+            SEARCH_PAGE: self.process_search_page,
+            DOCUMENT: self.process_document,
+        }
+
+    # Outputs and clients are opened on first use, so a node only drawing documents never starts a scraper
+    def _browser_pool(self) -> BrowserPool:
+        if self._pool is None:
+            self._playwright = self._stack.enter_context(sync_playwright())
+            self._pool = BrowserPool(self._playwright)
+            self._stack.callback(self._pool.close)
+        return self._pool
+
+    def scraper(self) -> sec.SECDocumentScraper:
+        if self._scraper is None:
+            self._scraper = sec.SECDocumentScraper(
+                csv_file=str(self.parts_dir / f"{self.worker_id}_Master_file.csv"),
+                rate_limiter=self.rate_limiter, archives_base=self.archives_url)
+            self._stack.callback(self._scraper.close)
+        return self._scraper
+
+    def client(self) -> EFTSClient:
+        if self._client is None:
+            self._client = EFTSClient(base_url=self.efts_url, archives_base=self.archives_url,
+                                      rate_limiter=self.rate_limiter)
+            self._stack.callback(self._client.close)
+        return self._client
+
+    def document_sink(self):
+        if self._sink is None:
+            # Appended to, so a restarted worker keeps the rows it finished before
+            self._sink = create_sink(self.parts_dir / f"{self.worker_id}_Updated_Master_file.csv",
+                                     sec_doc.fieldnames, batch_size=1)
+            self._stack.callback(self._sink.close)
+        return self._sink
+
+    def process_search_page(self, payload: Dict) -> None:
+        url, url_type, page_number = payload["url"], payload["url_type"], payload["page"]
+        scraper = self.scraper()
+        if self.backend == "http":
+            offset = (page_number - 1) * PAGE_SIZE
+            response = self.client().search_page(search_params_from_url(url), offset)
+            rows = parse_search_payload(response)
+            has_next = bool(rows) and offset + len(rows) < total_hits(response)
+            for details in rows:
+                file_url = archive_url(details, self.archives_url)
+                if file_url:
+                    scraper.write_details(file_url, url_type, details)
+                else:
+                    metrics.inc("failures_total", form_type=url_type, stage="document_url")
+            complete = True
+        else:
+            with self._browser_pool().page() as page:
+                scraper.attach(page)
+                if not scraper.load_results_page(page, f"{url}&page={page_number}", url_type):
+                    # Only a search response saying there are no hits ends the query; anything else is retried
+                    if not scraper.reached_end():
+                        raise RuntimeError(f"Could not load page {page_number} of {url}")
+                    logger.info(f"No more results for {url} after page {page_number - 1}")
+                    return
+                scraper.get_document_details(page, url_type)
+                has_next = True
+                complete = scraper._page_complete
+        scraper.finish_page(url, None)
+        if has_next:
+            self.queue.put(SEARCH_PAGE, {**payload, "page": page_number + 1},
+                           search_page_key(url, page_number + 1))
+        if not complete:
+            # Rows already written are deduplicated by file URL when the parts are merged
+            raise RuntimeError(f"Some rows of page {page_number} of {url} failed")
+
+    def process_document(self, row: Dict) -> None:
+        if self.fetch == "pdf":
+            sec_doc.fetch_pdf_row(self._browser_pool(), row, "sec_gov", self.rate_limiter, self.store)
+        else:
+            if self._session is None:
+                self._session = create_session()
+                self._stack.callback(self._session.close)
+            sec_doc.fetch_raw_row(self._session, row, "sec_gov", self.rate_limiter, self.store)
+        if row['file_path'] == 'Failed to download':
+            raise RuntimeError(f"Failed to download {row['file_url']}")
+        sec_doc.update_output(self.document_sink(), row)
+
+    def run(self, wait: bool = False, poll_interval: float = 5.0) -> int:
+        """Claim and process units until the queue is drained (or forever with wait); returns units done."""
+        done = 0
+        while True:
+            item = self.queue.claim(self.worker_id, self.visibility_timeout)
+            if item is None:
+                # Units leased elsewhere come back if their worker dies, so keep polling until none are left
+                if not wait and self.queue.counts()["leased"] == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+            handler = self.handlers.get(item.kind)
+            with Heartbeat(self.queue, item, self.visibility_timeout) as heartbeat:
+                try:
+                    if handler is None:
+                        raise ValueError(f"Unknown work item kind {item.kind!r}")
+                    with metrics.span(f"work_{item.kind}"):
+                        handler(item.payload)
+                except Exception as e:
+                    logger.error(f"Work item {item.id} ({item.kind}, attempt {item.attempts}) failed: {e}")
+                    metrics.inc("work_items_total", kind=item.kind, result="failed")
+                    self.queue.fail(item, str(e))
+                    continue
+            if heartbeat.lost or not self.queue.ack(item):
+                logger.warning(f"Work item {item.id} finished after its lease was lost; it may run twice")
+            metrics.inc("work_items_total", kind=item.kind, result="done")
+            done += 1
+        logger.info(f"Worker {self.worker_id} processed {done} work items")
+        return done
+
+    def close(self) -> None:
+        self._stack.close()
+
+
+def merge_parts(parts_dir: str = "distributed") -> None:
+    """Merge every node's part manifests into Master_file.csv and Updated_Master_file.csv."""
+    parts = Path(parts_dir)
+    updated = sorted(str(path) for path in parts.glob("*_Updated_Master_file.csv"))
+    search = sorted(str(path) for path in parts.glob("*_Master_file.csv") if str(path) not in updated)
+    if search:
+        logger.info(f"Merged {merge_manifests(search, 'Master_file.csv')} rows into Master_file.csv")
+    if updated:
+        merged = merge_manifests(updated, "Updated_Master_file.csv", fieldnames=sec_doc.fieldnames)
+        logger.info(f"Merged {merged} rows into Updated_Master_file.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl and download across machines through a shared work queue")
+    parser.add_argument("--queue", default="work_queue.db",
+                        help="SQLite file on a shared filesystem, or redis://host:port/db[#namespace]")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="claims before a unit is parked as dead")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="enqueue search pages and/or manifest rows")
+    seed.add_argument("--searches", action="store_true", help="enqueue page 1 of every query in URL_GROUPS")
+    seed.add_argument("--sec-url", default=SEC_BASE_URL, help="host the search URLs are pointed at")
+    seed.add_argument("--documents", default=None, metavar="MANIFEST", help="enqueue every row of a manifest")
+
+    work = commands.add_parser("work", help="run a worker on this node until the queue is drained")
+    work.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    work.add_argument("--parts-dir", default="distributed", help="where this node writes its part manifests")
+    work.add_argument("--backend", choices=["browser", "http"], default="http", help="how search pages are read")
+    work.add_argument("--fetch", choices=["raw", "pdf"], default="raw", help="how documents are downloaded")
+    work.add_argument("--efts-url", default=EFTS_BASE_URL)
+    work.add_argument("--archives-url", default=ARCHIVES_BASE_URL)
+    work.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                      help="requests per second of this node (SEC's limit applies per IP)")
+    work.add_argument("--visibility-timeout", type=float, default=DEFAULT_VISIBILITY_TIMEOUT,
+                      help="seconds a claimed unit stays invisible without a heartbeat")
+    work.add_argument("--wait", action="store_true", help="keep polling for new units instead of exiting")
+    work.add_argument("--store", action="store_true", help="keep documents in the deduplicated document store")
+    work.add_argument("--metrics-file", default=None)
+    work.add_argument("--http-cache", default=None, metavar="DIR")
+    work.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB)
+
+    commands.add_parser("stats", help="print how many units are ready, leased, done and dead")
+    merge = commands.add_parser("merge", help="merge the part manifests of every node")
+    merge.add_argument("--parts-dir", default="distributed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "merge":
+        merge_parts(args.parts_dir)
+        return
+    queue = open_queue(args.queue, args.max_attempts)
+    try:
+        if args.command == "seed":
+            if args.searches:
+                added = enqueue_searches(queue, rebase_url_groups(sec.URL_GROUPS, args.sec_url))
+                logger.info(f"Enqueued {added} search queries")
+            if args.documents:
+                logger.info(f"Enqueued {enqueue_documents(queue, args.documents)} documents")
+        elif args.command == "work":
+            http_cache.enable(args.http_cache, args.http_cache_mb)
+            store = DocumentStore("sec_gov") if args.store else None
+            worker = NodeWorker(queue, args.worker_id, args.parts_dir, args.backend, args.fetch,
+                                RateLimiter(args.rate), store, args.efts_url, args.archives_url,
+                                args.visibility_timeout)
+            try:
+                with metrics.exporting(args.metrics_file):
+                    worker.run(wait=args.wait)
+            finally:
+                worker.close()
+                if store:
+                    store.close()
+        print(" ".join(f"{state}={count}" for state, count in queue.counts().items()))
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
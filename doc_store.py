@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    accession TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (accession, file_name)
+);
+CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+"""
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DocumentStore:
+    """Content-addressed document store indexed by (accession number, file name).
+
+    Each distinct byte string is kept once under `.objects/<sha256>`; the per-form-type
+    directories only hold hardlinks to those objects. Because the index is keyed by
+    accession and file name, a filing that shows up again under another query or form
+    group is resolved from the index before any network or browser work happens.
+    """
+
+    def __init__(self, root: str = "sec_gov", index_path: Optional[str] = None):
+        self.root = Path(root)
+        self.objects_dir = self.root / ".objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = Path(index_path) if index_path else self.root / "store_index.db"
+        self.conn = sqlite3.connect(str(self.index_path), timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        # Download worker threads share the store
+        self._lock = threading.Lock()
+
+    def _object_path(self, sha256: str, suffix: str) -> Path:
+        return self.objects_dir / sha256[:2] / f"{sha256}{suffix}"
+
+    def lookup(self, accession: str, file_name: str) -> Optional[Path]:
+        """Return the stored object for a document, or None if it has never been stored."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT sha256 FROM documents WHERE accession = ? AND file_name = ?", (accession, file_name)
+            ).fetchone()
+        if not row:
+            return None
+        path = self._object_path(row[0], Path(file_name).suffix)
+        return path if path.exists() else None
+
+    def temp_path(self, suffix: str = ".tmp") -> str:
+        """A scratch path on the store's filesystem, so put_file can move rather than copy."""
+        return str(self.objects_dir / f"{uuid.uuid4().hex}{suffix}")
+
+    def put_file(self, accession: str, file_name: str, src_path) -> Path:
+        """Move a freshly downloaded file into the store, dropping it if the bytes are already stored."""
+        sha256 = file_sha256(src_path)
+        object_path = self._object_path(sha256, Path(file_name).suffix)
+        if object_path.exists():
+            logger.info(f"{accession} {file_name} has the same bytes as a stored document")
+            os.remove(src_path)
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src_path, object_path)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (accession, file_name, sha256, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (accession, file_name, sha256, object_path.stat().st_size, time.time()),
+            )
+            self.conn.commit()
+        return object_path
+
+    def view_path(self, form_dir: str, accession: str, file_name: str) -> Path:
+        """Where a document appears in a per-form-type view; unique because the accession is in the name."""
+        return self.root / form_dir / f"{accession}_{file_name}"
+
+    def link(self, object_path: Path, view_path: Path) -> Path:
+        """Hardlink a stored object into a view directory, copying if hardlinks are unavailable."""
+        view_path.parent.mkdir(parents=True, exist_ok=True)
+        if view_path.exists():
+            return view_path
+        try:
+            os.link(object_path, view_path)
+        except OSError:
+            shutil.copyfile(object_path, view_path)
+        return view_path
+
+    def close(self) -> None:
+        self.conn.close()
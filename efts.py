@@ -0,0 +1,233 @@
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from http_client import DEFAULT_USER_AGENT, RETRYABLE_ERRORS, create_session, timed_get
+from metrics import metrics
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# XHR endpoint the EDGAR full-text search page calls to fill its result table
+SEARCH_INDEX_PATH = "/LATEST/search-index"
+EFTS_BASE_URL = "https://efts.sec.gov"
+SEC_BASE_URL = "https://www.sec.gov"
+ARCHIVES_BASE_URL = "https://www.sec.gov/Archives/edgar/data"
+# Hits per result page, both in the search UI and in the JSON endpoint
+PAGE_SIZE = 100
+
+
+def is_search_response(response) -> bool:
+    return SEARCH_INDEX_PATH in response.url
+
+
+def _join(values, sep: str = " ") -> str:
+    """Join a list-or-scalar JSON field the way the result table renders it."""
+    if values is None:
+        return ""
+    if isinstance(values, (list, tuple)):
+        return sep.join(str(v).strip() for v in values if v is not None and str(v).strip())
+    return str(values).strip()
+
+
+def hit_to_row(hit: Dict) -> Dict:
+    """Convert one search-index hit into the row dict produced by _extract_document_metadata."""
+    source = hit.get("_source", {})
+    hit_id = hit.get("_id", "")
+    accession, _, file_name = hit_id.partition(":")
+
+    file_type = source.get("file_type") or source.get("form") or ""
+    description = source.get("file_description") or ""
+    form_file_name = f"{file_type} ({description})" if description else file_type
+
+    return {
+        "file_name": file_name or None,
+        "file_number": _join(source.get("file_num")),
+        "film_number": _join(source.get("film_num")),
+        "form_file_name": form_file_name.strip(),
+        "incorporate": _join(source.get("inc_states")),
+        "location": _join(source.get("biz_locations")),
+        "filed": _join(source.get("file_date")),
+        "end_date": _join(source.get("period_ending")),
+        "entity_name": _join(source.get("display_names")),
+        "cik_number": _join(source.get("ciks")),
+        "accession": source.get("adsh") or accession,
+    }
+
+
+def archive_url(row: Dict, archives_base: str = ARCHIVES_BASE_URL) -> Optional[str]:
+    """Build the Archives URL of a row's document from its CIK, accession number and file name."""
+    # The DOM cell may read "CIK 0000123456"; the JSON field is the bare number
+    ciks = [token for token in (row.get("cik_number") or "").replace("CIK", " ").split() if token.isdigit()]
+    accession = (row.get("accession") or "").replace("-", "")
+    file_name = row.get("file_name")
+    if not ciks or not accession or not file_name:
+        return None
+    return f"{archives_base.rstrip('/')}/{int(ciks[0])}/{accession}/{file_name}"
+
+
+def accession_from_url(file_url: str) -> Optional[Tuple[str, str]]:
+    """Split an Archives document URL into its dashed accession number and file name."""
+    parts = urlsplit(file_url or "").path.rstrip("/").split("/")
+    if len(parts) < 3 or not parts[-2].isdigit() or len(parts[-2]) != 18:
+        return None
+    accession = parts[-2]
+    return f"{accession[:10]}-{accession[10:12]}-{accession[12:]}", parts[-1]
+
+
+def rebase_url(url: str, base: str) -> str:
+    """Point a sec.gov URL at another host (e.g. the local fixture server), keeping path and fragment."""
+    parts = urlsplit(url)
+    base_parts = urlsplit(base)
+    return parts._replace(scheme=base_parts.scheme, netloc=base_parts.netloc).geturl()
+
+
+def rebase_url_groups(url_groups: Dict[str, List[str]], base: str) -> Dict[str, List[str]]:
+    if base.rstrip("/") == SEC_BASE_URL:
+        return url_groups
+    return {url_type: [rebase_url(url, base) for url in urls] for url_type, urls in url_groups.items()}
+
+
+def parse_search_payload(payload: Dict) -> List[Dict]:
+    """Build row dicts for every hit in a search-index JSON payload, in result-table order."""
+    hits = (payload or {}).get("hits", {}).get("hits", [])
+    return [hit_to_row(hit) for hit in hits]
+
+
+def total_hits(payload: Dict) -> int:
+    """Return the total match count reported by a search-index payload."""
+    total = (payload or {}).get("hits", {}).get("total", 0)
+    if isinstance(total, dict):
+        total = total.get("value", 0)
+    try:
+        return int(total)
+    except (TypeError, ValueError):
+        return 0
+
+
+class SearchResponseCapture:
+    """Keep the latest search-index response a page receives so rows can be read from its JSON."""
+
+    def __init__(self):
+        self._response = None
+        self._rows: Optional[List[Dict]] = None
+
+    def attach(self, page) -> None:
+        page.on("response", self._on_response)
+
+    def reset(self) -> None:
+        self._response = None
+        self._rows = None
+
+    @property
+    def status(self) -> Optional[int]:
+        return self._response.status if self._response is not None else None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return self._response.headers if self._response is not None else {}
+
+    def _on_response(self, response) -> None:
+        # Only keep a reference here; reading the body inside the event handler
+        # would block the sync dispatcher.
+        if is_search_response(response):
+            self._response = response
+            self._rows = None
+
+    def rows(self) -> Optional[List[Dict]]:
+        """Parse and return the captured rows, or None if nothing usable was captured."""
+        if self._rows is not None:
+            return self._rows
+        if self._response is None:
+            return None
+        try:
+            if not self._response.ok:
+                logger.warning(f"Search response returned status {self._response.status}")
+                return None
+            self._rows = parse_search_payload(self._response.json())
+        except Exception as e:
+            logger.warning(f"Failed to parse search response {self._response.url}: {e}")
+            return None
+        return self._rows
+
+
+def search_params_from_url(url: str) -> Dict[str, str]:
+    """Translate a hash-routed edgar/search/#/q=... URL into search-index query parameters."""
+    fragment = urlsplit(url).fragment.lstrip("/")
+    query = fragment or urlsplit(url).query
+    params = {key: values[-1] for key, values in parse_qs(query, keep_blank_values=True).items()}
+    if "filter_forms" in params:
+        params["forms"] = params.pop("filter_forms")
+    params.pop("page", None)
+    params.pop("from", None)
+    return params
+
+
+class EFTSClient:
+    """Browserless client for the EDGAR full-text search JSON endpoint."""
+
+    def __init__(self, base_url: str = EFTS_BASE_URL, archives_base: str = ARCHIVES_BASE_URL,
+                 user_agent: str = DEFAULT_USER_AGENT, timeout: float = 30,
+                 rate_limiter: Optional[RateLimiter] = None, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.archives_base = archives_base
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = session or self._create_session(user_agent)
+
+    @staticmethod
+    def _create_session(user_agent: str) -> requests.Session:
+        session = create_session(user_agent)
+        session.headers["Accept"] = "application/json"
+        return session
+
+    def search_page(self, params: Dict[str, str], offset: int = 0) -> Dict:
+        """Fetch one page of search-index results starting at the given hit offset."""
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                with metrics.span("search_request"):
+                    response = timed_get(self.session, f"{self.base_url}{SEARCH_INDEX_PATH}", self.rate_limiter,
+                                         self.timeout, params={**params, "from": offset})
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.rate_limiter.max_retries:
+                    raise
+                logger.warning(f"Search request at offset {offset} stalled ({e}), retrying")
+                metrics.inc("retries_total", status="timeout", form_type=params.get("forms"))
+                continue
+            if self.rate_limiter.record_response(response.status_code, response.headers, attempt,
+                                                 params.get("forms")) is None:
+                break
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, url: str, start_offset: int = 0) -> Iterator[Tuple[int, List[Dict]]]:
+        """Yield (offset, rows) for each result page of a search URL, paging by from= offset."""
+        return self.iter_search(search_params_from_url(url), start_offset)
+
+    def iter_search(self, params: Dict[str, str], start_offset: int = 0) -> Iterator[Tuple[int, List[Dict]]]:
+        """Same as iter_pages, for search-index parameters that were already parsed or adjusted."""
+        offset = start_offset
+        while True:
+            payload = self.search_page(params, offset)
+            rows = parse_search_payload(payload)
+            if not rows:
+                break
+            total = total_hits(payload)
+            logger.info(f"Fetched hits {offset + 1}-{offset + len(rows)} of {total} for {params.get('q')}")
+            for row in rows:
+                row["file_url"] = archive_url(row, self.archives_base)
+            yield offset, rows
+            offset += len(rows)
+            if offset >= total:
+                break
+
+    def iter_rows(self, url: str) -> Iterator[Dict]:
+        """Yield a row dict with its file_url for every hit of a search URL."""
+        for _, rows in self.iter_pages(url):
+            yield from rows
+
+    def close(self) -> None:
+        self.session.close()
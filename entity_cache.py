@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from sinks import _parse_ciks
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    cik INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    state_of_incorporation TEXT NOT NULL,
+    location TEXT NOT NULL,
+    source TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+# Rows per transaction when bulk loading submissions data
+LOAD_BATCH = 5000
+# Sources in order of trust: SEC's submissions data beats what a search result row says
+SOURCE_RANK = {"search": 0, "submissions": 1}
+
+# display_names in search results look like "EXXON MOBIL CORP  (XOM, XOM-P)  (CIK 0000034088)"
+NAME_SUFFIX = re.compile(r"\s*\((?:CIK\s*\d+|[A-Z0-9.,\- ]{1,30})\)\s*$")
+
+
+class Entity(NamedTuple):
+    cik: int
+    name: str
+    state_of_incorporation: str
+    location: str
+    source: str
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Entity name without the ticker and CIK suffixes the search UI appends, whitespace collapsed."""
+    name = " ".join((name or "").replace("<br>", " ").split())
+    previous = None
+    while name != previous:
+        previous = name
+        name = NAME_SUFFIX.sub("", name)
+    return name.strip()
+
+
+def normalize_state(state: Optional[str]) -> str:
+    return " ".join((state or "").replace("<br>", " ").split()).upper()
+
+
+def normalize_location(city: Optional[str], state: Optional[str] = None) -> str:
+    """'HOUSTON' + 'TX' or 'Houston,  tx' -> 'Houston, TX'."""
+    if state is None:
+        city, _, state = " ".join((city or "").replace("<br>", " ").split()).rpartition(",")
+        if not city:
+            city, state = state, ""
+    city = " ".join((city or "").split()).title()
+    state = normalize_state(state)
+    return ", ".join(part for part in (city, state) if part)
+
+
+def entity_from_submission(data: Dict) -> Optional[Entity]:
+    """Entity from one CIK##########.json document of SEC's submissions data."""
+    try:
+        cik = int(data["cik"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    business = (data.get("addresses") or {}).get("business") or {}
+    return Entity(cik, normalize_name(data.get("name")), normalize_state(data.get("stateOfIncorporation")),
+                  normalize_location(business.get("city"), business.get("stateOrCountry") or ""), "submissions")
+
+
+def iter_submissions(path) -> Iterator[Dict]:
+    """Yield the JSON documents of submissions.zip, a directory of CIK*.json files, or one file."""
+    path = Path(path)
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                # Paged "-submissions-001.json" files only hold older filings, not the entity header
+                if name.endswith(".json") and "-submissions-" not in name:
+                    yield json.loads(archive.read(name))
+    elif path.is_dir():
+        for file in sorted(path.glob("CIK*.json")):
+            if "-submissions-" not in file.name:
+                yield json.loads(file.read_text(encoding="utf-8"))
+    else:
+        yield json.loads(path.read_text(encoding="utf-8"))
+
+
+class EntityCache:
+    """Filer names, states of incorporation and business locations keyed by CIK.
+
+    Lookups are served from memory; the SQLite file keeps entities across runs and can
+    be filled in bulk from a local copy of SEC's submissions data (`load_submissions`).
+    CIKs missing from it are learned from the first search result row that mentions
+    them, so a crawl reads each filer's cells once.
+    """
+
+    def __init__(self, path: str = "entities.db"):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._entities: Dict[int, Entity] = {
+            row[0]: Entity(*row) for row in self.conn.execute(
+                "SELECT cik, name, state_of_incorporation, location, source FROM entities")
+        }
+        logger.info(f"Loaded {len(self._entities)} entities from {path}")
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def get(self, cik: int) -> Optional[Entity]:
+        return self._entities.get(cik)
+
+    def has_all(self, cik_text: Optional[str]) -> bool:
+        """True if every CIK in a row's CIK cell is cached, so its entity cells need not be read."""
+        ciks = _parse_ciks(cik_text)
+        return bool(ciks) and all(cik in self._entities for cik in ciks)
+
+    def put_many(self, entities: Iterable[Entity]) -> int:
+        """Store entities, keeping an existing entry that came from a more trusted source."""
+        count = 0
+        with self._lock:
+            batch: List[Entity] = []
+            for entity in entities:
+                current = self._entities.get(entity.cik)
+                if current is not None and SOURCE_RANK[current.source] > SOURCE_RANK[entity.source]:
+                    continue
+                self._entities[entity.cik] = entity
+                batch.append(entity)
+                if len(batch) >= LOAD_BATCH:
+                    count += self._write(batch)
+                    batch = []
+            count += self._write(batch)
+        return count
+
+    def _write(self, batch: List[Entity]) -> int:
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entities (cik, name, state_of_incorporation, location, source, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(*entity, now) for entity in batch],
+        )
+        self.conn.commit()
+        return len(batch)
+
+    def load_submissions(self, path) -> int:
+        """Bulk load submissions.zip (or a directory of its CIK*.json files)."""
+        entities = (entity_from_submission(data) for data in iter_submissions(path))
+        count = self.put_many(entity for entity in entities if entity is not None)
+        logger.info(f"Loaded {count} entities from {path}")
+        return count
+
+    def learn(self, details: Dict) -> None:
+        """Remember the entity of a single-filer search row whose CIK is not cached yet."""
+        ciks = _parse_ciks(details.get("cik_number"))
+        if len(ciks) != 1 or ciks[0] in self._entities:
+            return
+        self.put_many([Entity(ciks[0], normalize_name(details.get("entity_name")),
+                              normalize_state(details.get("incorporate")),
+                              normalize_location(details.get("location")), "search")])
+
+    def enrich(self, details: Dict) -> Dict:
+        """Replace a row's free-text entity columns with the cached values of its CIKs.
+
+        Multi-filer rows list every filer's value, separated by '; ', in CIK order.
+        """
+        self.learn(details)
+        if not self.has_all(details.get("cik_number")):
+            return details
+        entities = [self._entities[cik] for cik in _parse_ciks(details.get("cik_number"))]
+        enriched = dict(details)
+        enriched["entity_name"] = "; ".join(entity.name for entity in entities)
+        enriched["incorporate"] = "; ".join(entity.state_of_incorporation for entity in entities)
+        enriched["location"] = "; ".join(entity.location for entity in entities)
+        return enriched
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the CIK-keyed entity cache used to normalize manifests")
+    parser.add_argument("--db", default="entities.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="bulk load SEC submissions data")
+    load.add_argument("path", help="submissions.zip, a directory of its CIK*.json files, or one of them")
+    lookup = commands.add_parser("lookup", help="print the cached entity of CIKs")
+    lookup.add_argument("ciks", nargs="+", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cache = EntityCache(args.db)
+    try:
+        if args.command == "load":
+            cache.load_submissions(args.path)
+        else:
+            for cik in args.ciks:
+                entity = cache.get(cik)
+                print(f"{cik:010d}  {entity.name} | {entity.state_of_incorporation} | {entity.location} "
+                      f"({entity.source})" if entity else f"{cik:010d}  not cached")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
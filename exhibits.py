@@ -0,0 +1,303 @@
+import argparse
+import fnmatch
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+from urllib.parse import urljoin, urlsplit
+
+import http_cache
+from doc_store import DocumentStore
+from efts import accession_from_url
+from http_client import RETRYABLE_ERRORS, create_session, stream_to_file, timed_get
+from metrics import metrics
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from sec_doc import add_to_store, create_directories, fieldnames, resolve_from_store
+from sinks import OUTPUT_FORMATS, create_sink, output_path, read_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TYPES = ("EX-99*",)
+DEFAULT_EXTENSIONS = (".htm", ".html", ".txt", ".pdf")
+# Child rows name their parent filing's document and their own type from the filing index
+EXPANDED_FIELDNAMES = fieldnames + ['parent_file_url', 'document_type']
+# document_type of the failed child row written for a filing whose index could not be read
+FAILED_INDEX_TYPE = "filing-index"
+
+
+class FilingDocument(NamedTuple):
+    file_name: str
+    url: str
+    document_type: str
+    description: str
+
+
+class _IndexTableParser(HTMLParser):
+    """Reads the 'Document Format Files' table of a filing's -index.htm page."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[Dict] = []
+        self._in_table = False
+        self._row: Optional[Dict] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "table" and attrs.get("summary") == "Document Format Files":
+            self._in_table = True
+        elif self._in_table and tag == "tr":
+            self._row = {"cells": [], "href": None}
+        elif self._row is not None and tag == "td":
+            self._cell = []
+        elif self._row is not None and tag == "a" and self._row["href"] is None:
+            self._row["href"] = attrs.get("href")
+
+    def handle_endtag(self, tag):
+        if tag == "table" and self._in_table:
+            self._in_table = False
+        elif tag == "td" and self._cell is not None:
+            self._row["cells"].append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if self._row["cells"] and self._row["href"]:
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def filing_index_url(file_url: str) -> Optional[str]:
+    """URL of the -index.htm page of the filing a document belongs to."""
+    key = accession_from_url(file_url)
+    if key is None:
+        return None
+    return urljoin(file_url, f"{key[0]}-index.htm")
+
+
+def parse_filing_index(html: str, index_url: str) -> List[FilingDocument]:
+    """Documents listed in a filing index page: (file name, URL, type such as EX-99.1, description)."""
+    parser = _IndexTableParser()
+    parser.feed(html)
+    documents = []
+    for row in parser.rows:
+        # Columns are Seq, Description, Document, Type, Size; inline XBRL links go through /ix?doc=
+        cells = row["cells"] + [""] * (5 - len(row["cells"]))
+        href = row["href"].split("doc=", 1)[-1]
+        url = urljoin(index_url, href)
+        file_name = urlsplit(url).path.rsplit("/", 1)[-1]
+        documents.append(FilingDocument(file_name, url, cells[3].upper(), cells[1]))
+    return documents
+
+
+class ExhibitFilter:
+    """Allowlist of document types (shell patterns, e.g. EX-99*) and file extensions."""
+
+    def __init__(self, types: Sequence[str] = DEFAULT_TYPES, extensions: Sequence[str] = DEFAULT_EXTENSIONS):
+        self.types = [pattern.upper() for pattern in types]
+        self.extensions = tuple(extension.lower() for extension in extensions)
+
+    def __call__(self, document: FilingDocument) -> bool:
+        return (document.file_name.lower().endswith(self.extensions)
+                and any(fnmatch.fnmatchcase(document.document_type, pattern) for pattern in self.types))
+
+
+class ExhibitExpander:
+    """Adds the exhibits of every filing in a manifest as child rows of its parent document.
+
+    Each filing's index page is fetched once, however many manifest rows point into it;
+    its documents are filtered through an ExhibitFilter and the selected files are
+    downloaded by a thread pool that shares one RateLimiter with the index fetches.
+    """
+
+    def __init__(self, document_filter: Optional[ExhibitFilter] = None, concurrency: int = 4,
+                 rate_limiter: Optional[RateLimiter] = None, store: Optional[DocumentStore] = None,
+                 parent_dir: str = "sec_gov"):
+        self.document_filter = document_filter or ExhibitFilter()
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.store = store
+        self.parent_dir = parent_dir
+        self.session = create_session(pool_size=self.concurrency)
+        self._seen_filings = set()
+        self._lock = threading.Lock()
+
+    def fetch_index(self, index_url: str, form_type: Optional[str] = None) -> List[FilingDocument]:
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if not http_cache.served_offline(index_url):
+                self.rate_limiter.wait()
+            try:
+                with metrics.span("filing_index"):
+                    response = timed_get(self.session, index_url, self.rate_limiter, 60)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.rate_limiter.max_retries:
+                    raise
+                logger.warning(f"Fetching {index_url} stalled ({e}), retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                continue
+            if self.rate_limiter.record_response(response.status_code, response.headers, attempt, form_type) is None:
+                break
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to load filing index {index_url}: Status Code {response.status_code}")
+        return parse_filing_index(response.text, index_url)
+
+    def select(self, parent: Dict) -> List[Dict]:
+        """Child rows (without file_path) for the allowlisted documents of a parent row's filing."""
+        index_url = filing_index_url(parent.get('file_url') or "")
+        if index_url is None:
+            return []
+        with self._lock:
+            if index_url in self._seen_filings:
+                return []
+            self._seen_filings.add(index_url)
+        parent_name = urlsplit(parent['file_url']).path.rsplit("/", 1)[-1]
+        try:
+            documents = self.fetch_index(index_url, parent.get('form_file_name'))
+        except Exception:
+            with self._lock:
+                # Another document of the same filing may still get its exhibits
+                self._seen_filings.discard(index_url)
+            raise
+        children = []
+        for document in documents:
+            if document.file_name == parent_name or not self.document_filter(document):
+                continue
+            child = dict(parent)
+            child.update(file_url=document.url, file_path='', parent_file_url=parent['file_url'],
+                         document_type=document.document_type)
+            children.append(child)
+        logger.info(f"{index_url}: {len(children)} exhibits selected")
+        return children
+
+    def save_path(self, child: Dict) -> str:
+        """Exhibits sit next to their filing's documents, named after accession and file name."""
+        form_type_dir, _ = create_directories(child['form_file_name'], self.parent_dir)
+        accession, file_name = accession_from_url(child['file_url'])
+        return os.path.join(form_type_dir, f"{accession}_{file_name}")
+
+    def download(self, child: Dict) -> Dict:
+        stored = resolve_from_store(self.store, child)
+        if stored:
+            child['file_path'] = stored
+        elif self.store is not None:
+            tmp_path = self.store.temp_path()
+            if stream_to_file(self.session, child['file_url'], tmp_path, self.rate_limiter,
+                              form_type=child['form_file_name']):
+                child['file_path'] = add_to_store(self.store, child, tmp_path)
+            else:
+                child['file_path'] = 'Failed to download'
+        else:
+            save_path = self.save_path(child)
+            if os.path.exists(save_path):
+                child['file_path'] = save_path
+            elif stream_to_file(self.session, child['file_url'], save_path, self.rate_limiter,
+                                form_type=child['form_file_name']):
+                child['file_path'] = save_path
+            else:
+                child['file_path'] = 'Failed to download'
+        if child['file_path'] == 'Failed to download':
+            metrics.inc("failures_total", form_type=child.get('form_file_name'), stage="exhibit")
+        else:
+            metrics.document_done(child.get('form_file_name'), kind="exhibits")
+        return child
+
+    def expand(self, parents: Iterable[Dict], sink) -> int:
+        """Write each parent row followed, as its downloads finish, by its exhibits' child rows.
+
+        A parent's downloads are submitted as soon as its filing index is read. A filing
+        whose index cannot be read gets one failed child row (document_type
+        FAILED_INDEX_TYPE, pointing at the index) instead of ending the expansion.
+        """
+        count = 0
+        completed = queue.Queue()
+        selections = {}
+        downloads = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            def submit(fn, row):
+                future = executor.submit(fn, row)
+                future.add_done_callback(completed.put)
+                return future
+
+            for parent in parents:
+                parent.setdefault('parent_file_url', '')
+                parent.setdefault('document_type', '')
+                sink.write(parent)
+                selections[submit(self.select, parent)] = parent
+            while selections or downloads:
+                future = completed.get()
+                if future in selections:
+                    parent = selections.pop(future)
+                    try:
+                        children = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to select the exhibits of {parent['file_url']}: {e}")
+                        metrics.inc("failures_total", form_type=parent.get('form_file_name'), stage="filing_index")
+                        failed = dict(parent)
+                        failed.update(file_url=filing_index_url(parent['file_url']), file_path='Failed to download',
+                                      parent_file_url=parent['file_url'], document_type=FAILED_INDEX_TYPE)
+                        sink.write(failed)
+                        continue
+                    for child in children:
+                        downloads[submit(self.download, child)] = child
+                else:
+                    child = downloads.pop(future)
+                    try:
+                        child = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to download {child['file_url']}: {e}")
+                        metrics.inc("failures_total", form_type=child.get('form_file_name'), stage="exhibit")
+                        child['file_path'] = 'Failed to download'
+                    sink.write(child)
+                    count += 1
+        return count
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the exhibits of each filing in a manifest as child rows")
+    parser.add_argument("--input", default="Updated_Master_file.csv", help="manifest of parent documents")
+    parser.add_argument("--output", default="Expanded_Master_file.csv",
+                        help="parent rows plus one child row per downloaded exhibit")
+    parser.add_argument("--types", nargs="+", default=list(DEFAULT_TYPES),
+                        help="document types to keep, as shell patterns (e.g. 'EX-99*' 'EX-10.1')")
+    parser.add_argument("--extensions", nargs="+", default=list(DEFAULT_EXTENSIONS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="ceiling on requests per second shared by index fetches and downloads")
+    parser.add_argument("--store", action="store_true", help="keep exhibits in the deduplicated document store")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None)
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically export stage timings and counters (.prom for Prometheus, else JSON)")
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; filing indexes and exhibits are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
+
+    output_file = output_path(args.output, args.output_format) if args.output_format else args.output
+    sink = create_sink(output_file, EXPANDED_FIELDNAMES, args.output_format, truncate=True)
+    store = DocumentStore("sec_gov") if args.store else None
+    expander = ExhibitExpander(ExhibitFilter(args.types, args.extensions), args.concurrency,
+                               RateLimiter(args.rate), store)
+    try:
+        with metrics.exporting(args.metrics_file):
+            parents = [row for row in read_rows(args.input) if row.get('file_url')]
+            count = expander.expand(parents, sink)
+        logger.info(f"Added {count} exhibit rows for {len(parents)} documents to {sink.path}")
+    finally:
+        sink.close()
+        expander.close()
+        if store:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from efts import PAGE_SIZE, SEARCH_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+# What EDGAR serves to a client that exceeded the fair-access rate; see rate_limit.LOCKOUT_MARKERS
+LOCKOUT_PAGE = b"<html><body><h1>Request Rate Threshold Exceeded</h1></body></html>"
+
+# The search UI the scrapers drive. It reproduces the DOM contract of the real page:
+# the column checkboxes, th#filetype, one row per hit with a.preview-file[data-file-name],
+# td.file-num / td.film-num and the other metadata cells, the preview modal with
+# a#open-file and its "Open document" button, and &page=N pagination through the hash.
+SEARCH_PAGE = """<!DOCTYPE html>
+<html><head><title>EDGAR Full Text Search (fixture)</title>
+<style>#preview{display:none}#preview.open{display:block}</style></head>
+<body>
+<div id="columns">
+  <label><input type="checkbox" id="col-cik"> CIK</label>
+  <label><input type="checkbox" id="col-located"> Located</label>
+  <label><input type="checkbox" id="col-incorporated"> Incorporated</label>
+  <label><input type="checkbox" id="col-file-num"> File number</label>
+  <label><input type="checkbox" id="col-film-num"> Film number</label>
+  <label><input type="checkbox" id="col-filed" checked> Filed</label>
+</div>
+<div id="hits"></div>
+<div id="preview">
+  <a id="open-file" href="#">Open file</a>
+  <button class="btn btn-warning" id="open-document">Open document</button>
+  <button id="close-modal">Close</button>
+</div>
+<script>
+function params() {
+  var query = location.hash.replace(/^#\\/?/, "");
+  var out = new URLSearchParams(query);
+  var page = parseInt(out.get("page") || "1", 10);
+  out.delete("page");
+  if (out.has("filter_forms")) { out.set("forms", out.get("filter_forms")); out.delete("filter_forms"); }
+  out.set("from", String((page - 1) * %(page_size)d));
+  return out;
+}
+function cell(cls, html) { return '<td class="' + cls + '">' + html + '</td>'; }
+function render(payload) {
+  var hits = payload.hits.hits;
+  var target = document.getElementById("hits");
+  if (!hits.length) { target.innerHTML = "<p>No results found.</p>"; return; }
+  var rows = hits.map(function (hit) {
+    var s = hit._source, parts = hit._id.split(":");
+    var url = "/Archives/edgar/data/" + parseInt(s.ciks[0], 10) + "/" + s.adsh.replace(/-/g, "") + "/" + parts[1];
+    return "<tr>" +
+      cell("filetype", '<a class="preview-file" href="#" data-file-name="' + parts[1] + '" data-adsh="' + s.adsh +
+           '" data-url="' + url + '">' + s.file_type + " (" + s.file_description + ")</a>") +
+      cell("filed", s.file_date) + cell("enddate", s.period_ending) +
+      cell("entity-name", s.display_names.join("<br>")) + cell("cik", "CIK " + s.ciks.join(" ")) +
+      cell("biz-location located", s.biz_locations.join("<br>")) +
+      cell("incorporated", s.inc_states.join("<br>")) +
+      cell("file-num", s.file_num.map(function (n) { return "<a>" + n + "</a>"; }).join(" ")) +
+      cell("film-num", s.film_num.join("<br>")) + "</tr>";
+  });
+  target.innerHTML = '<table><thead><tr><th id="filetype" class="filetype" style="">Form &amp; File</th>' +
+    "<th>Filed</th><th>Reporting for</th><th>Filing entity/person</th><th>CIK</th><th>Located</th>" +
+    "<th>Incorporated</th><th>File number</th><th>Film number</th></tr></thead><tbody>" +
+    rows.join("") + "</tbody></table>";
+  Array.prototype.forEach.call(document.querySelectorAll("a.preview-file"), function (link) {
+    link.addEventListener("click", function (event) {
+      event.preventDefault();
+      document.getElementById("open-file").href = link.dataset.url;
+      document.getElementById("preview").className = "open";
+    });
+  });
+}
+function load() {
+  fetch("%(search_path)s?" + params().toString()).then(function (r) {
+    if (!r.ok) { document.getElementById("hits").innerHTML = "<p>Error " + r.status + "</p>"; return null; }
+    return r.json();
+  }).then(function (payload) { if (payload) render(payload); });
+}
+document.getElementById("open-document").addEventListener("click", function () {
+  window.open(document.getElementById("open-file").href);
+});
+document.getElementById("close-modal").addEventListener("click", function () {
+  document.getElementById("preview").className = "";
+});
+window.addEventListener("hashchange", load);
+load();
+</script>
+</body></html>
+""" % {"page_size": PAGE_SIZE, "search_path": SEARCH_INDEX_PATH}
+
+FORM_DESCRIPTIONS = {"8-K": "Current report", "10-K": "Annual report", "10-Q": "Quarterly report"}
+STATES = ["DE", "TX", "NV", "CA", "NY", "OK", "CO"]
+DAILY_INDEX_PREFIX = "/Archives/edgar/daily-index/"
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()[:12], 16)
+
+
+def synthetic_hit(query: str, forms: str, index: int) -> Dict:
+    """A deterministic search-index hit; the same query and index always describe the same filing."""
+    rng = random.Random(_seed(query, forms, index))
+    form = (forms.split(",")[0] if forms else "8-K") or "8-K"
+    cik = rng.randint(1000, 1999999)
+    accession = f"{cik:010d}-24-{index:06d}"
+    filers = 2 if rng.random() < 0.1 else 1
+    return {
+        "_id": f"{accession}:doc{index}.htm",
+        "_source": {
+            "ciks": [f"{cik + n:010d}" for n in range(filers)],
+            "display_names": [f"Synthetic Energy {cik + n} Inc (CIK {cik + n:010d})" for n in range(filers)],
+            "file_num": [f"001-{rng.randint(10000, 99999)}" for _ in range(filers)],
+            "film_num": [str(rng.randint(24000000, 24999999)) for _ in range(filers)],
+            "file_type": form,
+            "file_description": FORM_DESCRIPTIONS.get(form, form),
+            "inc_states": [rng.choice(STATES)],
+            "biz_locations": [f"Houston, {rng.choice(STATES)}"],
+            "file_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "period_ending": f"2024-{rng.randint(1, 12):02d}-28",
+            "adsh": accession,
+        },
+    }
+
+
+def synthetic_document(path: str, size: int) -> bytes:
+    """An HTML filing of roughly `size` bytes whose text is stable for a given path."""
+    rng = random.Random(_seed(path))
+    words = ["oil", "gas", "revenue", "barrels", "drilling", "pipeline", "quarter", "reserves", "operating", "net"]
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = "<p>" + " ".join(rng.choice(words) for _ in range(80)) + "</p>\n"
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    return f"<html><head><title>{path}</title></head><body>\n{''.join(paragraphs)}</body></html>".encode()
+
+
+def synthetic_form_index(day: date, filings: int) -> bytes:
+    """A day's form.YYYYMMDD.idx: a fixed-width table of that day's filings, the same on every request."""
+    rng = random.Random(_seed("daily-index", day.isoformat()))
+    lines = ["Description:           Daily Index of EDGAR Dissemination Feed by Form Type",
+             f"Last Data Received:    {day:%B %d, %Y}", "",
+             f"{'Form Type':<12}{'Company Name':<62}{'CIK':<12}{'Date Filed':<12}File Name",
+             "-" * 138]
+    for index in range(filings):
+        form = rng.choice(list(FORM_DESCRIPTIONS))
+        cik = rng.randint(1000, 1999999)
+        accession = f"{cik:010d}-{day:%y}-{day.timetuple().tm_yday * 1000 + index:06d}"
+        lines.append(f"{form:<12}{f'Synthetic Energy {cik} Inc':<62}{cik:<12}{day:%Y%m%d}    "
+                     f"edgar/data/{cik}/{accession}.txt")
+    return ("\n".join(lines) + "\n").encode("latin-1")
+
+
+def daily_index_day(path: str) -> Optional[date]:
+    """The weekday a daily-index path asks for; None for weekends, which have no index, and other files."""
+    name = path.rsplit("/", 1)[-1]
+    if not (name.startswith("form.") and name.endswith(".idx")):
+        return None
+    try:
+        day = date(int(name[5:9]), int(name[9:11]), int(name[11:13]))
+    except ValueError:
+        return None
+    return day if day.weekday() < 5 else None
+
+
+def synthetic_filing_index(path: str) -> bytes:
+    """The -index.htm page of a synthetic filing: its primary document, two exhibits and the submission text."""
+    folder = path.rsplit("/", 1)[0]
+    accession = path.rsplit("/", 1)[1][:-len("-index.htm")]
+    documents = [
+        ("1", "Current report", f"doc{int(accession[-6:])}.htm", "8-K"),
+        ("2", "Press release", "ex99-1.htm", "EX-99.1"),
+        ("3", "Material contract", "ex10-1.htm", "EX-10.1"),
+        ("", "Complete submission text file", f"{accession}.txt", ""),
+    ]
+    rows = "".join(f'<tr><td>{seq}</td><td>{description}</td><td><a href="{folder}/{name}">{name}</a></td>'
+                   f'<td>{doc_type}</td><td>1000</td></tr>' for seq, description, name, doc_type in documents)
+    return (f'<html><body><table class="tableFile" summary="Document Format Files">'
+            f'<tr><th>Seq</th><th>Description</th><th>Document</th><th>Type</th><th>Size</th></tr>{rows}'
+            f'</table></body></html>').encode()
+
+
+class FixtureConfig:
+    """Knobs of the stand-in server: result volume, document size, latency and injected throttling."""
+
+    def __init__(self, hits_per_query: int = 250, document_size: int = 20000, latency_ms: float = 0.0,
+                 latency_jitter_ms: float = 0.0, throttle_rate: float = 0.0, lockout_rate: float = 0.0,
+                 retry_after: Optional[int] = 1, seed: int = 0, filings_per_day: int = 30):
+        self.hits_per_query = hits_per_query
+        self.filings_per_day = filings_per_day
+        self.document_size = document_size
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        # Fraction of requests answered with 429 (with Retry-After), and with a 403 lockout page
+        self.throttle_rate = throttle_rate
+        self.lockout_rate = lockout_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def draw(self) -> Tuple[float, float]:
+        with self.lock:
+            return self.random.random(), self.random.gauss(0, 1)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = "EDGARFixture/1.0"
+    config: FixtureConfig = FixtureConfig()
+
+    def log_message(self, format, *args) -> None:
+        logger.debug(format % args)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _inject(self) -> bool:
+        """Apply latency and maybe answer with a throttle; returns True if the request was consumed."""
+        config = self.config
+        chance, noise = config.draw()
+        delay = max(0.0, config.latency_ms + noise * config.latency_jitter_ms) / 1000
+        if delay:
+            time.sleep(delay)
+        if chance < config.lockout_rate:
+            config.count("lockout")
+            self._send(403, LOCKOUT_PAGE, "text/html")
+            return True
+        if chance < config.lockout_rate + config.throttle_rate:
+            config.count("throttled")
+            headers = {"Retry-After": str(config.retry_after)} if config.retry_after is not None else {}
+            self._send(429, b"Too Many Requests", "text/plain", headers)
+            return True
+        return False
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path.rstrip("/") == "/edgar/search":
+            # The UI shell itself is static and never throttled; its XHR is
+            self.config.count("search_ui")
+            self._send(200, SEARCH_PAGE.encode(), "text/html; charset=utf-8")
+        elif parts.path == SEARCH_INDEX_PATH:
+            if not self._inject():
+                self.config.count("search_index")
+                self._send(200, self._search_payload(parse_qs(parts.query)), "application/json")
+        elif parts.path.startswith(DAILY_INDEX_PREFIX):
+            day = daily_index_day(parts.path)
+            if day is None:
+                self._send(404, b"Not found", "text/plain")
+            elif not self._inject():
+                self.config.count("daily_index")
+                self._send(200, synthetic_form_index(day, self.config.filings_per_day), "text/plain")
+        elif parts.path.startswith("/Archives/edgar/data/") and parts.path.endswith("-index.htm"):
+            if not self._inject():
+                self.config.count("filing_index")
+                self._send(200, synthetic_filing_index(parts.path), "text/html; charset=utf-8")
+        elif parts.path.startswith("/Archives/edgar/data/"):
+            if not self._inject():
+                self.config.count("document")
+                self._send(200, synthetic_document(parts.path, self.config.document_size), "text/html; charset=utf-8")
+        else:
+            self._send(404, b"Not found", "text/plain")
+
+    def _search_payload(self, query: Dict[str, List[str]]) -> bytes:
+        q = query.get("q", [""])[-1]
+        forms = query.get("forms", [""])[-1]
+        start = int(query.get("from", ["0"])[-1] or 0)
+        total = self.config.hits_per_query
+        hits = [synthetic_hit(q, forms, index) for index in range(start, min(start + PAGE_SIZE, total))]
+        return json.dumps({"hits": {"total": {"value": total, "relation": "eq"}, "hits": hits}}).encode()
+
+
+def start_server(config: Optional[FixtureConfig] = None, host: str = "127.0.0.1",
+                 port: int = 0) -> ThreadingHTTPServer:
+    """Serve the fixture from a daemon thread; the bound URL is http://host:server.server_port."""
+    handler = type("ConfiguredFixtureHandler", (FixtureHandler,), {"config": config or FixtureConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fixture-server", daemon=True).start()
+    logger.info(f"Fixture EDGAR listening on http://{host}:{server.server_port}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for EDGAR full-text search, daily indexes "
+                                                 "and Archives")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--hits", type=int, default=250, help="results per query")
+    parser.add_argument("--filings-per-day", type=int, default=30, help="filings listed in each weekday's daily index")
+    parser.add_argument("--document-size", type=int, default=20000, help="bytes per synthetic filing")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--lockout-rate", type=float, default=0.0,
+                        help="fraction of requests answered with the 403 rate-threshold page")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = FixtureConfig(args.hits, args.document_size, args.latency_ms, args.jitter_ms,
+                           args.throttle_rate, args.lockout_rate, filings_per_day=args.filings_per_day)
+    server = start_server(config, port=args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF text extraction is optional
+    PdfReader = None
+
+from efts import accession_from_url
+from sinks import _parse_ciks, read_rows
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL UNIQUE,
+    file_url TEXT,
+    accession TEXT,
+    cik INTEGER,
+    form_type TEXT,
+    form_file_name TEXT,
+    filed TEXT,
+    entity_name TEXT,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_cik ON documents (cik);
+DROP INDEX IF EXISTS documents_form_filed;
+CREATE INDEX IF NOT EXISTS documents_form_file_name_filed ON documents (form_file_name, filed);
+CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5(body, tokenize = 'porter unicode61');
+"""
+TEXT_SUFFIXES = (".htm", ".html", ".xml", ".txt")
+# Rows are committed in batches so an interrupted run keeps most of its work
+COMMIT_EVERY = 200
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML filing, skipping scripts, styles and inline XBRL headers."""
+
+    SKIPPED = {"script", "style", "head", "ix:header"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping and data.strip():
+            self.parts.append(data.strip())
+
+
+def html_text(raw: str) -> str:
+    extractor = _TextExtractor()
+    extractor.feed(raw)
+    extractor.close()
+    return " ".join(extractor.parts)
+
+
+def pdf_text(path: str) -> str:
+    """Text of a PDF; runs in a worker process because parsing large filings is CPU bound."""
+    if PdfReader is None:
+        raise ImportError("Indexing PDFs requires pypdf (pip install pypdf)")
+    reader = PdfReader(path)
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def extract_text(path: Path) -> str:
+    raw = path.read_text(encoding="utf-8", errors="replace")
+    if path.suffix.lower() == ".txt" and "<html" not in raw[:4096].lower():
+        return raw
+    return html_text(raw)
+
+
+class FullTextIndex:
+    """SQLite FTS5 index over the downloaded corpus, joined with the manifest's metadata columns.
+
+    `index_manifest` reads an updated manifest (the one sec_doc.py writes, with file_path)
+    and indexes every document whose size or mtime changed since it was last indexed, so
+    rerunning it after each download run only touches new documents. `search` ranks
+    matches with BM25 and can filter on form type, CIK and filed date. The form filter
+    matches the short code in form_file_name (e.g. 10-K); the manifest's form_type
+    column holds SEC's description of the form ("10-K (Annual report)").
+    """
+
+    def __init__(self, db_path: str = "sec_fulltext.db"):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def _is_current(self, file_path: str, stat: os.stat_result) -> bool:
+        row = self.conn.execute(
+            "SELECT size, mtime FROM documents WHERE file_path = ?", (file_path,)
+        ).fetchone()
+        return row is not None and row["size"] == stat.st_size and row["mtime"] == stat.st_mtime
+
+    def _upsert(self, row: Dict, stat: os.stat_result, text: str) -> None:
+        file_path = row["file_path"]
+        old = self.conn.execute("SELECT id FROM documents WHERE file_path = ?", (file_path,)).fetchone()
+        if old:
+            self.conn.execute("DELETE FROM document_text WHERE rowid = ?", (old["id"],))
+            self.conn.execute("DELETE FROM documents WHERE id = ?", (old["id"],))
+        key = accession_from_url(row.get("file_url") or "")
+        ciks = _parse_ciks(row.get("cik"))
+        cursor = self.conn.execute(
+            """INSERT INTO documents (file_path, file_url, accession, cik, form_type, form_file_name, filed,
+                                      entity_name, size, mtime, indexed_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (file_path, row.get("file_url"), key[0] if key else None, ciks[0] if ciks else None,
+             row.get("form_type"), row.get("form_file_name"), row.get("filed"), row.get("filing_entity_person"),
+             stat.st_size, stat.st_mtime, time.time()),
+        )
+        self.conn.execute("INSERT INTO document_text (rowid, body) VALUES (?, ?)", (cursor.lastrowid, text))
+
+    def _pending(self, rows: Iterable[Dict]) -> Iterable[Tuple[Dict, os.stat_result]]:
+        for row in rows:
+            file_path = row.get("file_path") or ""
+            path = Path(file_path)
+            if not file_path or not path.is_file():
+                continue
+            stat = path.stat()
+            if not self._is_current(file_path, stat):
+                yield row, stat
+
+    def index_manifest(self, manifest, workers: Optional[int] = None) -> int:
+        """Index new and changed documents listed in a manifest; returns how many were indexed."""
+        pending = list(self._pending(read_rows(manifest)))
+        text_rows = [(row, stat) for row, stat in pending if Path(row["file_path"]).suffix.lower() in TEXT_SUFFIXES]
+        pdf_rows = [(row, stat) for row, stat in pending if Path(row["file_path"]).suffix.lower() == ".pdf"]
+        indexed = 0
+
+        for row, stat in text_rows:
+            try:
+                self._upsert(row, stat, extract_text(Path(row["file_path"])))
+                indexed += 1
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to index {row['file_path']}: {e}")
+            if indexed % COMMIT_EVERY == 0:
+                self.conn.commit()
+        self.conn.commit()
+
+        if pdf_rows and PdfReader is None:
+            logger.warning(f"Skipping {len(pdf_rows)} PDFs: indexing PDFs requires pypdf (pip install pypdf)")
+        elif pdf_rows:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(pdf_text, row["file_path"]) for row, _ in pdf_rows]
+                for (row, stat), future in zip(pdf_rows, futures):
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to extract text from {row['file_path']}: {e}")
+                        continue
+                    self._upsert(row, stat, text)
+                    indexed += 1
+                    if indexed % COMMIT_EVERY == 0:
+                        self.conn.commit()
+            self.conn.commit()
+        logger.info(f"Indexed {indexed} documents from {manifest}; {len(pending) - indexed} skipped or failed")
+        return indexed
+
+    def search(self, query: str, form_type: Optional[str] = None, cik: Optional[int] = None,
+               filed_from: Optional[str] = None, filed_to: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """Return the best matching documents for an FTS5 query, most relevant first."""
+        sql = """SELECT d.file_path, d.file_url, d.accession, d.cik, d.form_type, d.form_file_name, d.filed,
+                        d.entity_name,
+                        snippet(document_text, 0, '[', ']', ' ... ', 12) AS snippet,
+                        bm25(document_text) AS score
+                 FROM document_text JOIN documents d ON d.id = document_text.rowid
+                 WHERE document_text MATCH ?"""
+        params: List = [query]
+        if form_type:
+            sql += " AND d.form_file_name = ?"
+            params.append(form_type)
+        if cik is not None:
+            sql += " AND d.cik = ?"
+            params.append(cik)
+        if filed_from:
+            sql += " AND d.filed >= ?"
+            params.append(filed_from)
+        if filed_to:
+            sql += " AND d.filed <= ?"
+            params.append(filed_to)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index downloaded filings for local full-text search")
+    parser.add_argument("--db", default="sec_fulltext.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="index new or changed documents listed in a manifest")
+    index.add_argument("--manifest", default="Updated_Master_file.csv")
+    index.add_argument("--workers", type=int, default=None, help="processes extracting PDF text")
+    search = commands.add_parser("search", help="query the index")
+    search.add_argument("query", help="FTS5 query, e.g. 'crude NEAR(pipeline spill)' or '\"oil spill\"'")
+    search.add_argument("--form", default=None, help="form code as in URL_GROUPS, e.g. 10-K")
+    search.add_argument("--cik", type=int, default=None)
+    search.add_argument("--since", default=None, help="earliest filed date (YYYY-MM-DD)")
+    search.add_argument("--until", default=None, help="latest filed date (YYYY-MM-DD)")
+    search.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fts = FullTextIndex(args.db)
+    try:
+        if args.command == "index":
+            fts.index_manifest(args.manifest, args.workers)
+        else:
+            started = time.perf_counter()
+            results = fts.search(args.query, args.form, args.cik, args.since, args.until, args.limit)
+            for result in results:
+                print(f"{result['filed']}  {result['form_file_name']:<6} {result['cik'] or '':>10}  "
+                      f"{result['entity_name']}\n    {result['file_path']}\n    {result['snippet']}")
+            print(f"{len(results)} results in {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        fts.close()
+
+
+if __name__ == "__main__":
+    main()
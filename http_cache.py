@@ -0,0 +1,383 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".http_cache"
+DEFAULT_MAX_MB = 2048
+# Documents under an accession folder never change once filed
+IMMUTABLE_URL = re.compile(r"/Archives/edgar/data/\d+/\d{18}/[^/]+$")
+# Requests a browser context sends through the cache: documents and full-text search results
+BROWSER_CACHED_URLS = re.compile(r"/Archives/edgar/data/|/LATEST/search-index")
+# Headers replayed with a cached body; hop-by-hop and length headers are recomputed
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    immutable INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+def is_immutable(url: str) -> bool:
+    return bool(IMMUTABLE_URL.search(url.split("?", 1)[0].split("#", 1)[0]))
+
+
+class HTTPCache:
+    """On-disk response cache keyed by URL, bounded by size with least-recently-used eviction.
+
+    Archives documents (anything inside an accession folder) are immutable, so a cached
+    copy is served with no network call at all. Other responses, such as search results,
+    are kept only when they carry an ETag or Last-Modified and are revalidated with
+    If-None-Match / If-Modified-Since; a 304 replays the cached body.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(str(self.root / "index.db"), timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        # Download threads and Playwright's route handlers share the cache
+        self._lock = threading.Lock()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def _body_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _count(self, result: str) -> None:
+        setattr(self, result, getattr(self, result) + 1)
+        metrics.inc("http_cache_total", result=result)
+
+    def lookup(self, url: str, as_file: bool = False) -> Optional[Tuple[Dict[str, str], Union[bytes, BinaryIO], bool]]:
+        """Return (headers, body, immutable) of a cached response, or None.
+
+        With as_file the body is an open binary file instead of bytes, for streaming callers.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT digest, headers, immutable FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                path = self._body_path(row[0])
+                body = open(path, "rb") if as_file else path.read_bytes()
+            except OSError:
+                self._delete(url, row[0])
+                return None
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+        return json.loads(row[1]), body, bool(row[2])
+
+    def has_immutable(self, url: str) -> bool:
+        """True if a request for url will be answered from disk without touching the network."""
+        if not is_immutable(url):
+            return False
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM responses WHERE url = ?", (url,)).fetchone() is not None
+
+    def cacheable(self, url: str, headers) -> bool:
+        if not is_immutable(url) and not (headers.get("ETag") or headers.get("Last-Modified")):
+            return False  # Could never be revalidated, so caching it would only serve stale data
+        length = headers.get("Content-Length")
+        return not (length and length.isdigit() and int(length) > self.max_bytes)
+
+    def temp_path(self, url: str) -> Path:
+        """Scratch file next to url's body, for store_file to move into place."""
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        path = self._body_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f".{digest}.{uuid.uuid4().hex}.tmp")
+
+    def store(self, url: str, headers, body: bytes) -> None:
+        if not self.cacheable(url, headers) or len(body) > self.max_bytes:
+            return
+        tmp_path = self.temp_path(url)
+        tmp_path.write_bytes(body)
+        self.store_file(url, headers, tmp_path, len(body))
+
+    def store_file(self, url: str, headers, tmp_path, size: int) -> None:
+        """Store a body already written to a temp_path file, moving the file into the cache."""
+        kept = {name: headers[name] for name in STORED_HEADERS if headers.get(name)}
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            os.replace(tmp_path, self._body_path(digest))
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, digest, headers, size, immutable, stored_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, json.dumps(kept), size, int(is_immutable(url)), now, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def refresh(self, url: str, headers) -> None:
+        """Record the validators of a 304 so the next revalidation uses them."""
+        updates = {name: headers[name] for name in ("ETag", "Last-Modified", "Date") if headers.get(name)}
+        if not updates:
+            return
+        with self._lock:
+            row = self.conn.execute("SELECT headers FROM responses WHERE url = ?", (url,)).fetchone()
+            if row:
+                self.conn.execute("UPDATE responses SET headers = ? WHERE url = ?",
+                                  (json.dumps({**json.loads(row[0]), **updates}), url))
+                self.conn.commit()
+
+    def _delete(self, url: str, digest: str) -> None:
+        row = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+        self._body_path(digest).unlink(missing_ok=True)
+        if row:
+            self.total_bytes -= row[0]
+
+    def _evict(self) -> None:
+        """Drop least recently used responses until the cache fits in max_bytes; caller holds the lock."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for url, digest in self.conn.execute(
+                "SELECT url, digest FROM responses ORDER BY last_access").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._delete(url, digest)
+            evicted += 1
+        metrics.inc("http_cache_evictions_total", evicted)
+        logger.info(f"Evicted {evicted} responses from the HTTP cache ({self.total_bytes / 1e6:.0f} MB kept)")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.revalidated
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses,
+                "hit_ratio": round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+                "bytes": self.total_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+def conditional_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Request headers revalidating a cached response against its validators."""
+    conditional = {}
+    if headers.get("ETag"):
+        conditional["If-None-Match"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        conditional["If-Modified-Since"] = headers["Last-Modified"]
+    return conditional
+
+
+def _cached_response(request: requests.PreparedRequest, headers: Dict[str, str],
+                     body: Union[bytes, BinaryIO]) -> requests.Response:
+    """A 200 replaying a cached body; a file body is read in chunks by iter_content like a network one."""
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.url = request.url
+    response.request = request
+    size = len(body) if isinstance(body, bytes) else os.fstat(body.fileno()).st_size
+    response.headers = CaseInsensitiveDict({**headers, "Content-Length": str(size), "X-Cache": "HIT"})
+    response.encoding = get_encoding_from_headers(response.headers)
+    if isinstance(body, bytes):
+        response._content = body
+        response._content_consumed = True
+    else:
+        response.raw = body
+    return response
+
+
+class _TeeBody:
+    """Wraps a streamed response's raw body, copying each chunk to a cache file as the caller reads it.
+
+    The copy is stored once the body has been read to the end; one abandoned part way,
+    or growing past the cache size, is deleted. Everything else is delegated to the
+    urllib3 response, so requests still translates its errors.
+    """
+
+    def __init__(self, raw, cache: HTTPCache, url: str, headers):
+        self._raw = raw
+        self._cache = cache
+        self._url = url
+        self._headers = headers
+        self._tmp_path = cache.temp_path(url)
+        self._file = open(self._tmp_path, "wb")
+        self._size = 0
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None):
+        try:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                self._copy(chunk)
+                yield chunk
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._cache.store_file(self._url, self._headers, self._tmp_path, self._size)
+        finally:
+            self._discard()
+
+    def _copy(self, chunk: bytes) -> None:
+        if self._file is None:
+            return
+        self._size += len(chunk)
+        if self._size > self._cache.max_bytes:
+            self._discard()
+        else:
+            self._file.write(chunk)
+
+    def _discard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            Path(self._tmp_path).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self._discard()
+        self._raw.close()
+
+
+class CachingAdapter(HTTPAdapter):
+    """Transport adapter answering GETs from an HTTPCache before (or instead of) the network."""
+
+    def __init__(self, cache: HTTPCache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            return super().send(request, **kwargs)
+        stream = kwargs.get("stream", False)
+        cached = self.cache.lookup(request.url, as_file=stream)
+        if cached is not None:
+            headers, body, immutable = cached
+            if immutable:
+                self.cache._count("hits")
+                return _cached_response(request, headers, body)
+            request.headers.update(conditional_headers(headers))
+
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            if cached is not None and stream:
+                cached[1].close()
+            raise
+        if cached is not None and stream and response.status_code != 304:
+            cached[1].close()
+        if cached is not None and response.status_code == 304:
+            self.cache._count("revalidated")
+            self.cache.refresh(request.url, response.headers)
+            response.close()
+            return _cached_response(request, {**cached[0], **{k: v for k, v in response.headers.items()
+                                                             if k in ("ETag", "Last-Modified", "Date")}}, cached[1])
+        self.cache._count("misses")
+        if response.status_code == 200 and stream:
+            if self.cache.cacheable(request.url, response.headers):
+                # Teed to disk as the caller reads it, so a large document is never held in memory
+                response.raw = _TeeBody(response.raw, self.cache, request.url, response.headers)
+        elif response.status_code == 200:
+            self.cache.store(request.url, response.headers, response.content)
+        return response
+
+
+def install_http_cache(context, cache: HTTPCache) -> None:
+    """Route a sync Playwright context's document and search requests through the cache."""
+
+    def handle(route):
+        url = route.request.url
+        cached = cache.lookup(url) if route.request.method == "GET" else None
+        if cached is not None and cached[2]:
+            cache._count("hits")
+            route.fulfill(status=200, headers=cached[0], body=cached[1])
+            return
+        conditional = conditional_headers(cached[0]) if cached else {}
+        response = route.fetch(headers={**route.request.headers, **conditional}) if conditional else route.fetch()
+        if conditional and response.status == 304:
+            cache._count("revalidated")
+            cache.refresh(url, _case_insensitive(response.headers))
+            route.fulfill(status=200, headers=cached[0], body=cached[1])
+            return
+        cache._count("misses")
+        if response.status == 200:
+            cache.store(url, _case_insensitive(response.headers), response.body())
+        route.fulfill(response=response)
+
+    context.route(BROWSER_CACHED_URLS, handle)
+
+
+async def install_http_cache_async(context, cache: HTTPCache) -> None:
+    """Async counterpart of install_http_cache for async Playwright contexts."""
+
+    async def handle(route):
+        url = route.request.url
+        cached = cache.lookup(url) if route.request.method == "GET" else None
+        if cached is not None and cached[2]:
+            cache._count("hits")
+            await route.fulfill(status=200, headers=cached[0], body=cached[1])
+            return
+        conditional = conditional_headers(cached[0]) if cached else {}
+        response = await (route.fetch(headers={**route.request.headers, **conditional}) if conditional
+                          else route.fetch())
+        if conditional and response.status == 304:
+            cache._count("revalidated")
+            cache.refresh(url, _case_insensitive(response.headers))
+            await route.fulfill(status=200, headers=cached[0], body=cached[1])
+            return
+        cache._count("misses")
+        if response.status == 200:
+            cache.store(url, _case_insensitive(response.headers), await response.body())
+        await route.fulfill(response=response)
+
+    await context.route(BROWSER_CACHED_URLS, handle)
+
+
+def _case_insensitive(headers: Dict[str, str]) -> CaseInsensitiveDict:
+    """Playwright lower-cases header names; the cache looks them up as requests reports them."""
+    return CaseInsensitiveDict(headers)
+
+
+# Set by enable() from each script's --http-cache flag; create_session and BrowserPool pick it up
+default_cache: Optional[HTTPCache] = None
+
+
+def enable(root: Optional[str], max_mb: float = DEFAULT_MAX_MB) -> Optional[HTTPCache]:
+    """Turn on the process-wide cache in root (no-op for None)."""
+    global default_cache
+    if root:
+        default_cache = HTTPCache(root, int(max_mb * 1024 * 1024))
+        logger.info(f"Caching HTTP responses in {root} (up to {max_mb:.0f} MB)")
+    return default_cache
+
+
+def served_offline(url: str) -> bool:
+    """True if the process-wide cache answers url without a network call."""
+    return default_cache is not None and default_cache.has_immutable(url)
@@ -0,0 +1,152 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import http_cache
+from http_cache import CachingAdapter
+from latency import LatencyTracker, default_tracker, endpoint_class
+from metrics import metrics
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# SEC rejects requests without a descriptive User-Agent that includes a contact address
+DEFAULT_USER_AGENT = "Sec.gov research scraper admin@example.com"
+CHUNK_SIZE = 64 * 1024
+
+# Runs requests that may be hedged; the caller blocks on them, so this only bounds duplicates in flight
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+HEDGE_POLL_INTERVAL = 0.05
+# Raised once a fetch runs past its latency-derived timeout or the connection drops; callers retry them
+RETRYABLE_ERRORS = (requests.Timeout, requests.ConnectionError)
+
+
+def create_session(user_agent: str = DEFAULT_USER_AGENT, pool_size: int = 8) -> requests.Session:
+    """Create a keep-alive session whose connection pool is reused across every request.
+
+    With the HTTP cache enabled, the session's GETs go through it.
+    """
+    session = requests.Session()
+    if http_cache.default_cache is not None:
+        adapter = CachingAdapter(http_cache.default_cache, pool_connections=4, pool_maxsize=pool_size)
+    else:
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": user_agent})
+    return session
+
+
+def served_from_cache(session: requests.Session, url: str) -> bool:
+    """True if the session answers url from the HTTP cache without a network call."""
+    adapter = session.get_adapter(url)
+    return isinstance(adapter, CachingAdapter) and adapter.cache.has_immutable(url)
+
+
+def _close_response(future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def timed_get(session: requests.Session, url: str, rate_limiter: RateLimiter, default_timeout: float = 60,
+              tracker: Optional[LatencyTracker] = None, **kwargs) -> requests.Response:
+    """GET with a timeout derived from the endpoint's latency, hedged once it runs past p95.
+
+    The caller has already waited on the rate limiter for the first request. If it has
+    not answered by the class's p95, a duplicate is sent as soon as the limiter has a
+    token to spare, provided the tracker's hedge allowance is not used up, so hedging
+    never pushes the request rate past the budget. Whichever response arrives first is
+    returned; the other is closed when it lands. With stream=True the latency measured
+    is the time to the response headers.
+    """
+    tracker = tracker or default_tracker
+    endpoint = endpoint_class(url)
+    timeout = tracker.timeout(endpoint, default_timeout)
+
+    def send() -> requests.Response:
+        start = time.monotonic()
+        try:
+            return session.get(url, timeout=timeout, **kwargs)
+        finally:
+            tracker.record(endpoint, time.monotonic() - start)
+
+    delay = tracker.hedge_delay(endpoint)
+    if delay is None or served_from_cache(session, url):
+        return send()
+    primary = _hedge_executor.submit(send)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    if not tracker.allow_hedge(endpoint):
+        return primary.result()
+    # The hedge waits for a free token rather than queueing for one, so it never delays other requests
+    while not rate_limiter.try_acquire():
+        try:
+            return primary.result(timeout=HEDGE_POLL_INTERVAL)
+        except FutureTimeout:
+            pass
+
+    logger.info(f"{url} is slower than p95 ({delay:.2f}s), sending a hedged request")
+    hedge = _hedge_executor.submit(send)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None and pending:
+                continue  # The other request may still succeed
+            for other in pending:
+                other.add_done_callback(_close_response)
+            metrics.inc("hedged_requests_total", endpoint=endpoint,
+                        winner="hedge" if future is hedge else "primary")
+            return future.result()
+
+
+def stream_to_file(session: requests.Session, url: str, save_path: str, rate_limiter: RateLimiter,
+                   timeout: float = 60, retry_count: Optional[int] = None, form_type: Optional[str] = None) -> bool:
+    """Stream a document's original bytes to disk in chunks, retrying while SEC throttles us.
+
+    Bytes go to a .part file that is renamed into place only once complete, so an
+    interrupted download never leaves a truncated document behind.
+    """
+    retry_count = rate_limiter.max_retries if retry_count is None else retry_count
+    part_path = f"{save_path}.part"
+    try:
+        for attempt in range(retry_count + 1):
+            # A cached Archives document costs no request, so it does not spend the budget
+            if not served_from_cache(session, url):
+                rate_limiter.wait()
+            try:
+                with metrics.span("download"), timed_get(session, url, rate_limiter, timeout, stream=True) as response:
+                    logger.info(f"Request URL: {url} - Status Code: {response.status_code}")
+                    if rate_limiter.record_response(response.status_code, response.headers, attempt,
+                                                    form_type) is not None:
+                        continue
+                    if response.status_code != 200:
+                        logger.error(f"Failed to load {url}: Status Code {response.status_code}")
+                        return False
+                    with open(part_path, "wb") as file:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            file.write(chunk)
+            except RETRYABLE_ERRORS as e:
+                # The timeout follows the endpoint's latency, so a stuck fetch is retried within seconds
+                logger.warning(f"Fetching {url} stalled ({e}), retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                continue
+            os.replace(part_path, save_path)
+            logger.info(f"Saved {url} to {save_path}.")
+            return True
+        logger.error(f"Giving up on {url} after {retry_count} retries")
+        return False
+    except Exception as e:
+        logger.error(f"Error downloading {url}: {e}")
+        return False
+    finally:
+        # Whatever stopped the download, a partial .part file must not be left behind
+        if os.path.exists(part_path):
+            os.remove(part_path)
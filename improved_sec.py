@@ -1,5 +1,14 @@
 from playwright.sync_api import sync_playwright
-import csv
+import http_cache
+from browser_pool import DEFAULT_BLOCKED_RESOURCE_TYPES, BrowserPool
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter, is_lockout_page
+from efts import (ARCHIVES_BASE_URL, SEC_BASE_URL, SearchResponseCapture, archive_url, is_search_response,
+                  rebase_url_groups)
+from http_client import create_session, stream_to_file
+from metrics import metrics
+from render_farm import RenderFarm
+from sinks import OUTPUT_FORMATS, create_sink, output_path
+import argparse
 import logging
 import time
 from pathlib import Path
@@ -14,37 +23,49 @@ logging.basicConfig(
     ]
 )
 
+CSV_HEADERS = [
+    'file_path', 'form_file_name', 'filed', 'reporting_for',
+    'filing_entity_person', 'cik', 'located', 'incorporated',
+    'file_number', 'firm_number', 'form_type'
+]
+
+RESULTS_HEADER_SELECTOR = 'th#filetype.filetype[style=""]:has-text("Form & File")'
+
 class SECDocumentScraper:
-    def __init__(self, output_dir: str = "sec_gov", csv_file: str = 'Master_file.csv', timeout: int = 30000):
+    def __init__(self, output_dir: str = "sec_gov", csv_file: str = 'Master_file.csv', timeout: int = 30000,
+                 extraction_mode: str = "json", rate_limiter: Optional[RateLimiter] = None,
+                 fetch_mode: str = "pdf", output_format: Optional[str] = None,
+                 render_farm: Optional[RenderFarm] = None, archives_base: str = ARCHIVES_BASE_URL):
         self.output_dir = Path(output_dir)
-        self.csv_file = Path(csv_file)
+        self.csv_file = output_path(csv_file, output_format) if output_format else Path(csv_file)
+        self.output_format = output_format
         self.timeout = timeout
+        # "json" reads row metadata from the intercepted search-index response, "dom" reads table cells
+        self.extraction_mode = extraction_mode
+        self.search_capture = SearchResponseCapture()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # "pdf" prints the document from the browser, "raw" streams the original bytes over HTTP
+        self.fetch_mode = fetch_mode
+        self.session = create_session() if fetch_mode == "raw" else None
+        # PDFs are printed by separate browser processes when a farm is given, so the crawl never waits on them
+        self.render_farm = render_farm
+        self.archives_base = archives_base
         self.setup_directories()
         
     def setup_directories(self) -> None:
         try:
             self.output_dir.mkdir(parents=True, exist_ok=True)
-            self._initialize_csv()
+            # Rows are buffered and written in batches; the CSV sink writes the header itself
+            self.sink = create_sink(self.csv_file, CSV_HEADERS, self.output_format)
         except Exception as e:
             logging.error(f"Failed to setup directories: {e}")
             raise
 
-    def _initialize_csv(self) -> None:
-        if not self.csv_file.exists():
-            headers = [
-                'file_path', 'form_file_name', 'filed', 'reporting_for', 
-                'filing_entity_person', 'cik', 'located', 'incorporated', 
-                'file_number', 'firm_number', 'form_type'
-            ]
-            self._write_csv_row(headers, mode='w')
+    def _write_csv_row(self, row: List[str]) -> None:
+        self.sink.write(dict(zip(CSV_HEADERS, row)))
 
-    def _write_csv_row(self, row: List[str], mode: str = 'a') -> None:
-        try:
-            with open(self.csv_file, mode=mode, newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(row)
-        except Exception as e:
-            logging.error(f"Failed to write to CSV: {e}")
+    def close(self) -> None:
+        self.sink.close()
 
     def _safe_wait_and_click(self, page, selector: str, timeout: int = 5000) -> bool:
         try:
@@ -79,6 +100,7 @@ class SECDocumentScraper:
             try:
                 return {
                     "file_name": document_link.get_attribute('data-file-name'),
+                    "accession": document_link.get_attribute('data-adsh'),
                     "file_number": page.locator("td.file-num a").nth(index).text_content(timeout=5000).strip(),
                     "form_file_name": page.locator("td.filetype a").nth(index).text_content(timeout=5000).strip(),
                     "incorporate": page.locator("td.incorporated").nth(index).text_content(timeout=5000).strip(),
@@ -95,7 +117,80 @@ class SECDocumentScraper:
                 time.sleep(1)
         raise Exception("Failed to extract metadata")
 
+    def _open_document_url(self, page, document_link) -> Optional[str]:
+        """Read the document URL from the preview modal's popup without waiting for it to render."""
+        document_link.click(timeout=5000)
+        with page.expect_popup(timeout=30000) as popup_info:
+            if not self._safe_wait_and_click(page, "button.btn.btn-warning:has-text('Open document')", timeout=10000):
+                return None
+            self._safe_wait_and_click(page, "#close-modal", timeout=5000)
+        document_page = popup_info.value
+        file_url = document_page.url
+        document_page.close()
+        return file_url
+
+    def fetch_raw_document(self, page, url_type: str, document_link, details: Dict) -> Optional[str]:
+        """Stream the original .htm/.txt/.pdf document to disk instead of printing it in the browser."""
+        doc_dir = self.output_dir / url_type
+        doc_dir.mkdir(exist_ok=True)
+
+        try:
+            file_url = archive_url(details, self.archives_base) or self._open_document_url(page, document_link)
+            if not file_url:
+                logging.warning("Open document link not found")
+                return None
+            extension = Path(file_url.split("?")[0]).suffix or ".htm"
+            raw_path = doc_dir / f"{details['form_file_name']}_{details['file_number']}_{details['film_number']}{extension}"
+            if raw_path.exists():
+                logging.info(f"Document already exists: {raw_path}")
+                return str(raw_path)
+            if stream_to_file(self.session, file_url, str(raw_path), self.rate_limiter, form_type=url_type):
+                return str(raw_path)
+            return None
+        except Exception as e:
+            logging.error(f"Failed to process document {details.get('file_name', 'unknown')}: {e}")
+            return None
+
+    def _write_details(self, file_path: str, url_type: str, details: Dict) -> None:
+        self._write_csv_row([
+            file_path, url_type, details["filed"], details["end_date"],
+            details["entity_name"], details["cik_number"], details["location"],
+            details["incorporate"], details["file_number"], details["film_number"],
+            details["form_file_name"]
+        ])
+        metrics.document_done(url_type)
+
+    def render_later(self, url_type: str, details: Dict) -> bool:
+        """Queue the document on the render farm; its row is written once the PDF exists.
+
+        Returns False when the row has no buildable URL, so the caller falls back to the
+        in-browser path through the preview modal.
+        """
+        file_url = archive_url(details, self.archives_base)
+        if not file_url:
+            return False
+        doc_dir = self.output_dir / url_type
+        doc_dir.mkdir(exist_ok=True)
+        pdf_path = doc_dir / f"{details['form_file_name']}_{details['file_number']}_{details['film_number']}.pdf"
+        if pdf_path.exists():
+            logging.info(f"Document already exists: {pdf_path}")
+            self._write_details(str(pdf_path), url_type, details)
+            return True
+
+        def finish(future):
+            if future.result():
+                self._write_details(str(pdf_path), url_type, details)
+            else:
+                metrics.inc("failures_total", form_type=url_type, stage="render")
+                logging.error(f"Failed to render document {details.get('file_name', 'unknown')}")
+
+        self.render_farm.submit(file_url, pdf_path, url_type).add_done_callback(finish)
+        return True
+
     def scrape_document(self, page, url_type: str, document_link, details: Dict) -> Optional[str]:
+        if self.fetch_mode == "raw":
+            return self.fetch_raw_document(page, url_type, document_link, details)
+
         doc_dir = self.output_dir / url_type
         doc_dir.mkdir(exist_ok=True)
         
@@ -106,35 +201,140 @@ class SECDocumentScraper:
             return str(pdf_path)
 
         try:
+            file_url = archive_url(details, self.archives_base)
+            if file_url:
+                # The URL follows from the row, so skip the preview modal and its popup
+                document_page = page.context.new_page()
+                try:
+                    if not self._load_document(document_page, file_url, url_type):
+                        return None
+                    return self._save_pdf(document_page, pdf_path)
+                finally:
+                    document_page.close()
+
+            self.rate_limiter.wait()  # Opening the preview fetches the document
+            metrics.inc("preview_modal_opens_total", form_type=url_type)
             document_link.click(timeout=5000)
-            
+
             with page.expect_popup(timeout=30000) as popup_info:
                 if not self._safe_wait_and_click(page, "button.btn.btn-warning:has-text('Open document')", timeout=10000):
                     return None
-                
+
                 self._safe_wait_and_click(page, "#close-modal", timeout=5000)
 
             document_page = popup_info.value
-            document_page.wait_for_load_state("domcontentloaded", timeout=30000)
-            
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    document_page.pdf(path=str(pdf_path))
-                    document_page.close()
-                    logging.info(f"Successfully saved document to {pdf_path}")
-                    return str(pdf_path)
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        document_page.close()
-                        raise
-                    logging.warning(f"PDF save attempt {attempt + 1} failed: {e}")
-                    time.sleep(2)
-            
+            try:
+                document_page.wait_for_load_state("domcontentloaded", timeout=30000)
+                return self._save_pdf(document_page, pdf_path)
+            finally:
+                document_page.close()
+
         except Exception as e:
             logging.error(f"Failed to process document {details.get('file_name', 'unknown')}: {e}")
             return None
 
+    def _load_document(self, document_page, file_url: str, form_type: Optional[str] = None) -> bool:
+        """Open a document, backing off while SEC throttles us; False unless it loaded with a 200.
+
+        A 403/429 lockout page must never be printed: the PDF would exist and the
+        document would not be fetched again.
+        """
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            # A cached Archives document is served by the route handler and spends no request
+            if not http_cache.served_offline(file_url):
+                self.rate_limiter.wait()
+            response = document_page.goto(file_url, wait_until="domcontentloaded", timeout=30000)
+            if response is None:
+                logging.error(f"No response loading {file_url}")
+                return False
+            if self.rate_limiter.record_response(response.status, response.headers, attempt, form_type) is not None:
+                continue
+            if response.status == 200 and is_lockout_page(document_page.content()):
+                self.rate_limiter.record_throttle(attempt, form_type=form_type)
+                continue
+            if response.status == 200:
+                return True
+            logging.error(f"Failed to load {file_url}: Status Code {response.status}")
+            return False
+        logging.error(f"Giving up on {file_url} after {self.rate_limiter.max_retries} retries")
+        return False
+
+    def _save_pdf(self, document_page, pdf_path: Path) -> str:
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                with metrics.span("pdf"):
+                    document_page.pdf(path=str(pdf_path))
+                logging.info(f"Successfully saved document to {pdf_path}")
+                return str(pdf_path)
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    raise
+                logging.warning(f"PDF save attempt {attempt + 1} failed: {e}")
+                time.sleep(2)
+
+    def attach(self, page) -> None:
+        """Start listening for search-index responses on a freshly opened page."""
+        self.search_capture.attach(page)
+
+    def _wait_until_ready(self, page, timeout: int = 10000) -> None:
+        """Return as soon as the results table renders or the search response says it never will."""
+        if self.search_capture.status is None:
+            try:
+                page.wait_for_event("response", predicate=is_search_response, timeout=timeout)
+            except Exception:
+                pass
+        status = self.search_capture.status
+        if status is not None and status != 200:
+            return  # Throttled or failed: load_results_page decides what to do
+        if status == 200 and self.search_capture.rows() == []:
+            return  # Past the last page, nothing will render
+        try:
+            page.wait_for_selector(RESULTS_HEADER_SELECTOR, timeout=timeout)
+        except Exception:
+            pass
+
+    def load_results_page(self, page, url: str, form_type: Optional[str] = None) -> bool:
+        """Load a search results page, backing off while SEC is throttling us.
+
+        Returns False once a page loads without a results table and is not a lockout.
+        """
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.search_capture.reset()
+            self.rate_limiter.wait()
+            with metrics.span("goto"):
+                page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            with metrics.span("wait_for_results"):
+                self._wait_until_ready(page)
+
+            status = self.search_capture.status
+            if status is not None and self.rate_limiter.record_response(status, self.search_capture.headers, attempt,
+                                                                        form_type) is not None:
+                continue
+            if page.locator(RESULTS_HEADER_SELECTOR).is_visible():
+                return True
+            if is_lockout_page(page.content()):
+                self.rate_limiter.record_throttle(attempt, form_type=form_type)
+                continue
+            return False
+
+        logging.error(f"Giving up on {url} after {self.rate_limiter.max_retries} retries")
+        return False
+
+    def _captured_metadata(self, expected_rows: int) -> Optional[List[Dict]]:
+        """Return row metadata from the captured JSON payload if it lines up with the table."""
+        if self.extraction_mode != "json":
+            return None
+        rows = self.search_capture.rows()
+        if rows is None:
+            logging.info("No search response captured, falling back to DOM extraction")
+            return None
+        if len(rows) != expected_rows:
+            logging.warning(f"Search response has {len(rows)} rows but table has {expected_rows}, "
+                            f"falling back to DOM extraction")
+            return None
+        return rows
+
     def get_document_details(self, page, url_type: str) -> None:
         self.ensure_checkboxes_checked(page)
         
@@ -144,21 +344,26 @@ class SECDocumentScraper:
             document_links = page.locator(link_selector).all()
             
             logging.info(f"Found {len(document_links)} documents on current page")
+            captured = self._captured_metadata(len(document_links))
             
             for i, doc_link in enumerate(document_links):
                 try:
-                    details = self._extract_document_metadata(page, doc_link, i)
-                    pdf_path = self.scrape_document(page, url_type, doc_link, details)
+                    if captured:
+                        details = captured[i]
+                    else:
+                        with metrics.span("extract_metadata"):
+                            details = self._extract_document_metadata(page, doc_link, i)
+                    if self.render_farm and self.fetch_mode == "pdf" and self.render_later(url_type, details):
+                        continue
+                    with metrics.span("scrape_document"):
+                        pdf_path = self.scrape_document(page, url_type, doc_link, details)
                     
                     if pdf_path:
-                        self._write_csv_row([
-                            pdf_path, url_type, details["filed"], details["end_date"],
-                            details["entity_name"], details["cik_number"], details["location"],
-                            details["incorporate"], details["file_number"], details["film_number"],
-                            details["form_file_name"]
-                        ])
-                    time.sleep(1)  # Add small delay between documents
+                        self._write_details(pdf_path, url_type, details)
+                    else:
+                        metrics.inc("failures_total", form_type=url_type, stage="scrape_document")
                 except Exception as e:
+                    metrics.inc("failures_total", form_type=url_type, stage="document")
                     logging.error(f"Failed to process document {i}: {e}")
                     continue
                     
@@ -166,6 +371,26 @@ class SECDocumentScraper:
             logging.error(f"Failed to process page: {e}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Save the documents behind EDGAR full-text search results")
+    parser.add_argument("--fetch-mode", choices=["pdf", "raw"], default="pdf",
+                        help="print documents to PDF in the browser, or stream their original bytes over HTTP")
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically export stage timings and counters (.prom for Prometheus, else JSON)")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="print PDFs in this many separate browser processes (0 prints in the crawling browser)")
+    parser.add_argument("--sec-url", default=SEC_BASE_URL,
+                        help="host serving the search UI (e.g. the local fixture server)")
+    parser.add_argument("--archives-url", default=ARCHIVES_BASE_URL, help="base URL used to build document links")
+    parser.add_argument("--headed", action="store_true", help="show the browser window instead of running headless")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None,
+                        help="manifest format (default: csv, written to Master_file.csv)")
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; Archives documents are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
+
     url_groups = {
         # '10-Q': [
         #     "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=10-Q",
@@ -184,50 +409,55 @@ def main():
         ]
     }
 
-    scraper = SECDocumentScraper()
+    farm = None
+    rate_limiter = RateLimiter()
+    if args.render_workers > 0 and args.fetch_mode == "pdf":
+        # The crawler and the render workers share SEC's budget, so each side gets half of it
+        farm = RenderFarm(args.render_workers, rate=DEFAULT_REQUESTS_PER_SECOND / 2, headless=not args.headed)
+        rate_limiter = RateLimiter(DEFAULT_REQUESTS_PER_SECOND / 2)
+    scraper = SECDocumentScraper(rate_limiter=rate_limiter, fetch_mode=args.fetch_mode,
+                                 output_format=args.output_format, render_farm=farm,
+                                 archives_base=args.archives_url)
+    url_groups = rebase_url_groups(url_groups, args.sec_url)
     
-    with sync_playwright() as p:
-        for url_type, urls in url_groups.items():
-            logging.info(f"Processing {url_type} URLs")
+    with metrics.exporting(args.metrics_file):
+        with sync_playwright() as p:
+            # Printed PDFs need the filing's images and fonts; only block them when fetching raw bytes
+            blocked = DEFAULT_BLOCKED_RESOURCE_TYPES if args.fetch_mode == "raw" else ()
+            pool = BrowserPool(p, headless=not args.headed, blocked_resource_types=blocked)
+            for url_type, urls in url_groups.items():
+                logging.info(f"Processing {url_type} URLs")
             
-            for url in urls:
-                browser = p.chromium.launch(headless=False)
-                context = browser.new_context(viewport={'width': 1920, 'height': 1080})
-                page = context.new_page()
-                page_number = 1
+                for url in urls:
+                    with pool.page() as page:
+                        scraper.attach(page)
+                        page_number = 1
                 
-                while True:
-                    paginated_url = f"{url}&page={page_number}"
-                    logging.info(f"Processing page {page_number}: {paginated_url}")
+                        while True:
+                            paginated_url = f"{url}&page={page_number}"
+                            logging.info(f"Processing page {page_number}: {paginated_url}")
                     
-                    try:
-                        page.goto(paginated_url, wait_until="domcontentloaded", timeout=60000)
-                        time.sleep(10)  # Allow page to stabilize
-                        
-                        if not page.locator('th#filetype.filetype[style=""]:has-text("Form & File")').is_visible():
-                            logging.info("No more results found")
-                            break
+                            try:
+                                if not scraper.load_results_page(page, paginated_url, url_type):
+                                    logging.info("No more results found")
+                                    break
                         
-                        scraper.get_document_details(page, url_type)
-                        page_number += 1
+                                scraper.get_document_details(page, url_type)
+                                scraper.sink.flush()
+                                page_number += 1
                         
-                    except Exception as e:
-                        logging.error(f"Failed to process {paginated_url}: {e}")
-                        break
-                    
-                    finally:
-                        time.sleep(5)  # Add delay between pages
-                
-                try:
-                    page.close()
-                    context.close()
-                    browser.close()
-                except Exception as e:
-                    logging.error(f"Error closing browser resources: {e}")
+                            except Exception as e:
+                                logging.error(f"Failed to process {paginated_url}: {e}")
+                                break
             
-            logging.info(f"Completed processing {url_type} URLs")
+                logging.info(f"Completed processing {url_type} URLs")
         
-        logging.info("All URLs processed")
+            pool.close()
+            logging.info("All URLs processed")
+        if farm:
+            # Wait for the queued renders so their rows reach the manifest
+            farm.close()
+    scraper.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,117 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+from metrics import _percentile
+
+logger = logging.getLogger(__name__)
+
+# Endpoint classes with their own latency profile
+SEARCH = "search"
+INDEX = "index"
+DOCUMENT = "document"
+FACTS = "facts"
+OTHER = "other"
+
+# Recent samples per endpoint class; a short window follows SEC's latency as it drifts
+WINDOW = 512
+# Until this many samples are in, the caller's fixed timeout applies and nothing is hedged
+MIN_SAMPLES = 20
+# Timeouts are this multiple of p99, clamped to [MIN_TIMEOUT, the caller's fixed timeout]
+TIMEOUT_MULTIPLIER = 4.0
+MIN_TIMEOUT = 2.0
+HEDGE_QUANTILE = 0.95
+# Hedges allowed per request of a class; past p95 about 5% of requests qualify
+MAX_HEDGE_RATIO = 0.1
+
+
+def endpoint_class(url: str) -> str:
+    path = url.split("?", 1)[0].split("#", 1)[0]
+    if "/search-index" in path or "/edgar/search/" in path:
+        return SEARCH
+    if path.endswith("-index.htm") or path.endswith("-index.html") or "/edgar/daily-index/" in path:
+        return INDEX
+    if "/Archives/edgar/data/" in path:
+        return DOCUMENT
+    if "/api/xbrl/" in path:
+        return FACTS
+    return OTHER
+
+
+def page_class(url: str) -> str:
+    """Class of a browser page load; rendering makes it slower than a plain fetch of the same endpoint."""
+    return f"{endpoint_class(url)}_page"
+
+
+class LatencyTracker:
+    """Rolling latency percentiles per endpoint class, and the timeouts and hedge delays they imply.
+
+    Each class (search results, filing and daily indexes, Archives documents) keeps its
+    last WINDOW latencies. `timeout` turns the fixed timeout a caller would have used
+    into TIMEOUT_MULTIPLIER x p99, so a stuck request is abandoned after a few times
+    what a slow healthy one takes instead of a minute. `hedge_delay` is the p95 after
+    which a duplicate request is worth sending; `allow_hedge` caps how often that
+    happens so hedging adds at most MAX_HEDGE_RATIO extra requests.
+    """
+
+    def __init__(self, window: int = WINDOW, min_samples: int = MIN_SAMPLES,
+                 timeout_multiplier: float = TIMEOUT_MULTIPLIER, min_timeout: float = MIN_TIMEOUT,
+                 hedge_quantile: float = HEDGE_QUANTILE, max_hedge_ratio: float = MAX_HEDGE_RATIO):
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.hedge_quantile = hedge_quantile
+        self.max_hedge_ratio = max_hedge_ratio
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._requests: Dict[str, int] = defaultdict(int)
+        self._hedges: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[endpoint].append(seconds)
+            self._requests[endpoint] += 1
+
+    def percentile(self, endpoint: str, fraction: float) -> Optional[float]:
+        """Latency at a fraction (0.95 for p95) of the class's recent samples, None while too few."""
+        with self._lock:
+            samples = list(self._samples[endpoint])
+        if len(samples) < self.min_samples:
+            return None
+        return _percentile(samples, fraction)
+
+    def timeout(self, endpoint: str, default: float) -> float:
+        """Seconds to allow a request of the class, never more than the caller's fixed default."""
+        p99 = self.percentile(endpoint, 0.99)
+        if p99 is None:
+            return default
+        return min(default, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def timeout_ms(self, endpoint: str, default_ms: float) -> float:
+        """timeout() in the milliseconds Playwright expects."""
+        return self.timeout(endpoint, default_ms / 1000) * 1000
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        return self.percentile(endpoint, self.hedge_quantile)
+
+    def allow_hedge(self, endpoint: str) -> bool:
+        """Take one hedge from the class's allowance if it has one left."""
+        with self._lock:
+            if self._hedges[endpoint] >= self._requests[endpoint] * self.max_hedge_ratio:
+                return False
+            self._hedges[endpoint] += 1
+            return True
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {}
+        for endpoint in list(self._samples):
+            p50, p95, p99 = (self.percentile(endpoint, fraction) for fraction in (0.5, 0.95, 0.99))
+            if p50 is not None:
+                stats[endpoint] = {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3),
+                                   "hedges": self._hedges[endpoint], "requests": self._requests[endpoint]}
+        return stats
+
+
+# Shared by every fetch in the process, like the default rate limiter
+default_tracker = LatencyTracker()
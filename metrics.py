@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per stage for percentiles; older samples are dropped first
+SAMPLE_LIMIT = 10000
+# Window over which the rolling per-second rates are reported
+RATE_WINDOW = 60.0
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _prom_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """In-process timings and counters for the crawl's hot path.
+
+    `span(stage)` times a block (page.goto, waiting for results, metadata extraction,
+    the preview modal, page.pdf, raw downloads); `inc(name, ...)` counts retries,
+    rate-limit hits and failures, labelled by form type where it is known;
+    `document_done()` feeds a rolling per-second rate for each kind of output
+    (manifest rows discovered, documents saved). Everything is thread-safe so
+    download workers can share the module-level `metrics` registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=SAMPLE_LIMIT))
+        self._span_count: Dict[str, int] = defaultdict(int)
+        self._span_total: Dict[str, float] = defaultdict(float)
+        self._counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._done: Dict[str, deque] = defaultdict(deque)
+        self.started = time.time()
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._span_count[stage] += 1
+            self._span_total[stage] += seconds
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        with self._lock:
+            self._counters[(name, _labels(labels))] += amount
+
+    def document_done(self, form_type: Optional[str] = None, kind: str = "documents") -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._counters[(f"{kind}_total", _labels({"form_type": form_type}))] += 1
+            done = self._done[kind]
+            done.append(now)
+            while done and done[0] < now - RATE_WINDOW:
+                done.popleft()
+
+    def per_second(self) -> Dict[str, float]:
+        """Rolling rate of each kind of output over the last RATE_WINDOW seconds."""
+        now = time.monotonic()
+        rates = {}
+        with self._lock:
+            for kind, done in self._done.items():
+                while done and done[0] < now - RATE_WINDOW:
+                    done.popleft()
+                rates[kind] = len(done) / min(RATE_WINDOW, max(now - done[0], 1.0)) if done else 0.0
+        return rates
+
+    def snapshot(self) -> Dict:
+        """Current values as plain data, the shape of the JSON export."""
+        rates = self.per_second()
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": self._span_count[stage],
+                    "total_seconds": round(self._span_total[stage], 6),
+                    "p50": round(_percentile(samples, 0.50), 6),
+                    "p99": round(_percentile(samples, 0.99), 6),
+                }
+                for stage, samples in self._samples.items()
+            }
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+        return {"timestamp": time.time(), "uptime_seconds": round(time.time() - self.started, 3),
+                "per_second": {kind: round(rate, 4) for kind, rate in rates.items()},
+                "stages": stages, "counters": counters}
+
+    def prometheus_text(self) -> str:
+        snapshot = self.snapshot()
+        lines = ["# TYPE sec_stage_seconds summary"]
+        for stage, values in snapshot["stages"].items():
+            for quantile in ("p50", "p99"):
+                lines.append(f'sec_stage_seconds{{stage="{stage}",quantile="0.{quantile[1:]}"}} {values[quantile]}')
+            lines.append(f'sec_stage_seconds_sum{{stage="{stage}"}} {values["total_seconds"]}')
+            lines.append(f'sec_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        seen = set()
+        for counter in snapshot["counters"]:
+            name = f"sec_{counter['name']}"
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_prom_labels(tuple(sorted(counter['labels'].items())))} {counter['value']}")
+        lines.append("# TYPE sec_per_second gauge")
+        for kind, rate in snapshot["per_second"].items():
+            lines.append(f'sec_per_second{{kind="{kind}"}} {rate}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path) -> None:
+        """Write a Prometheus text file (.prom) or a JSON snapshot (any other extension) atomically."""
+        path = Path(path)
+        text = self.prometheus_text() if path.suffix == ".prom" else json.dumps(self.snapshot(), indent=2)
+        # Rename into place so a scraping node_exporter never reads a half-written file
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def summary_table(self) -> str:
+        snapshot = self.snapshot()
+        rows = [("stage", "count", "total s", "p50 ms", "p99 ms")]
+        for stage, values in sorted(snapshot["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+            rows.append((stage, str(values["count"]), f"{values['total_seconds']:.1f}",
+                         f"{values['p50'] * 1000:.0f}", f"{values['p99'] * 1000:.0f}"))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows]
+        for counter in snapshot["counters"]:
+            labels = ",".join(f"{key}={value}" for key, value in counter["labels"].items())
+            lines.append(f"{counter['name']}{f' [{labels}]' if labels else ''}: {counter['value']:g}")
+        for kind, rate in snapshot["per_second"].items():
+            lines.append(f"{kind}/sec (last {RATE_WINDOW:.0f}s): {rate:.2f}")
+        return "\n".join(lines)
+
+    def start_exporter(self, path, interval: float = 15.0) -> threading.Event:
+        """Rewrite `path` every `interval` seconds in a daemon thread; set the returned event to stop."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.write(path)
+                except OSError as e:
+                    logger.error(f"Failed to write metrics to {path}: {e}")
+
+        threading.Thread(target=run, name="metrics-exporter", daemon=True).start()
+        return stop
+
+    @contextmanager
+    def exporting(self, path: Optional[str], interval: float = 15.0) -> Iterator[None]:
+        """Export periodically while the block runs, then write a final snapshot and log the summary."""
+        stop = self.start_exporter(path, interval) if path else None
+        try:
+            yield
+        finally:
+            if stop:
+                stop.set()
+                self.write(path)
+            logger.info("Run summary:\n" + self.summary_table())
+
+
+# Shared by every module of one process
+metrics = Metrics()
@@ -0,0 +1,107 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from efts import search_params_from_url
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Windows that ended longer ago than this no longer gain filings, so their pages barely change
+SETTLED_AFTER_DAYS = 7
+DEFAULT_RECENT_TTL = 6 * 3600
+DEFAULT_HISTORICAL_TTL = 30 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_pages (
+    cache_key TEXT PRIMARY KEY,
+    entries TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def page_key(url: str, page_number: int) -> str:
+    """Normalized (query, date range, forms, other filters, page) of a search results page."""
+    params = search_params_from_url(url)
+    params["q"] = " ".join(params.get("q", "").lower().split())
+    if "forms" in params:
+        params["forms"] = ",".join(sorted(form.strip().upper() for form in params["forms"].split(",") if form.strip()))
+    return json.dumps({"params": params, "page": page_number}, sort_keys=True)
+
+
+def window_end(url: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(search_params_from_url(url).get("enddt", ""))
+    except ValueError:
+        return None
+
+
+class ResultPageCache:
+    """Memoized search result pages: the rows extracted from each page, keyed by page_key.
+
+    Entries live in memory for the run and in SQLite across runs. A page of a window that
+    ended more than SETTLED_AFTER_DAYS ago is kept for `historical_ttl` seconds; pages of
+    open-ended or recent windows expire after `recent_ttl`, since new filings shift them.
+    An empty list marks the page after the last one, so replays know where a query ends.
+    """
+
+    def __init__(self, path: str = "result_pages.db", recent_ttl: float = DEFAULT_RECENT_TTL,
+                 historical_ttl: float = DEFAULT_HISTORICAL_TTL):
+        self.recent_ttl = recent_ttl
+        self.historical_ttl = historical_ttl
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("DELETE FROM result_pages WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+        self._memory: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def ttl(self, url: str) -> float:
+        end = window_end(url)
+        if end is not None and end < date.today() - timedelta(days=SETTLED_AFTER_DAYS):
+            return self.historical_ttl
+        return self.recent_ttl
+
+    def get(self, url: str, page_number: int) -> Optional[List[Dict]]:
+        """Return the cached rows of a page, or None when it is not cached or has expired."""
+        key = page_key(url, page_number)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is None:
+                row = self.conn.execute(
+                    "SELECT entries, expires_at FROM result_pages WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    cached = (json.loads(row[0]), row[1])
+                    self._memory[key] = cached
+        if cached is None:
+            metrics.inc("page_cache_total", result="miss")
+            return None
+        if cached[1] < now:
+            metrics.inc("page_cache_total", result="expired")
+            return None
+        metrics.inc("page_cache_total", result="hit")
+        return cached[0]
+
+    def put(self, url: str, page_number: int, entries: List[Dict]) -> None:
+        key = page_key(url, page_number)
+        now = time.time()
+        expires_at = now + self.ttl(url)
+        with self._lock:
+            self._memory[key] = (entries, expires_at)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO result_pages (cache_key, entries, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entries), now, expires_at),
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
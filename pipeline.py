@@ -0,0 +1,249 @@
+import argparse
+import logging
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from playwright.sync_api import sync_playwright
+
+import http_cache
+from browser_pool import BrowserPool
+from checkpoint import CrawlCheckpoint
+from doc_store import DocumentStore
+from efts import ARCHIVES_BASE_URL, EFTS_BASE_URL, EFTSClient
+from http_client import create_session
+from metrics import metrics
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from segment_store import _replace_manifest
+from sinks import OUTPUT_FORMATS, create_sink, output_path, read_rows
+import sec
+import sec_doc
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a queue's stream; every consumer gets one
+_DONE = None
+
+
+class DocumentPipeline:
+    """Discovery, document fetch and manifest writing as concurrent stages joined by bounded queues.
+
+    Discovery runs sec.py's crawl (browser or HTTP) and extracts each row's metadata;
+    every row it writes to Master_file.csv is also put on the fetch queue, where the
+    fetch workers pick it up while later result pages are still being discovered. The
+    queues are bounded, so a slow stage blocks the one feeding it instead of letting
+    rows pile up in memory. A single writer thread appends finished rows to the
+    updated manifest.
+
+    The updated manifest is appended to, not truncated: rows it already holds are not
+    fetched again, and Master_file.csv rows that an interrupted run discovered but
+    never downloaded are fetched before discovery resumes. Rows that failed to
+    download are dropped from the manifest on startup and fetched again, so each URL
+    keeps a single row.
+    """
+
+    def __init__(self, url_groups: Dict[str, List[str]], master_file: str = "Master_file.csv",
+                 updated_file: str = "Updated_Master_file.csv", backend: str = "http", mode: str = "raw",
+                 concurrency: int = 4, queue_size: int = 64, rate_limiter: Optional[RateLimiter] = None,
+                 checkpoint: Optional[CrawlCheckpoint] = None, store: Optional[DocumentStore] = None,
+                 output_format: Optional[str] = None, headless: bool = True,
+                 efts_url: str = EFTS_BASE_URL, archives_url: str = ARCHIVES_BASE_URL):
+        self.url_groups = url_groups
+        self.efts_url = efts_url
+        self.archives_url = archives_url
+        self.backend = backend
+        self.mode = mode
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.store = store
+        self.headless = headless
+        self.parent_dir = "sec_gov"
+        self.fetch_queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self.write_queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self.scraper = sec.SECDocumentScraper(csv_file=master_file, rate_limiter=self.rate_limiter,
+                                              checkpoint=checkpoint, output_format=output_format,
+                                              on_row=self._enqueue)
+        updated_path = output_path(updated_file, output_format) if output_format else Path(updated_file)
+        self.done_urls = self._drop_failed_rows(updated_path) if updated_path.exists() else set()
+        self.sink = create_sink(updated_path, sec_doc.fieldnames, output_format)
+        self._seen_lock = threading.Lock()
+
+    @staticmethod
+    def _drop_failed_rows(updated_path: Path) -> Set[str]:
+        """Return the URLs already downloaded, rewriting the manifest without its failed rows."""
+        done_urls = set()
+        failed = 0
+        for row in read_rows(updated_path):
+            if row.get("file_path") and row["file_path"] != "Failed to download":
+                done_urls.add(row["file_url"])
+            else:
+                failed += 1
+        if not failed:
+            return done_urls
+        new_path = updated_path.with_name(f".{updated_path.name}.retrying")
+        output_format = updated_path.suffix.lstrip(".") or "csv"
+        with create_sink(new_path, sec_doc.fieldnames, output_format, batch_size=1000, truncate=True) as sink:
+            for row in read_rows(updated_path):
+                if row.get("file_path") and row["file_path"] != "Failed to download":
+                    sink.write(row)
+        if new_path.exists():
+            _replace_manifest(updated_path, new_path)
+        elif updated_path.is_dir():
+            shutil.rmtree(updated_path)
+        else:
+            updated_path.unlink()
+        logger.info(f"Retrying {failed} failed downloads listed in {updated_path}")
+        return done_urls
+
+    def _enqueue(self, row: Dict) -> None:
+        with self._seen_lock:
+            if row["file_url"] in self.done_urls:
+                return
+            self.done_urls.add(row["file_url"])
+        # Blocks while the fetch workers are behind, which in turn pauses discovery
+        self.fetch_queue.put(row)
+
+    def _backlog(self) -> None:
+        """Queue the rows an earlier run discovered but never finished downloading."""
+        master_file = self.scraper.csv_file
+        if not master_file.exists():
+            return
+        self.scraper.sink.flush()
+        for row in read_rows(master_file):
+            self._enqueue(row)
+
+    def discover(self) -> None:
+        try:
+            self._backlog()
+            if self.backend == "http":
+                client = EFTSClient(base_url=self.efts_url, archives_base=self.archives_url,
+                                    rate_limiter=self.rate_limiter)
+                try:
+                    sec.run_http(self.scraper, self.url_groups, client)
+                finally:
+                    client.close()
+            else:
+                sec.run_browser(self.scraper, self.url_groups, headless=self.headless)
+        except Exception as e:
+            logger.error(f"Discovery stopped: {e}")
+        finally:
+            for _ in range(self.concurrency):
+                self.fetch_queue.put(_DONE)
+
+    def _fetch_raw(self) -> None:
+        session = create_session(pool_size=1)
+        try:
+            while True:
+                row = self.fetch_queue.get()
+                if row is _DONE:
+                    break
+                try:
+                    sec_doc.fetch_raw_row(session, row, self.parent_dir, self.rate_limiter, self.store)
+                except Exception as e:
+                    logger.error(f"Failed to fetch {row['file_url']}: {e}")
+                    row['file_path'] = 'Failed to download'
+                self.write_queue.put(row)
+        finally:
+            session.close()
+
+    def _fetch_pdf(self) -> None:
+        # Each worker thread drives its own browser; sync Playwright objects stay on the thread that made them
+        with sync_playwright() as p:
+            pool = BrowserPool(p, headless=self.headless, blocked_resource_types=())
+            try:
+                while True:
+                    row = self.fetch_queue.get()
+                    if row is _DONE:
+                        break
+                    try:
+                        sec_doc.fetch_pdf_row(pool, row, self.parent_dir, self.rate_limiter, self.store)
+                    except Exception as e:
+                        logger.error(f"Failed to fetch {row['file_url']}: {e}")
+                        row['file_path'] = 'Failed to download'
+                    self.write_queue.put(row)
+            finally:
+                pool.close()
+
+    def fetch(self) -> None:
+        try:
+            if self.mode == "raw":
+                self._fetch_raw()
+            else:
+                self._fetch_pdf()
+        except Exception as e:
+            logger.error(f"Fetch worker stopped: {e}")
+
+    def write(self) -> None:
+        while True:
+            row = self.write_queue.get()
+            if row is _DONE:
+                break
+            sec_doc.update_output(self.sink, row)
+
+    def run(self) -> None:
+        os.makedirs(self.parent_dir, exist_ok=True)
+        stages = [threading.Thread(target=self.discover, name="discover")]
+        stages += [threading.Thread(target=self.fetch, name=f"fetch-{i}") for i in range(self.concurrency)]
+        writer = threading.Thread(target=self.write, name="write")
+        for stage in stages + [writer]:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        self.write_queue.put(_DONE)
+        writer.join()
+
+    def close(self) -> None:
+        self.sink.close()
+        self.scraper.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discover and download documents in one pipelined run")
+    parser.add_argument("--backend", choices=["browser", "http"], default="http",
+                        help="how search result pages are discovered")
+    parser.add_argument("--mode", choices=["pdf", "raw"], default="raw",
+                        help="print each document to PDF in a browser, or stream its original bytes over HTTP")
+    parser.add_argument("--efts-url", default=EFTS_BASE_URL, help="base URL of the full-text search endpoint")
+    parser.add_argument("--archives-url", default=ARCHIVES_BASE_URL, help="base URL used to build document links")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of fetch workers")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="rows buffered between stages before the faster stage waits")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="ceiling on requests per second shared by discovery and downloads")
+    parser.add_argument("--checkpoint", default="crawl_checkpoint.db")
+    parser.add_argument("--store", action="store_true",
+                        help="keep documents in the deduplicated store keyed by accession number")
+    parser.add_argument("--headed", action="store_true", help="show the browser windows instead of running headless")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None)
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically export stage timings and counters (.prom for Prometheus, else JSON)")
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; Archives documents are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
+
+    checkpoint = CrawlCheckpoint(args.checkpoint)
+    store = DocumentStore("sec_gov") if args.store else None
+    pipeline = DocumentPipeline(sec.URL_GROUPS, backend=args.backend, mode=args.mode,
+                                concurrency=args.concurrency, queue_size=args.queue_size,
+                                rate_limiter=RateLimiter(args.rate), checkpoint=checkpoint, store=store,
+                                output_format=args.output_format, headless=not args.headed,
+                                efts_url=args.efts_url, archives_url=args.archives_url)
+    try:
+        with metrics.exporting(args.metrics_file):
+            pipeline.run()
+        logging.info(f"Pipeline finished; updated manifest saved to {pipeline.sink.path}")
+    finally:
+        pipeline.close()
+        checkpoint.close()
+        if store:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from checkpoint import CrawlCheckpoint
+from efts import EFTSClient, total_hits
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from sinks import OUTPUT_FORMATS, create_sink, output_path, read_rows
+import sec
+
+logger = logging.getLogger(__name__)
+
+# Full-text search never returns more than this many hits for one query
+RESULT_CAP = 10000
+SEARCH_UI_URL = "https://www.sec.gov/edgar/search/#/"
+
+
+class Shard(NamedTuple):
+    query: str
+    forms: str
+    start: date
+    end: date
+    hits: int
+
+    @property
+    def url(self) -> str:
+        """The shard as a hash-routed search URL, the same shape as the entries of URL_GROUPS."""
+        params = {
+            "q": self.query,
+            "dateRange": "custom",
+            "startdt": self.start.isoformat(),
+            "enddt": self.end.isoformat(),
+            "filter_forms": self.forms,
+        }
+        return SEARCH_UI_URL + urlencode(params, safe=",")
+
+
+def count_hits(client: EFTSClient, query: str, forms: str, start: date, end: date) -> int:
+    params = {"q": query, "dateRange": "custom", "startdt": start.isoformat(),
+              "enddt": end.isoformat(), "forms": forms}
+    return total_hits(client.search_page(params))
+
+
+def plan_shards(client: EFTSClient, query: str, forms: str, start: date, end: date,
+                cap: int = RESULT_CAP) -> List[Shard]:
+    """Bisect [start, end] until every shard's hit count is below the search result cap.
+
+    One count request is made per visited range, so a range is only split as far as
+    its own density requires. A single day that still exceeds the cap cannot be split
+    further by date and is returned as is, with a warning.
+    """
+    hits = count_hits(client, query, forms, start, end)
+    if hits < cap:
+        return [Shard(query, forms, start, end, hits)] if hits else []
+    if start >= end:
+        logger.warning(f"{query!r} {forms} on {start} has {hits} hits, above the cap of {cap}; results will be truncated")
+        return [Shard(query, forms, start, end, hits)]
+    middle = start + timedelta(days=(end - start).days // 2)
+    logger.info(f"Splitting {start}..{end} ({hits} hits) at {middle}")
+    return (plan_shards(client, query, forms, start, middle, cap)
+            + plan_shards(client, query, forms, middle + timedelta(days=1), end, cap))
+
+
+def plan_url_groups(client: EFTSClient, query: str, forms: List[str], start: date, end: date,
+                    cap: int = RESULT_CAP) -> Dict[str, List[str]]:
+    """Plan every form type into shards, returned in the same shape as sec.URL_GROUPS."""
+    return {form: [shard.url for shard in plan_shards(client, query, form, start, end, cap)] for form in forms}
+
+
+def crawl_shard(url: str, url_type: str, part_file: str, backend: str, rate: float,
+                checkpoint_path: Optional[str]) -> str:
+    """Crawl one shard in a worker process with its own browser or HTTP client; returns its part file."""
+    rate_limiter = RateLimiter(rate)
+    checkpoint = CrawlCheckpoint(checkpoint_path) if checkpoint_path else None
+    scraper = sec.SECDocumentScraper(csv_file=part_file, rate_limiter=rate_limiter, checkpoint=checkpoint)
+    try:
+        if backend == "http":
+            client = EFTSClient(rate_limiter=rate_limiter)
+            try:
+                sec.run_http(scraper, {url_type: [url]}, client)
+            finally:
+                client.close()
+        else:
+            sec.run_browser(scraper, {url_type: [url]})
+    finally:
+        scraper.close()
+        if checkpoint:
+            checkpoint.close()
+    return part_file
+
+
+def merge_manifests(part_files: List[str], output_file, output_format: Optional[str] = None,
+                    fieldnames: Optional[List[str]] = None) -> int:
+    """Append the shard manifests to one output manifest, skipping document URLs it already holds."""
+    output_file = Path(output_file)
+    seen = {row["file_url"] for row in read_rows(output_file)} if output_file.exists() else set()
+    merged = 0
+    with create_sink(output_file, fieldnames or sec.CSV_HEADERS, output_format, batch_size=1000) as sink:
+        for part_file in part_files:
+            if not Path(part_file).exists():
+                continue
+            for row in read_rows(part_file):
+                if row["file_url"] in seen:
+                    continue
+                seen.add(row["file_url"])
+                sink.write(row)
+                merged += 1
+    for part_file in part_files:
+        Path(part_file).unlink(missing_ok=True)
+    return merged
+
+
+def run_shards(url_groups: Dict[str, List[str]], shard_dir: str = "shards", workers: int = 4,
+               backend: str = "http", rate: float = DEFAULT_REQUESTS_PER_SECOND,
+               checkpoint_path: Optional[str] = "crawl_checkpoint.db") -> List[str]:
+    """Crawl every shard on a pool of worker processes that split the request budget between them.
+
+    Returns the per-shard part files for merge_manifests.
+    """
+    Path(shard_dir).mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for url_type, urls in url_groups.items():
+        for index, url in enumerate(urls):
+            jobs.append((url, url_type, str(Path(shard_dir) / f"{url_type}_{index:04d}.csv")))
+
+    # SEC's limit applies to our whole egress, so each process gets an equal slice of it
+    per_worker_rate = rate / max(workers, 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(crawl_shard, url, url_type, part_file, backend, per_worker_rate, checkpoint_path): url
+            for url, url_type, part_file in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                logger.info(f"Finished shard {futures[future]}")
+            except Exception as e:
+                logger.error(f"Shard {futures[future]} failed: {e}")
+    # Parts of failed shards still hold the rows they captured before failing, so all are merged
+    return [part_file for _, _, part_file in jobs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a full-text search under the result cap and crawl it in parallel")
+    parser.add_argument("--query", default="oil")
+    parser.add_argument("--forms", default="8-K,10-Q,10-K", help="comma separated form types, one group each")
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="first filing date (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, required=True, help="last filing date (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=4, help="number of crawler processes")
+    parser.add_argument("--backend", choices=["browser", "http"], default="http")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="requests per second for all workers together")
+    parser.add_argument("--checkpoint", default="crawl_checkpoint.db")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None)
+    args = parser.parse_args()
+
+    client = EFTSClient(rate_limiter=RateLimiter(args.rate))
+    try:
+        url_groups = plan_url_groups(client, args.query, args.forms.split(","), args.start, args.end)
+    finally:
+        client.close()
+    logging.info(f"Planned {sum(len(urls) for urls in url_groups.values())} shards")
+
+    part_files = run_shards(url_groups, workers=args.workers, backend=args.backend, rate=args.rate,
+                            checkpoint_path=args.checkpoint)
+    output_file = output_path("Master_file.csv", args.output_format) if args.output_format else "Master_file.csv"
+    merged = merge_manifests(part_files, output_file, args.output_format)
+    logging.info(f"Merged {merged} rows into {output_file}")
+
+
+if __name__ == "__main__":
+    main()
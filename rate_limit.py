@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# SEC's fair-access policy allows at most 10 requests per second per client
+SEC_MAX_REQUESTS_PER_SECOND = 10.0
+DEFAULT_REQUESTS_PER_SECOND = 8.0
+
+# 403 is what EDGAR returns once a client is locked out for exceeding the rate
+THROTTLE_STATUSES = {403, 429, 503}
+RETRY_STATUSES = THROTTLE_STATUSES | {500, 502, 504}
+
+LOCKOUT_MARKERS = (
+    "Request Rate Threshold Exceeded",
+    "Undeclared Automated Tool",
+    "Your request has been identified as part of a network of automated tools",
+)
+
+
+def is_lockout_page(text: Optional[str]) -> bool:
+    """Return True if the page body is one of SEC's rate-limit lockout notices."""
+    return bool(text) and any(marker in text for marker in LOCKOUT_MARKERS)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """Token bucket shared by every request a process makes, with backoff on throttling.
+
+    The default backoff schedule (5s doubling over 7 retries) adds up to roughly the
+    ten minutes an EDGAR lockout lasts, so a locked-out run recovers without a fixed wait.
+
+    The bucket refills at the current rate, which starts at the configured ceiling,
+    halves whenever SEC throttles us and creeps back up with each successful request.
+    A throttle also pauses every caller until the backoff (or Retry-After) has passed.
+    """
+
+    def __init__(self, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND, burst: int = 1,
+                 min_requests_per_second: float = 0.5, base_backoff: float = 5.0,
+                 max_backoff: float = 15 * 60, max_retries: int = 7):
+        self.max_rate = min(requests_per_second, SEC_MAX_REQUESTS_PER_SECOND)
+        self.min_rate = min(min_requests_per_second, self.max_rate)
+        self.rate = self.max_rate
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # A negative balance is a reservation against tokens that have not refilled yet
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free right now; for optional requests such as hedges."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1 or now < self._blocked_until:
+                return False
+            self._tokens -= 1
+            return True
+
+    def wait(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Delay before retry number `attempt`: Retry-After if given, else capped exponential with jitter."""
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+        return min(delay, self.max_backoff)
+
+    def _pause(self, delay: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def record_throttle(self, attempt: int, retry_after: Optional[str] = None,
+                        form_type: Optional[str] = None) -> float:
+        """Slow down after a throttled response and pause all callers; returns the pause."""
+        delay = self.backoff_delay(attempt, retry_after)
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._pause(delay)
+        metrics.inc("rate_limit_hits_total", form_type=form_type)
+        logger.warning(f"Throttled by SEC, backing off {delay:.1f}s (rate now {self.rate:.2f} req/s)")
+        return delay
+
+    def record_response(self, status: int, headers: Optional[Mapping[str, str]] = None,
+                        attempt: int = 0, form_type: Optional[str] = None) -> Optional[float]:
+        """Update the limiter from a response; returns the backoff if the request should be retried.
+
+        The backoff is applied to the bucket itself, so the next wait() already honours it.
+        form_type, when the request belongs to one, labels the retry and rate-limit counters.
+        """
+        if status in RETRY_STATUSES:
+            metrics.inc("retries_total", status=status, form_type=form_type)
+        if status in THROTTLE_STATUSES:
+            retry_after = (headers or {}).get("retry-after") or (headers or {}).get("Retry-After")
+            return self.record_throttle(attempt, retry_after, form_type)
+        if status in RETRY_STATUSES:
+            delay = self.backoff_delay(attempt)
+            with self._lock:
+                self._pause(delay)
+            logger.warning(f"Server error {status}, retrying in {delay:.1f}s")
+            return delay
+        self.record_success()
+        return None
@@ -0,0 +1,244 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:  # Without psutil workers are only recycled by job count
+    psutil = None
+
+from metrics import metrics
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Chromium grows steadily while rendering large filings; past this its worker is restarted
+DEFAULT_MAX_RSS_MB = 1500
+DEFAULT_MAX_JOBS = 50
+DEFAULT_JOB_TIMEOUT = 120.0
+# Sent by a worker around rate limiter waits, so the parent stops the job clock meanwhile
+_WAITING = "waiting"
+_RENDERING = "rendering"
+
+
+class _ReportingRateLimiter(RateLimiter):
+    """A worker's rate limiter that tells the parent when it sleeps for a token or a backoff."""
+
+    def __init__(self, conn, requests_per_second: float):
+        super().__init__(requests_per_second)
+        self.conn = conn
+
+    def wait(self) -> None:
+        delay = self._reserve()
+        if delay > 0:
+            self.conn.send(_WAITING)
+            time.sleep(delay)
+            self.conn.send(_RENDERING)
+
+
+def _render_worker(conn, headless: bool, rate: float) -> None:
+    """Entry point of a render process: one headless browser rendering jobs sent over `conn`."""
+    # Own process group, so a timed-out render is killed together with its Chromium children
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    from playwright.sync_api import sync_playwright
+    from browser_pool import install_resource_blocking
+    from sec_doc import download_pdf
+
+    rate_limiter = _ReportingRateLimiter(conn, rate)
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=headless)
+        context = browser.new_context()
+        # The printed PDF needs the document's images and fonts, so only trackers are blocked
+        install_resource_blocking(context, ())
+        while True:
+            job = conn.recv()
+            if job is None:
+                break
+            source, pdf_path, form_type = job
+            page = context.new_page()
+            try:
+                if source.startswith("file:"):
+                    # Rendering a stored document is offline: never let it pull resources from sec.gov
+                    page.route("http*://**/*", lambda route: route.abort())
+                    page.goto(source, wait_until="load")
+                    page.pdf(path=pdf_path, format='A4')
+                    ok = True
+                else:
+                    ok = download_pdf(page, source, pdf_path, rate_limiter=rate_limiter, form_type=form_type)
+            except Exception as e:
+                logger.error(f"Error rendering {source}: {e}")
+                ok = False
+            finally:
+                page.close()
+            conn.send(ok)
+        browser.close()
+
+
+class _RenderProcess:
+    """Parent-side handle of one render process."""
+
+    def __init__(self, headless: bool, rate: float):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_render_worker, args=(child_conn, headless, rate), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def rss_mb(self) -> Optional[float]:
+        """Resident memory of the process and its browser, or None when it cannot be measured."""
+        if psutil is None:
+            return None
+        try:
+            root = psutil.Process(self.process.pid)
+            return sum(p.memory_info().rss for p in [root] + root.children(recursive=True)) / (1024 * 1024)
+        except psutil.Error:
+            return None
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self) -> None:
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.join(timeout=5)
+
+
+class RenderFarm:
+    """A pool of render processes, each with its own headless Chromium, fed from one job queue.
+
+    Rendering runs outside the scraping process, so a slow 10-K exhibit only occupies one
+    worker instead of stalling the crawl. A worker is restarted after `max_jobs` renders
+    or once its process tree exceeds `max_rss_mb` (needs psutil), and a render that takes
+    longer than `job_timeout` seconds is killed along with its browser. Time the worker
+    spends in rate limiter waits and throttling backoff does not count against
+    `job_timeout`, so sustained throttling never kills a healthy worker. Workers split
+    the request budget between them, as the planner's processes do.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_jobs: int = DEFAULT_MAX_JOBS,
+                 max_rss_mb: float = DEFAULT_MAX_RSS_MB, job_timeout: float = DEFAULT_JOB_TIMEOUT,
+                 rate: float = DEFAULT_REQUESTS_PER_SECOND, headless: bool = True):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.job_timeout = job_timeout
+        self.headless = headless
+        self.rate = rate / self.workers
+        if psutil is None:
+            logger.warning("psutil is not installed; render workers are recycled by job count only")
+        # Bounded so a fast crawler blocks in submit() instead of queueing thousands of renders
+        self._jobs: "queue.Queue" = queue.Queue(maxsize=self.workers * 4)
+        self._slots = [threading.Thread(target=self._run_slot, name=f"render-{i}", daemon=True)
+                       for i in range(self.workers)]
+        for slot in self._slots:
+            slot.start()
+
+    def submit(self, source: str, pdf_path, form_type: Optional[str] = None) -> Future:
+        """Queue a document URL (or file: URI of a stored document) to be rendered to pdf_path.
+
+        The returned future resolves to True once the PDF is written, False if the render failed.
+        form_type labels the worker's retry and rate-limit counters.
+        """
+        future: Future = Future()
+        self._jobs.put((source, str(pdf_path), form_type, future))
+        return future
+
+    def render(self, source: str, pdf_path, form_type: Optional[str] = None) -> bool:
+        return self.submit(source, pdf_path, form_type).result()
+
+    def _needs_recycle(self, worker: _RenderProcess) -> bool:
+        if worker.jobs >= self.max_jobs:
+            logger.info(f"Recycling render worker {worker.process.pid} after {worker.jobs} documents")
+            return True
+        rss = worker.rss_mb()
+        if rss is not None and rss > self.max_rss_mb:
+            logger.info(f"Recycling render worker {worker.process.pid} at {rss:.0f} MB RSS")
+            return True
+        return False
+
+    def _await_result(self, worker: _RenderProcess) -> Optional[bool]:
+        """The worker's result for its current job, or None once it rendered for longer than job_timeout."""
+        budget = self.job_timeout
+        running_since = time.monotonic()
+        while True:
+            timeout = None if running_since is None else max(0.0, budget - (time.monotonic() - running_since))
+            if not worker.conn.poll(timeout):
+                return None
+            message = worker.conn.recv()
+            if message == _WAITING:
+                budget -= time.monotonic() - running_since
+                running_since = None
+            elif message == _RENDERING:
+                running_since = time.monotonic()
+            else:
+                return message
+
+    def _run_slot(self) -> None:
+        worker = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            source, pdf_path, form_type, future = job
+            if worker is None or not worker.process.is_alive():
+                worker = _RenderProcess(self.headless, self.rate)
+            start = time.perf_counter()
+            try:
+                worker.conn.send((source, pdf_path, form_type))
+                ok = self._await_result(worker)
+                if ok is None:
+                    logger.error(f"Render of {source} exceeded {self.job_timeout}s; killing worker {worker.process.pid}")
+                    metrics.inc("render_timeouts_total")
+                    worker.kill()
+                    worker = None
+                    Path(pdf_path).unlink(missing_ok=True)
+                    ok = False
+            except (OSError, EOFError) as e:
+                logger.error(f"Render worker died while rendering {source}: {e}")
+                worker.kill()
+                worker = None
+                ok = False
+            # Spans inside the worker process are not visible here, so the whole job is timed
+            metrics.observe("render", time.perf_counter() - start)
+            future.set_result(ok)
+            if worker is not None:
+                worker.jobs += 1
+                if self._needs_recycle(worker):
+                    worker.stop()
+                    worker = None
+        if worker is not None:
+            worker.stop()
+
+    def close(self) -> None:
+        """Finish every queued render, then stop the workers."""
+        for _ in self._slots:
+            self._jobs.put(None)
+        for slot in self._slots:
+            slot.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
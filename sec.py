@@ -1,9 +1,21 @@
-from playwright.sync_api import sync_playwright
-import csv
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
+import http_cache
+from browser_pool import BrowserPool
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter, is_lockout_page
+from efts import (EFTS_BASE_URL, ARCHIVES_BASE_URL, SEC_BASE_URL, PAGE_SIZE, EFTSClient, SearchResponseCapture,
+                  archive_url, is_search_response, rebase_url_groups)
+from http_client import create_session
+from latency import default_tracker, page_class
+from checkpoint import CrawlCheckpoint
+from entity_cache import EntityCache
+from page_cache import DEFAULT_HISTORICAL_TTL, DEFAULT_RECENT_TTL, ResultPageCache
+from metrics import metrics
+from sinks import OUTPUT_FORMATS, create_sink, output_path
+import argparse
 import logging
 import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,37 +26,61 @@ logging.basicConfig(
     ]
 )
 
+CSV_HEADERS = [
+    'file_url', 'form_file_name', 'filed', 'reporting_for',
+    'filing_entity_person', 'cik', 'located', 'incorporated',
+    'file_number', 'firm_number', 'form_type'
+]
+
+RESULTS_HEADER_SELECTOR = 'th#filetype.filetype[style=""]:has-text("Form & File")'
+
 class SECDocumentScraper:
-    def __init__(self, output_dir: str = "sec_gov", csv_file: str = 'Master_file.csv', timeout: int = 30000):
+    def __init__(self, output_dir: str = "sec_gov", csv_file: str = 'Master_file.csv', timeout: int = 30000,
+                 extraction_mode: str = "json", rate_limiter: Optional[RateLimiter] = None,
+                 checkpoint: Optional[CrawlCheckpoint] = None,
+                 output_format: Optional[str] = None, verify_urls: bool = False,
+                 on_row: Optional[Callable[[Dict], None]] = None, archives_base: str = ARCHIVES_BASE_URL,
+                 page_cache: Optional[ResultPageCache] = None, entities: Optional[EntityCache] = None):
         self.output_dir = Path(output_dir)
-        self.csv_file = Path(csv_file)
+        self.csv_file = output_path(csv_file, output_format) if output_format else Path(csv_file)
+        self.output_format = output_format
         self.timeout = timeout
+        # "json" reads row metadata from the intercepted search-index response, "dom" reads table cells
+        self.extraction_mode = extraction_mode
+        self.search_capture = SearchResponseCapture()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.checkpoint = checkpoint
+        self._pending_rows: List[tuple] = []
+        # Document URLs built from row data are trusted unless verify_urls asks for a HEAD check
+        self.verify_urls = verify_urls
+        self.archives_base = archives_base
+        self.session = create_session() if verify_urls else None
+        # Called with every manifest row as it is written, e.g. to hand it to pipeline.py's downloaders
+        self.on_row = on_row
+        # Rows extracted from the current results page; memoized once the whole page succeeded
+        self.page_cache = page_cache
+        self._page_entries: List[Dict] = []
+        self._page_complete = False
+        # Set when a row or the page itself failed; the page is then not marked done so a resume redoes it
+        self._page_failed = False
+        # Normalized entity columns keyed by CIK, replacing the free text of each result row
+        self.entities = entities
         self.setup_directories()
         
     def setup_directories(self) -> None:
         try:
             self.output_dir.mkdir(parents=True, exist_ok=True)
-            self._initialize_csv()
+            # Rows are buffered and written in batches; the CSV sink writes the header itself
+            self.sink = create_sink(self.csv_file, CSV_HEADERS, self.output_format)
         except Exception as e:
             logging.error(f"Failed to setup directories: {e}")
             raise
 
-    def _initialize_csv(self) -> None:
-        if not self.csv_file.exists():
-            headers = [
-                'file_url', 'form_file_name', 'filed', 'reporting_for', 
-                'filing_entity_person', 'cik', 'located', 'incorporated', 
-                'file_number', 'firm_number', 'form_type'
-            ]
-            self._write_csv_row(headers, mode='w')
+    def _write_csv_row(self, row: List[str]) -> None:
+        self.sink.write(dict(zip(CSV_HEADERS, row)))
 
-    def _write_csv_row(self, row: List[str], mode: str = 'a') -> None:
-        try:
-            with open(self.csv_file, mode=mode, newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(row)
-        except Exception as e:
-            logging.error(f"Failed to write to CSV: {e}")
+    def close(self) -> None:
+        self.sink.close()
 
     def _safe_wait_and_click(self, page, selector: str, timeout: int = 5000) -> bool:
         try:
@@ -72,34 +108,6 @@ class SECDocumentScraper:
             except Exception as e:
                 logging.warning(f"Checkbox {selector} not found or not clickable: {e}")
 
-    # def _extract_document_metadata(self, page, doc_link=None, row_index=None) -> Dict:
-    #     """Extract metadata for a single document row, merging multiple file and film numbers."""
-    #     try:
-    #         # Fetch all matching elements for file numbers and film numbers
-    #         file_number_elements = page.locator(f"tr:nth-child({row_index + 1}) td.file-num a").all()
-    #         film_number_elements = page.locator(f"tr:nth-child({row_index + 1}) td.film-num").all()
-
-    #         # Combine multiple file numbers and film numbers into a single string
-    #         file_numbers = " ".join(el.text_content().strip() for el in file_number_elements)
-    #         film_numbers = " ".join(el.text_content().strip() for el in film_number_elements)
-
-    #         # Extract other metadata
-    #         row_data = {
-    #             "file_name": doc_link.get_attribute('data-file-name'),
-    #             "file_number": file_numbers,
-    #             "film_number": film_numbers,
-    #             "form_file_name": page.locator(f"tr:nth-child({row_index + 1}) td.filetype a").text_content().strip(),
-    #             "incorporate": page.locator(f"tr:nth-child({row_index + 1}) td.incorporated").text_content().strip(),
-    #             "filed": page.locator(f"tr:nth-child({row_index + 1}) td.filed").text_content().strip(),
-    #             "end_date": page.locator(f"tr:nth-child({row_index + 1}) td.enddate").text_content().strip(),
-    #             "entity_name": page.locator(f"tr:nth-child({row_index + 1}) td.entity-name").text_content().strip(),
-    #             "location": page.locator(f"tr:nth-child({row_index + 1}) td.biz-location.located").text_content().strip(),
-    #             "cik_number": page.locator(f"tr:nth-child({row_index + 1}) td.cik").text_content().strip(),
-    #         }
-    #         return row_data
-    #     except Exception as e:
-    #         logging.error(f"Failed to extract metadata for row {row_index}: {e}")
-    #         return {}
     def _extract_document_metadata(self, page, doc_link=None, row_index=None) -> Dict:
         """Extract metadata for a single document row, merging multiple file and film numbers."""
         try:
@@ -116,35 +124,39 @@ class SECDocumentScraper:
             else:
                 film_numbers = ""
 
-            # Handle incorporated field, replacing <br> with space if present
-            incorporated_element = page.locator(f"tr:nth-child({row_index + 1}) td.incorporated")
-            if incorporated_element:
-                incorporated_html = incorporated_element.inner_html()
-                incorporated = incorporated_html.replace("<br>", " ").strip()
-            else:
-                incorporated = ""
-
-            # Handle located field, replacing <br> with space if present
-            located_element = page.locator(f"tr:nth-child({row_index + 1}) td.biz-location.located")
-            if located_element:
-                located_html = located_element.inner_html()
-                located = located_html.replace("<br>", " ").strip()
-            else:
-                located = ""
+            cik_number = page.locator(f"tr:nth-child({row_index + 1}) td.cik").text_content().strip()
 
             # Extract other metadata
             row_data = {
                 "file_name": doc_link.get_attribute('data-file-name') if doc_link else None,
+                "accession": doc_link.get_attribute('data-adsh') if doc_link else None,
                 "file_number": file_numbers,
                 "film_number": film_numbers,
                 "form_file_name": page.locator(f"tr:nth-child({row_index + 1}) td.filetype a").text_content().strip(),
-                "incorporate": incorporated,  # Store the processed incorporated value here
-                "location": located,  # Store the processed located value here
+                "incorporate": "",
+                "location": "",
                 "filed": page.locator(f"tr:nth-child({row_index + 1}) td.filed").text_content().strip(),
                 "end_date": page.locator(f"tr:nth-child({row_index + 1}) td.enddate").text_content().strip(),
-                "entity_name": page.locator(f"tr:nth-child({row_index + 1}) td.entity-name").text_content().strip(),
-                "cik_number": page.locator(f"tr:nth-child({row_index + 1}) td.cik").text_content().strip(),
+                "entity_name": "",
+                "cik_number": cik_number,
             }
+            # The entity cache supplies name, incorporation and location; write_details fills them in
+            if self.entities and self.entities.has_all(cik_number):
+                return row_data
+
+            # Handle incorporated field, replacing <br> with space if present
+            incorporated_element = page.locator(f"tr:nth-child({row_index + 1}) td.incorporated")
+            if incorporated_element:
+                incorporated_html = incorporated_element.inner_html()
+                row_data["incorporate"] = incorporated_html.replace("<br>", " ").strip()
+
+            # Handle located field, replacing <br> with space if present
+            located_element = page.locator(f"tr:nth-child({row_index + 1}) td.biz-location.located")
+            if located_element:
+                located_html = located_element.inner_html()
+                row_data["location"] = located_html.replace("<br>", " ").strip()
+
+            row_data["entity_name"] = page.locator(f"tr:nth-child({row_index + 1}) td.entity-name").text_content().strip()
             return row_data
         except Exception as e:
             logging.error(f"Failed to extract metadata for row {row_index}: {e}")
@@ -155,10 +167,33 @@ class SECDocumentScraper:
 
 
 
+    def _document_url_from_row(self, details: Dict) -> Optional[str]:
+        """Build the Archives URL from the row's CIK, accession and file name; None if any is missing."""
+        file_url = archive_url(details, self.archives_base)
+        if not file_url or not self.verify_urls:
+            return file_url
+        try:
+            self.rate_limiter.wait()
+            response = self.session.head(file_url, allow_redirects=True, timeout=30)
+            self.rate_limiter.record_response(response.status_code, response.headers)
+            if response.status_code == 200:
+                return file_url
+            logging.warning(f"HEAD {file_url} returned {response.status_code}, falling back to the preview modal")
+        except Exception as e:
+            logging.warning(f"HEAD {file_url} failed, falling back to the preview modal: {e}")
+        return None
+
     def scrape_document(self, page, url_type: str, document_link, details: Dict) -> Optional[str]:
         sanitized_url_type = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in url_type.strip())
         
+        file_url = self._document_url_from_row(details)
+        if file_url:
+            logging.info(f"Document URL built from row data: {file_url}")
+            return file_url
+
         try:
+            self.rate_limiter.wait()  # Opening the preview fetches the document
+            metrics.inc("preview_modal_opens_total", form_type=url_type)
             document_link.click(timeout=5000)
             open_file_selector = "a#open-file"
             open_file_element = page.wait_for_selector(open_file_selector, timeout=10000)
@@ -181,7 +216,180 @@ class SECDocumentScraper:
 
 
 
+    def attach(self, page) -> None:
+        """Start listening for search-index responses on a freshly opened page."""
+        self.search_capture.attach(page)
+
+    def _wait_until_ready(self, page, timeout: int = 10000) -> None:
+        """Return as soon as the results table renders or the search response says it never will."""
+        if self.search_capture.status is None:
+            try:
+                page.wait_for_event("response", predicate=is_search_response, timeout=timeout)
+            except Exception:
+                pass
+        status = self.search_capture.status
+        if status is not None and status != 200:
+            return  # Throttled or failed: load_results_page decides what to do
+        if status == 200 and self.search_capture.rows() == []:
+            return  # Past the last page, nothing will render
+        try:
+            page.wait_for_selector(RESULTS_HEADER_SELECTOR, timeout=timeout)
+        except Exception:
+            pass
+
+    def reached_end(self) -> bool:
+        """True when the last search response loaded had no hits, i.e. the query has no more pages."""
+        return self.search_capture.status == 200 and self.search_capture.rows() == []
+
+    def load_results_page(self, page, url: str, form_type: Optional[str] = None) -> bool:
+        """Load a search results page, backing off while SEC is throttling us.
+
+        Returns True once the results table renders. Returns False past the last page
+        (reached_end() is then True) or after giving up on retries. form_type labels
+        the retry and rate-limit counters.
+        """
+        endpoint = page_class(url)
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.search_capture.reset()
+            self.rate_limiter.wait()
+            start = time.monotonic()
+            try:
+                with metrics.span("goto"):
+                    page.goto(url, wait_until="domcontentloaded", timeout=default_tracker.timeout_ms(endpoint, 60000))
+            except PlaywrightTimeoutError:
+                logging.warning(f"Loading {url} timed out, retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                continue
+            finally:
+                default_tracker.record(endpoint, time.monotonic() - start)
+            with metrics.span("wait_for_results"):
+                self._wait_until_ready(page)
+
+            status = self.search_capture.status
+            if status is not None and self.rate_limiter.record_response(status, self.search_capture.headers, attempt,
+                                                                        form_type) is not None:
+                continue
+            if page.locator(RESULTS_HEADER_SELECTOR).is_visible():
+                return True
+            if self.reached_end():
+                return False
+            if is_lockout_page(page.content()):
+                self.rate_limiter.record_throttle(attempt, form_type=form_type)
+                continue
+            # Hits that have not rendered yet, or no search response at all: load the page again
+            logging.warning(f"Results of {url} did not render, retrying")
+            metrics.inc("retries_total", status="render", form_type=form_type)
+
+        logging.error(f"Giving up on {url} after {self.rate_limiter.max_retries} retries")
+        return False
+
+    def _captured_metadata(self, expected_rows: int) -> Optional[List[Dict]]:
+        """Return row metadata from the captured JSON payload if it lines up with the table."""
+        if self.extraction_mode != "json":
+            return None
+        rows = self.search_capture.rows()
+        if rows is None:
+            logging.info("No search response captured, falling back to DOM extraction")
+            return None
+        if len(rows) != expected_rows:
+            logging.warning(f"Search response has {len(rows)} rows but table has {expected_rows}, "
+                            f"falling back to DOM extraction")
+            return None
+        return rows
+
+    def write_details(self, file_url: str, url_type: str, details: Dict) -> None:
+        if self.entities:
+            details = self.entities.enrich(details)
+        row = [
+            file_url, url_type, details["filed"], details["end_date"],
+            details["entity_name"], details["cik_number"], details["location"],
+            details["incorporate"], details["file_number"], details["film_number"],
+            details["form_file_name"]
+        ]
+        self._write_csv_row(row)
+        self._page_entries.append({"file_url": file_url, "details": details})
+        metrics.document_done(url_type, kind="rows")
+        if self.on_row:
+            self.on_row(dict(zip(CSV_HEADERS, row)))
+
+    def _already_captured(self, details: Dict) -> bool:
+        return bool(self.checkpoint) and self.checkpoint.has_row(details.get("accession"), details.get("file_name"))
+
+    def _record_captured(self, details: Dict) -> None:
+        if self.checkpoint:
+            self._pending_rows.append((details.get("accession"), details.get("file_name")))
+
+    def finish_page(self, query_url: str, page_number: Optional[int]) -> None:
+        """Flush the page's rows to the manifest, then record them and the page in the checkpoint.
+
+        Incremental syncs pass page_number=None: their rows are recorded, but the page
+        progress of the full crawl of the same query is left alone.
+        """
+        self.sink.flush()
+        if self.checkpoint:
+            self.checkpoint.add_rows(query_url, self._pending_rows)
+            if page_number is not None and not self._page_failed:
+                self.checkpoint.mark_page_done(query_url, page_number)
+        self._pending_rows = []
+        self._page_entries = []
+        self._page_failed = False
+
+    def get_document_details_http(self, client: EFTSClient, url: str, url_type: str) -> None:
+        """Write every result of a search URL using the JSON endpoint instead of a browser."""
+        if self.checkpoint and self.checkpoint.is_query_done(url):
+            logging.info(f"Already completed, skipping: {url}")
+            return
+        count = 0
+        start_offset = self.checkpoint.last_page(url) * PAGE_SIZE if self.checkpoint else 0
+        try:
+            for offset, rows in client.iter_pages(url, start_offset):
+                for details in rows:
+                    if self._already_captured(details):
+                        continue
+                    if details.get("file_url"):
+                        self.write_details(details["file_url"], url_type, details)
+                        self._record_captured(details)
+                        count += 1
+                    else:
+                        metrics.inc("failures_total", form_type=url_type, stage="document_url")
+                        logging.warning(f"Could not build document URL for {details.get('accession')}")
+                self.finish_page(url, offset // PAGE_SIZE + 1)
+            if self.checkpoint:
+                self.checkpoint.mark_query_done(url)
+        except Exception as e:
+            logging.error(f"Failed to process {url}: {e}")
+        logging.info(f"Captured {count} documents for {url}")
+
+    def replay_cached_page(self, query_url: str, page_number: int, url_type: str) -> Optional[bool]:
+        """Write a memoized page's rows without the browser.
+
+        Returns None when the page is not cached, False when the cache says the query
+        ended before this page, True once its rows are written.
+        """
+        entries = self.page_cache.get(query_url, page_number) if self.page_cache else None
+        if entries is None:
+            return None
+        logging.info(f"Replaying page {page_number} of {query_url} from the page cache ({len(entries)} rows)")
+        for entry in entries:
+            if not self._already_captured(entry["details"]):
+                self.write_details(entry["file_url"], url_type, entry["details"])
+                self._record_captured(entry["details"])
+        return bool(entries)
+
+    def cache_page(self, query_url: str, page_number: int, last: bool = False) -> None:
+        """Memoize the rows of the page just extracted; `last` records that the query ends here."""
+        if not self.page_cache:
+            return
+        if last:
+            self.page_cache.put(query_url, page_number, [])
+        elif self._page_complete and self._page_entries:
+            self.page_cache.put(query_url, page_number, self._page_entries)
+
     def get_document_details(self, page, url_type: str) -> None:
+        # Only a page whose every row was extracted and written is memoized
+        self._page_entries = []
+        self._page_complete = False
+        self._page_failed = False
         self.ensure_checkboxes_checked(page)
         
         try:
@@ -190,99 +398,203 @@ class SECDocumentScraper:
             document_links = page.locator(link_selector).all()
             
             logging.info(f"Found {len(document_links)} documents on current page")
+            captured = self._captured_metadata(len(document_links))
+            skipped = 0
             
             for i, doc_link in enumerate(document_links):
                 try:
-                    details = self._extract_document_metadata(page, doc_link, i)
-                    file_url = self.scrape_document(page, url_type, doc_link, details)
+                    if captured:
+                        details = captured[i]
+                    else:
+                        with metrics.span("extract_metadata"):
+                            details = self._extract_document_metadata(page, doc_link, i)
+                    if self._already_captured(details):
+                        logging.info(f"Skipping already captured {details.get('accession')} {details.get('file_name')}")
+                        skipped += 1
+                        continue
+                    with metrics.span("document_url"):
+                        file_url = self.scrape_document(page, url_type, doc_link, details)
                     
                     if file_url:
-                        self._write_csv_row([
-                            file_url, url_type, details["filed"], details["end_date"],
-                            details["entity_name"], details["cik_number"], details["location"],
-                            details["incorporate"], details["file_number"], details["film_number"],
-                            details["form_file_name"]
-                        ])
-                    time.sleep(1)  # Add small delay between documents
+                        self.write_details(file_url, url_type, details)
+                        self._record_captured(details)
+                    else:
+                        metrics.inc("failures_total", form_type=url_type, stage="document_url")
+                        self._page_failed = True
                 except Exception as e:
+                    metrics.inc("failures_total", form_type=url_type, stage="document")
                     logging.error(f"Failed to process document {i}: {e}")
+                    self._page_failed = True
                     continue
+
+            self._page_complete = not skipped and len(self._page_entries) == len(document_links)
                     
         except Exception as e:
             logging.error(f"Failed to process page: {e}")
+            self._page_failed = True
 
-def main():
-    url_groups = {
-        '8-K': [
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=8-K",
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=8-K",
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=8-K",
-        ],
-        '10-Q': [
-            "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=10-Q",
-            "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=10-Q",
-            "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=10-Q",
-        ],
-        '10-K': [
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=10-K",
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=10-K",
-           "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=10-K",
-        ]
-        
-    }
+URL_GROUPS = {
+    '8-K': [
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=8-K",
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=8-K",
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=8-K",
+    ],
+    '10-Q': [
+        "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=10-Q",
+        "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=10-Q",
+        "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=10-Q",
+    ],
+    '10-K': [
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2023-12-01&enddt=2024-12-01&filter_forms=10-K",
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2022-12-01&enddt=2023-12-01&filter_forms=10-K",
+       "https://www.sec.gov/edgar/search/#/q=oil&dateRange=custom&startdt=2021-12-01&enddt=2022-12-01&filter_forms=10-K",
+    ]
+}
 
-    scraper = SECDocumentScraper()
-    
+
+def run_http(scraper: SECDocumentScraper, url_groups: Dict[str, List[str]], client: EFTSClient) -> None:
+    for url_type, urls in url_groups.items():
+        logging.info(f"Processing {url_type} URLs")
+        for url in urls:
+            scraper.get_document_details_http(client, url, url_type)
+        logging.info(f"Completed processing {url_type} URLs")
+    logging.info("All URLs processed")
+
+
+def run_browser(scraper: SECDocumentScraper, url_groups: Dict[str, List[str]], headless: bool = True) -> None:
     with sync_playwright() as p:
+        # One browser for the whole run; its context is recycled every few dozen pages
+        pool = BrowserPool(p, headless=headless)
         for url_type, urls in url_groups.items():
             logging.info(f"Processing {url_type} URLs")
             
             for url in urls:
-                browser = p.chromium.launch(headless=False)
-                context = browser.new_context(viewport={'width': 1920, 'height': 1080})
-                page = context.new_page()
-                page_number = 1
-                
-                
+                checkpoint = scraper.checkpoint
+                if checkpoint and checkpoint.is_query_done(url):
+                    logging.info(f"Already completed, skipping: {url}")
+                    continue
+
+                with pool.page() as page:
+                    scraper.attach(page)
+                    page_number = checkpoint.last_page(url) + 1 if checkpoint else 1
+                    if page_number > 1:
+                        logging.info(f"Resuming {url} at page {page_number}")
                 
-                while True:
-                    paginated_url = f"{url}&page={page_number}"
-                    logging.info(f"Processing page {page_number}: {paginated_url}")
+                    while True:
+                        paginated_url = f"{url}&page={page_number}"
+                        logging.info(f"Processing page {page_number}: {paginated_url}")
                     
-                    try:
-                        page.goto(paginated_url, wait_until="domcontentloaded", timeout=60000)
-                        time.sleep(10)  # Allow page to stabilize
-                        
-                        if not page.locator('th#filetype.filetype[style=""]:has-text("Form & File")').is_visible():
-                            logging.info("Please wait for 10 minutes checking for request limit...")
-                            time.sleep(12 * 60) #wait until traffic limit unblocks
-                            page.goto(paginated_url, wait_until="domcontentloaded", timeout=60000)
-                            time.sleep(10)
-                            if not page.locator('th#filetype.filetype[style=""]:has-text("Form & File")').is_visible():
+                        try:
+                            replayed = scraper.replay_cached_page(url, page_number, url_type)
+                            if replayed is False:
+                                logging.info("No more results found (page cache)")
+                                if checkpoint:
+                                    checkpoint.mark_query_done(url)
+                                break
+                            if replayed:
+                                scraper.finish_page(url, page_number)
+                                page_number += 1
+                                continue
+
+                            if not scraper.load_results_page(page, paginated_url, url_type):
+                                # Only a search response saying there are no hits marks the end, not a give-up
+                                if not scraper.reached_end():
+                                    logging.error(f"Could not load {paginated_url}; the query resumes from "
+                                                  f"page {page_number} on the next run")
+                                    break
                                 logging.info("No more results found")
+                                scraper.cache_page(url, page_number, last=True)
+                                if checkpoint:
+                                    checkpoint.mark_query_done(url)
                                 break
-                            
                         
-                        scraper.get_document_details(page, url_type)
-                        page_number += 1
+                            scraper.get_document_details(page, url_type)
+                            page_failed = scraper._page_failed
+                            scraper.cache_page(url, page_number)
+                            scraper.finish_page(url, page_number)
+                            if page_failed:
+                                # Later pages would move last_page past this one, so stop here
+                                logging.error(f"Page {page_number} of {url} did not finish; the query resumes "
+                                              f"from it on the next run")
+                                break
+                            page_number += 1
                         
-                    except Exception as e:
-                        logging.error(f"Failed to process {paginated_url}: {e}")
-                        break
-                    
-                    finally:
-                        time.sleep(5)  # Add delay between pages
-                
-                try:
-                    page.close()
-                    context.close()
-                    browser.close()
-                except Exception as e:
-                    logging.error(f"Error closing browser resources: {e}")
+                        except Exception as e:
+                            logging.error(f"Failed to process {paginated_url}: {e}")
+                            break
             
             logging.info(f"Completed processing {url_type} URLs")
         
+        pool.close()
         logging.info("All URLs processed")
 
+def main():
+    parser = argparse.ArgumentParser(description="Collect EDGAR full-text search results into Master_file.csv")
+    parser.add_argument("--backend", choices=["browser", "http"], default="browser",
+                        help="render search pages in Chromium or call the search JSON endpoint directly")
+    parser.add_argument("--sec-url", default=SEC_BASE_URL,
+                        help="host serving the search UI; URL_GROUPS are pointed at it (e.g. the local fixture server)")
+    parser.add_argument("--efts-url", default=EFTS_BASE_URL, help="base URL of the full-text search endpoint")
+    parser.add_argument("--archives-url", default=ARCHIVES_BASE_URL, help="base URL used to build document links")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="ceiling on requests per second sent to sec.gov")
+    parser.add_argument("--checkpoint", default="crawl_checkpoint.db",
+                        help="SQLite file recording crawl progress so interrupted runs resume")
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint and crawl from page 1")
+    parser.add_argument("--verify-urls", action="store_true",
+                        help="HEAD-check document URLs built from row data instead of trusting them")
+    parser.add_argument("--headed", action="store_true", help="show the browser window instead of running headless")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None,
+                        help="manifest format (default: csv, written to Master_file.csv)")
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically export stage timings and counters (.prom for Prometheus, else JSON)")
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; Archives documents are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    parser.add_argument("--page-cache", default=None, metavar="DB",
+                        help="memoize extracted result pages in this SQLite file; reruns replay them without the browser")
+    parser.add_argument("--page-cache-ttl", type=float, default=DEFAULT_RECENT_TTL / 3600,
+                        help="hours a cached page of a recent date window stays fresh")
+    parser.add_argument("--page-cache-historical-ttl", type=float, default=DEFAULT_HISTORICAL_TTL / 86400,
+                        help="days a cached page of a window that ended over a week ago stays fresh")
+    parser.add_argument("--entities", default=None, metavar="DB",
+                        help="normalize entity name, incorporation and location per CIK from this cache "
+                             "(fill it with: python3 entity_cache.py load submissions.zip)")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
+
+    checkpoint = CrawlCheckpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.reset()
+    entities = EntityCache(args.entities) if args.entities else None
+    page_cache = None
+    if args.page_cache:
+        page_cache = ResultPageCache(args.page_cache, args.page_cache_ttl * 3600,
+                                     args.page_cache_historical_ttl * 86400)
+    scraper = SECDocumentScraper(rate_limiter=RateLimiter(args.rate), checkpoint=checkpoint,
+                                 output_format=args.output_format, verify_urls=args.verify_urls,
+                                 archives_base=args.archives_url, page_cache=page_cache, entities=entities)
+    url_groups = rebase_url_groups(URL_GROUPS, args.sec_url)
+
+    try:
+        with metrics.exporting(args.metrics_file):
+            if args.backend == "http":
+                client = EFTSClient(base_url=args.efts_url, archives_base=args.archives_url,
+                                    rate_limiter=scraper.rate_limiter)
+                try:
+                    run_http(scraper, url_groups, client)
+                finally:
+                    client.close()
+            else:
+                run_browser(scraper, url_groups, headless=not args.headed)
+    finally:
+        scraper.close()
+        checkpoint.close()
+        if page_cache:
+            page_cache.close()
+        if entities:
+            entities.close()
+
 if __name__ == "__main__":
     main()
@@ -1,51 +1,82 @@
-import csv
+import argparse
+import asyncio
 import os
-import time
 import logging
-from playwright.sync_api import sync_playwright
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import urlsplit
+from playwright.async_api import TimeoutError as AsyncPlaywrightTimeoutError, async_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
+from browser_pool import BrowserPool, install_resource_blocking_async
+import http_cache
+from doc_store import DocumentStore
+from efts import accession_from_url
+from http_client import create_session, stream_to_file
+from latency import default_tracker, page_class
+from metrics import metrics
+from sinks import OUTPUT_FORMATS, create_sink, output_path, read_rows
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from render_farm import DEFAULT_JOB_TIMEOUT, DEFAULT_MAX_RSS_MB, RenderFarm
+from segment_store import SegmentStore
 
 # Setup logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
+# Pacing shared by every request this process makes to sec.gov
+default_rate_limiter = RateLimiter()
+
 # Define the headers for the CSV file
 fieldnames = ['file_url', 'file_path', 'form_file_name', 'filed', 'reporting_for', 
               'filing_entity_person', 'cik', 'located', 'incorporated', 
               'file_number', 'firm_number', 'form_type']
 
-# Function to initialize the CSV file with headers
-def create_update_csv(output_csv_file):
-    """Create the CSV file and write headers"""
-    try:
-        with open(output_csv_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            logger.info(f"Headers written to {output_csv_file}")
-    except Exception as e:
-        logger.error(f"Error creating CSV file: {e}")
+# Function to open the output manifest, replacing any previous run's output
+def create_update_sink(output_file, output_format=None):
+    """Create the output sink (CSV, JSONL or Parquet); rows are buffered and written in batches"""
+    sink = create_sink(output_file, fieldnames, output_format, truncate=True)
+    logger.info(f"Writing updated records to {sink.path}")
+    return sink
 
 # Function to download a PDF and save it to the correct location
-def download_pdf(page, file_url, pdf_save_path, retry_count=3):
+def download_pdf(page, file_url, pdf_save_path, retry_count=None, rate_limiter=None, form_type=None):
     """Download the PDF from the URL and save it, retrying in case of failure"""
+    rate_limiter = rate_limiter or default_rate_limiter
+    retry_count = rate_limiter.max_retries if retry_count is None else retry_count
+    endpoint = page_class(file_url)
+    response = None
     try:
-        response = page.goto(file_url)
-        logger.info(f"Request URL: {file_url} - Status Code: {response.status}")
-
-        # Retry logic for status codes like 403 or other error codes
-        while response.status in [403, 500, 503, 504] and retry_count > 0:
-            logger.warning(f"Error {response.status} encountered. Retrying in 15 minutes...")
-            time.sleep(15 * 60)  # Wait for 15 minutes
-            page.reload()  # Refresh the page
-            response = page.goto(file_url)
-            retry_count -= 1
-
-        if response.status == 200:
-            page.wait_for_load_state("load")
-            page.pdf(path=pdf_save_path, format='A4')  # Save PDF in A4 format
+        # Retry with backoff (or Retry-After) while SEC throttles us or errors out
+        for attempt in range(retry_count + 1):
+            # A cached Archives document is served by the route handler and spends no request
+            if not http_cache.served_offline(file_url):
+                rate_limiter.wait()
+            # The timeout follows observed load times, so a stuck fetch is retried instead of blocking
+            start = time.monotonic()
+            try:
+                with metrics.span("goto"):
+                    response = page.goto(file_url, timeout=default_tracker.timeout_ms(endpoint, 30000))
+            except PlaywrightTimeoutError:
+                logger.warning(f"Loading {file_url} timed out, retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                response = None
+                continue
+            finally:
+                default_tracker.record(endpoint, time.monotonic() - start)
+            logger.info(f"Request URL: {file_url} - Status Code: {response.status}")
+            if rate_limiter.record_response(response.status, response.headers, attempt, form_type) is None:
+                break
+
+        if response is not None and response.status == 200:
+            with metrics.span("pdf"):
+                page.wait_for_load_state("load")
+                page.pdf(path=pdf_save_path, format='A4')  # Save PDF in A4 format
             logger.info(f"Saved PDF to {pdf_save_path}.")
             return True
         else:
-            logger.error(f"Failed to load {file_url}: Status Code {response.status}")
+            status = f"Status Code {response.status}" if response is not None else "timed out"
+            logger.error(f"Failed to load {file_url}: {status}")
             return False
     except Exception as e:
         logger.error(f"Error downloading PDF from {file_url}: {e}")
@@ -59,69 +90,421 @@ def create_directories(form_file_name, parent_dir):
     os.makedirs(form_type_dir, exist_ok=True)  # Create directory if it doesn't exist
     return form_type_dir, directory_name
 
-# Function to update the CSV file with the download result
-def update_csv_file(output_csv_file, row):
-    """Append updated row to the CSV file after PDF download"""
-    try:
-        with open(output_csv_file, mode='a', newline='', encoding='utf-8') as output_file:
-            writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-            writer.writerow(row)
-            logger.info(f"Updated record for {row['file_url']} in the CSV.")
-    except Exception as e:
-        logger.error(f"Error updating CSV file: {e}")
+# Function to build the save path for a manifest row
+def build_save_path(row, parent_dir, extension='.pdf'):
+    """Return the path a row's document is saved to, creating its form type directory"""
+    form_file_name = row['form_file_name']
+    form_type_dir, directory_name = create_directories(form_file_name, parent_dir)
+
+    # Create a custom file name for saving the document with form_type included
+    custom_file_name = f"{row['form_type']}_{form_file_name}_{row['file_number']}_{row['firm_number']}{extension}"
+    custom_file_name = custom_file_name.replace('/', '_').replace('\\', '_')  # Sanitize the file name
+    return os.path.join(form_type_dir, custom_file_name)
+
+# Function to find the key a row is indexed under in the document store
+def store_key(row, variant=''):
+    """Return (accession, file name) for a row; variant '.pdf' keys the rendered PDF of the document"""
+    key = accession_from_url(row['file_url'])
+    if key is None:
+        return None
+    accession, file_name = key
+    return accession, f"{file_name}{variant}"
+
+# Function to resolve a row from the document store before any network or browser work
+def resolve_from_store(store, row, variant=''):
+    """Return the row's view path if the document is already stored, else None"""
+    key = store_key(row, variant) if store else None
+    object_path = store.lookup(*key) if key else None
+    if object_path is None:
+        return None
+    form_type_dir, directory_name = create_directories(row['form_file_name'], str(store.root))
+    view_path = store.link(object_path, store.view_path(directory_name, *key))
+    logger.info(f"{row['file_url']} resolved from the document store.")
+    return str(view_path)
+
+# Function to move a finished download into the document store
+def add_to_store(store, row, downloaded_path, variant=''):
+    """Store the downloaded file (once per distinct content) and return its per-form-type view path"""
+    key = store_key(row, variant)
+    object_path = store.put_file(*key, downloaded_path)
+    form_type_dir, directory_name = create_directories(row['form_file_name'], str(store.root))
+    return str(store.link(object_path, store.view_path(directory_name, *key)))
+
+# Function to record the download result of a row
+def update_output(sink, row):
+    """Queue the updated row for the next batch write to the output manifest"""
+    if row.get('file_path') == 'Failed to download':
+        metrics.inc("failures_total", form_type=row.get('form_file_name'), stage="download")
+    else:
+        metrics.document_done(row.get('form_file_name'))
+    sink.write(row)
+    logger.info(f"Updated record for {row.get('file_url')}.")
+
+# Function to download one manifest row as a PDF on a page borrowed from the pool
+def fetch_pdf_row(pool, row, parent_dir, rate_limiter=None, store=None):
+    """Set row['file_path'] to the rendered PDF, resolving it from the store when already kept there"""
+    stored = resolve_from_store(store, row, '.pdf')
+    if stored:
+        row['file_path'] = stored
+        return row
+    use_store = store is not None and store_key(row) is not None
+    pdf_save_path = store.temp_path('.pdf') if use_store else build_save_path(row, parent_dir)
+
+    # Try downloading the PDF
+    with pool.page() as page:
+        if download_pdf(page, row['file_url'], pdf_save_path, rate_limiter=rate_limiter,
+                        form_type=row['form_file_name']):
+            # Update the row with the file path
+            row['file_path'] = add_to_store(store, row, pdf_save_path, '.pdf') if use_store else pdf_save_path
+        else:
+            row['file_path'] = 'Failed to download'
+    return row
 
 # Main function to process CSV file and download documents
-def download_documents_from_csv(csv_file, output_csv_file):
-    """Download documents from URLs and update the CSV file with the file path"""
+def download_documents_from_csv(csv_file, sink, rate_limiter=None, headless=True, store=None):
+    """Download documents from URLs and update the output manifest with the file path"""
     parent_dir = 'sec_gov'  # Root directory for the PDFs
     os.makedirs(parent_dir, exist_ok=True)  # Create the root directory if not exists
 
     try:
-        with open(csv_file, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=False)  # Launch browser in non-headless mode
-                context = browser.new_context()
-
-                for row in reader:
-                    file_url = row['file_url']
-                    form_file_name = row['form_file_name']
-                    form_type = row['form_type']
-                    form_type_dir, directory_name = create_directories(form_file_name, parent_dir)
-
-                    # Create a custom file name for saving the PDF with form_type included
-                    custom_file_name = f"{form_type}_{form_file_name}_{row['file_number']}_{row['firm_number']}.pdf"
-                    custom_file_name = custom_file_name.replace('/', '_').replace('\\', '_')  # Sanitize the file name
-                    pdf_save_path = os.path.join(form_type_dir, custom_file_name)
-
-                    # Try downloading the PDF
-                    page = context.new_page()
-                    if download_pdf(page, file_url, pdf_save_path):
-                        row['file_path'] = pdf_save_path  # Update the row with the file path
+        reader = read_rows(csv_file)
+        with sync_playwright() as p:
+            # The printed PDF needs the document's images and fonts, so only trackers are blocked
+            pool = BrowserPool(p, headless=headless, blocked_resource_types=())
+
+            for row in reader:
+                fetch_pdf_row(pool, row, parent_dir, rate_limiter, store)
+                # Queue the updated row for the next batch write
+                update_output(sink, row)
+
+            pool.close()
+        logger.info(f"Download process completed. Updated manifest saved to {sink.path}")
+    
+    except Exception as e:
+        logger.error(f"Error processing CSV file: {e}")
+
+# Out-of-process counterpart of download_documents_from_csv
+def download_documents_farm(csv_file, sink, farm, store=None):
+    """Hand every row to the render farm; rows are written to the manifest as their renders finish"""
+    parent_dir = 'sec_gov'
+    os.makedirs(parent_dir, exist_ok=True)
+
+    def finish(row, pdf_save_path, use_store, future):
+        if future.result():
+            row['file_path'] = add_to_store(store, row, pdf_save_path, '.pdf') if use_store else pdf_save_path
+        else:
+            row['file_path'] = 'Failed to download'
+        update_output(sink, row)
+
+    try:
+        for row in read_rows(csv_file):
+            stored = resolve_from_store(store, row, '.pdf')
+            if stored:
+                row['file_path'] = stored
+                update_output(sink, row)
+                continue
+            use_store = store is not None and store_key(row) is not None
+            pdf_save_path = store.temp_path('.pdf') if use_store else build_save_path(row, parent_dir)
+            future = farm.submit(row['file_url'], pdf_save_path, row['form_file_name'])
+            future.add_done_callback(lambda f, row=row, path=pdf_save_path, use_store=use_store:
+                                     finish(row, path, use_store, f))
+        farm.close()
+        logger.info(f"Download process completed. Updated manifest saved to {sink.path}")
+    except Exception as e:
+        logger.error(f"Error processing CSV file: {e}")
+
+# Async variant of download_pdf used by the concurrent workers
+async def download_pdf_async(page, file_url, pdf_save_path, rate_limiter, retry_count=None, form_type=None):
+    """Download the PDF from the URL within the shared request budget, retrying in case of failure"""
+    retry_count = rate_limiter.max_retries if retry_count is None else retry_count
+    endpoint = page_class(file_url)
+    response = None
+    try:
+        for attempt in range(retry_count + 1):
+            if not http_cache.served_offline(file_url):
+                await rate_limiter.wait_async()
+            start = time.monotonic()
+            try:
+                with metrics.span("goto"):
+                    response = await page.goto(file_url, timeout=default_tracker.timeout_ms(endpoint, 30000))
+            except AsyncPlaywrightTimeoutError:
+                logger.warning(f"Loading {file_url} timed out, retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                response = None
+                continue
+            finally:
+                default_tracker.record(endpoint, time.monotonic() - start)
+            logger.info(f"Request URL: {file_url} - Status Code: {response.status}")
+            if rate_limiter.record_response(response.status, response.headers, attempt, form_type) is None:
+                break
+
+        if response is not None and response.status == 200:
+            with metrics.span("pdf"):
+                await page.wait_for_load_state("load")
+                await page.pdf(path=pdf_save_path, format='A4')
+            logger.info(f"Saved PDF to {pdf_save_path}.")
+            return True
+        else:
+            status = f"Status Code {response.status}" if response is not None else "timed out"
+            logger.error(f"Failed to load {file_url}: {status}")
+            return False
+    except Exception as e:
+        logger.error(f"Error downloading PDF from {file_url}: {e}")
+        return False
+
+async def _download_worker(worker_id, context, queue, rate_limiter, sink, parent_dir, store=None):
+    """Pull manifest rows off the queue and download them on one long-lived page"""
+    page = await context.new_page()
+    try:
+        while True:
+            row = await queue.get()
+            try:
+                pdf_save_path = build_save_path(row, parent_dir)
+                stored = resolve_from_store(store, row, '.pdf')
+                use_store = store is not None and store_key(row) is not None
+                if stored:
+                    row['file_path'] = stored
+                elif use_store:
+                    tmp_path = store.temp_path('.pdf')
+                    if await download_pdf_async(page, row['file_url'], tmp_path, rate_limiter,
+                                                form_type=row['form_file_name']):
+                        row['file_path'] = add_to_store(store, row, tmp_path, '.pdf')
                     else:
                         row['file_path'] = 'Failed to download'
+                elif os.path.exists(pdf_save_path):
+                    logger.info(f"Worker {worker_id}: {pdf_save_path} already exists, skipping download.")
+                    row['file_path'] = pdf_save_path
+                elif await download_pdf_async(page, row['file_url'], pdf_save_path, rate_limiter,
+                                              form_type=row['form_file_name']):
+                    row['file_path'] = pdf_save_path
+                else:
+                    row['file_path'] = 'Failed to download'
+                # Rows finish out of order; each one carries its own file_url so the output needs no ordering
+                update_output(sink, row)
+            except Exception as e:
+                # One bad row (a malformed manifest entry, a failed store link) must not end the worker
+                logger.error(f"Worker {worker_id}: failed to download {row.get('file_url')}: {e}")
+                row['file_path'] = 'Failed to download'
+                update_output(sink, row)
+            finally:
+                queue.task_done()
+    finally:
+        await page.close()
 
-                    # Update the CSV file immediately after download
-                    update_csv_file(output_csv_file, row)
+async def _download_concurrently(csv_file, sink, concurrency, rate_limiter, store=None):
+    parent_dir = 'sec_gov'
+    os.makedirs(parent_dir, exist_ok=True)
+    # Bounded so the reader never gets far ahead of the workers on huge manifests
+    queue = asyncio.Queue(maxsize=concurrency * 2)
 
-                    page.close()
-                    time.sleep(2)  # Simulate a delay to avoid rate limiting
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context()
+        await install_resource_blocking_async(context, ())
+        if http_cache.default_cache is not None:
+            await http_cache.install_http_cache_async(context, http_cache.default_cache)
+        workers = [
+            asyncio.create_task(_download_worker(i, context, queue, rate_limiter, sink, parent_dir, store))
+            for i in range(concurrency)
+        ]
+        try:
+            for row in read_rows(csv_file):
+                await queue.put(row)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await browser.close()
 
-                browser.close()
-        logger.info(f"Download process completed. Updated CSV saved to {output_csv_file}")
-    
+# Concurrent counterpart of download_documents_from_csv
+def download_documents_concurrently(csv_file, sink, concurrency=4, rate_limiter=None, store=None):
+    """Download documents with a bounded pool of pages sharing one request budget"""
+    rate_limiter = rate_limiter or default_rate_limiter
+    try:
+        asyncio.run(_download_concurrently(csv_file, sink, concurrency, rate_limiter, store))
+        logger.info(f"Download process completed. Updated manifest saved to {sink.path}")
+    except Exception as e:
+        logger.error(f"Error processing CSV file: {e}")
+
+# Function to pick the file extension of the original document
+def raw_extension(file_url):
+    """Return the extension of the document behind a URL (.htm, .txt, .pdf, ...)"""
+    extension = os.path.splitext(urlsplit(file_url).path)[1]
+    return extension.lower() if extension else '.htm'
+
+# Function to stream one manifest row's original document over HTTP
+def fetch_raw_row(session, row, parent_dir, rate_limiter, store=None, segments=None):
+    """Set row['file_path'] to the raw document, resolving it from the store when already kept there"""
+    stored = resolve_from_store(store, row)
+    key = store_key(row) if segments is not None else None
+    if stored:
+        row['file_path'] = stored
+    elif key is not None:
+        # Packed into a segment file instead of one file per document
+        if key in segments:
+            logger.info(f"{row['file_url']} is already packed, skipping download.")
+            row['file_path'] = segments.location(*key)
+        else:
+            tmp_path = segments.temp_path()
+            if stream_to_file(session, row['file_url'], tmp_path, rate_limiter, form_type=row['form_file_name']):
+                row['file_path'] = segments.put_file(*key, tmp_path)
+            else:
+                row['file_path'] = 'Failed to download'
+    elif store is not None and store_key(row) is not None:
+        tmp_path = store.temp_path()
+        if stream_to_file(session, row['file_url'], tmp_path, rate_limiter, form_type=row['form_file_name']):
+            row['file_path'] = add_to_store(store, row, tmp_path)
+        else:
+            row['file_path'] = 'Failed to download'
+    else:
+        save_path = build_save_path(row, parent_dir, raw_extension(row['file_url']))
+        if os.path.exists(save_path):
+            logger.info(f"{save_path} already exists, skipping download.")
+            row['file_path'] = save_path
+        elif stream_to_file(session, row['file_url'], save_path, rate_limiter, form_type=row['form_file_name']):
+            row['file_path'] = save_path
+        else:
+            row['file_path'] = 'Failed to download'
+    return row
+
+# Raw counterpart of download_documents_from_csv: original bytes over HTTP, no browser
+def download_documents_raw(csv_file, sink, concurrency=1, rate_limiter=None, store=None, segments=None):
+    """Stream the original documents to disk and update the CSV file with the file path"""
+    rate_limiter = rate_limiter or default_rate_limiter
+    parent_dir = 'sec_gov'
+    os.makedirs(parent_dir, exist_ok=True)
+    workers = max(concurrency, 1)
+    session = create_session(pool_size=workers)
+
+    def fetch(row):
+        try:
+            fetch_raw_row(session, row, parent_dir, rate_limiter, store, segments)
+        except Exception as e:
+            logger.error(f"Failed to download {row.get('file_url')}: {e}")
+            row['file_path'] = 'Failed to download'
+        update_output(sink, row)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for row in read_rows(csv_file):
+                # Bounded so the reader never gets far ahead of the workers on huge manifests
+                if len(pending) >= workers * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(executor.submit(fetch, row))
+            wait(pending)
+        logger.info(f"Download process completed. Updated manifest saved to {sink.path}")
     except Exception as e:
         logger.error(f"Error processing CSV file: {e}")
+    finally:
+        session.close()
+
+# Optional post-processing step that prints already downloaded documents to PDF
+def render_pdfs(updated_file, farm=None):
+    """Render every raw HTML/text document listed in the updated manifest to a PDF next to it"""
+    try:
+        paths = [Path(row['file_path']) for row in read_rows(updated_file)]
+        paths = [path for path in paths if path.suffix in ('.htm', '.html', '.txt') and path.exists()]
+
+        if farm is not None:
+            for path in paths:
+                if not path.with_suffix('.pdf').exists():
+                    farm.submit(path.resolve().as_uri(), path.with_suffix('.pdf'))
+            farm.close()
+            return
+
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=True)
+            context = browser.new_context()
+            # Rendering is offline: never let a stored document pull resources from sec.gov
+            context.route("http*://**/*", lambda route: route.abort())
+            page = context.new_page()
+            for path in paths:
+                pdf_path = path.with_suffix('.pdf')
+                if pdf_path.exists():
+                    continue
+                try:
+                    page.goto(path.resolve().as_uri(), wait_until="load")
+                    page.pdf(path=str(pdf_path), format='A4')
+                    logger.info(f"Rendered {path} to {pdf_path}.")
+                except Exception as e:
+                    logger.error(f"Error rendering {path}: {e}")
+            browser.close()
+    except Exception as e:
+        logger.error(f"Error rendering PDFs from {updated_file}: {e}")
 
 # Main entry point
 if __name__ == '__main__':
-    # Define paths to input and output CSV files
-    csv_file = 'Master_file.csv'  # Replace with your actual CSV file path
-    output_csv_file = 'Updated_Master_file.csv'  # Desired output CSV file
+    parser = argparse.ArgumentParser(description="Download the documents listed in Master_file.csv")
+    parser.add_argument("--mode", choices=["pdf", "raw"], default="pdf",
+                        help="print each document to PDF in a browser, or stream its original bytes over HTTP")
+    parser.add_argument("--render-pdfs", action="store_true",
+                        help="only render the raw documents already listed in Updated_Master_file.csv to PDF")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of documents downloading in parallel (1 keeps the sequential downloader)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="ceiling on requests per second shared by all workers")
+    parser.add_argument("--store", action="store_true",
+                        help="keep documents in a deduplicated store keyed by accession number, "
+                             "hardlinked into the per-form-type folders")
+    parser.add_argument("--segments", action="store_true",
+                        help="with --mode raw, pack documents compressed into segment files under sec_gov/segments "
+                             "instead of writing one file each")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="render PDFs in this many separate browser processes (0 renders in-process)")
+    parser.add_argument("--render-timeout", type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help="seconds of rendering, rate limiter waits excluded, before a render is killed with its browser")
+    parser.add_argument("--render-max-rss", type=float, default=DEFAULT_MAX_RSS_MB,
+                        help="MB of browser memory after which a render worker is restarted")
+    parser.add_argument("--headed", action="store_true", help="show the browser window instead of running headless")
+    parser.add_argument("--input", default="Master_file.csv",
+                        help="manifest written by sec.py (.csv, .jsonl or .parquet)")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None,
+                        help="format of the updated manifest (default: csv, Updated_Master_file.csv)")
+    parser.add_argument("--metrics-file", default=None,
+                        help="periodically export stage timings and counters (.prom for Prometheus, else JSON)")
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; Archives documents are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
 
-    # Step 1: Create the update CSV file with headers
-    create_update_csv(output_csv_file)
+    # Define paths to input and output manifest files
+    csv_file = args.input
+    output_file = 'Updated_Master_file.csv'  # Desired output CSV file
+    if args.output_format:
+        output_file = output_path(output_file, args.output_format)
+
+    farm = None
+    if args.render_workers > 0 and (args.mode == "pdf" or args.render_pdfs):
+        farm = RenderFarm(args.render_workers, max_rss_mb=args.render_max_rss,
+                          job_timeout=args.render_timeout, rate=args.rate, headless=not args.headed)
+
+    with metrics.exporting(args.metrics_file):
+        if args.render_pdfs:
+            render_pdfs(output_file, farm)
+        else:
+            # Step 1: Create the output manifest, replacing the previous run's
+            sink = create_update_sink(output_file, args.output_format)
 
-    # Step 2: Download documents and update the CSV file
-    download_documents_from_csv(csv_file, output_csv_file)
+            # Step 2: Download documents and update the output manifest
+            rate_limiter = RateLimiter(args.rate)
+            store = DocumentStore('sec_gov') if args.store else None
+            segments = SegmentStore(os.path.join('sec_gov', 'segments')) if args.segments else None
+            try:
+                if args.mode == "raw":
+                    download_documents_raw(csv_file, sink, args.concurrency, rate_limiter, store, segments)
+                elif farm is not None:
+                    download_documents_farm(csv_file, sink, farm, store)
+                elif args.concurrency > 1:
+                    download_documents_concurrently(csv_file, sink, args.concurrency, rate_limiter, store)
+                else:
+                    download_documents_from_csv(csv_file, sink, rate_limiter, headless=not args.headed, store=store)
+            finally:
+                sink.close()
+                if store:
+                    store.close()
+                if segments:
+                    segments.close()
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+from efts import accession_from_url
+from sinks import create_sink, read_rows
+
+logger = logging.getLogger(__name__)
+
+# A segment is closed and a new one started once it grows past this
+DEFAULT_SEGMENT_SIZE = 1024 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# Record in a segment: magic, accession length, file name length, compressed length,
+# uncompressed size, CRC32 of the uncompressed bytes; then accession, file name, payload
+RECORD_MAGIC = b"SECR"
+RECORD_HEADER = struct.Struct("<4sHHIII")
+# Entry in a segment's .idx file: key digest, payload offset, compressed length, uncompressed size
+INDEX_ENTRY = struct.Struct("<20sQII")
+# Manifest rows point into the store as "<root>#<accession>/<file name>"
+LOCATION_SEPARATOR = "#"
+
+
+class Entry(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    size: int
+
+
+def document_key(accession: str, file_name: str) -> bytes:
+    return hashlib.sha1(f"{accession}/{file_name}".encode("utf-8")).digest()
+
+
+class SegmentStore:
+    """Append-only store packing compressed documents into large segment files.
+
+    Instead of one file per document in a flat per-form-type directory, each document
+    is zlib-compressed on its own and appended to `segment-NNNNN.seg`, and a fixed-width
+    entry (key digest, offset, lengths) goes to the segment's `.idx` file. Opening the
+    store loads those entries into memory; `read` then decompresses just one record
+    out of a memory-mapped segment. Records carry their own header, so a lost index can
+    be rebuilt by scanning the segment (`rebuild_index`).
+    """
+
+    def __init__(self, root: str = "sec_gov/segments", segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self._index: Dict[bytes, Entry] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+        segments = sorted(int(path.stem.split("-")[1]) for path in self.root.glob("segment-*.seg"))
+        for number in segments:
+            if not self._index_path(number).exists():
+                self.rebuild_index(number)
+            self._load_index(number)
+        self._active = segments[-1] if segments else 0
+        self._truncate_torn_tail(self._active)
+        self._writer = open(self._segment_path(self._active), "ab")
+        self._index_writer = open(self._index_path(self._active), "ab")
+
+    def _segment_path(self, number: int) -> Path:
+        return self.root / f"segment-{number:05d}.seg"
+
+    def _index_path(self, number: int) -> Path:
+        return self.root / f"segment-{number:05d}.idx"
+
+    def _load_index(self, number: int) -> None:
+        data = self._index_path(number).read_bytes()
+        # A trailing partial entry is the remains of an interrupted append
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for key, offset, length, size in INDEX_ENTRY.iter_unpack(data[:usable]):
+            self._index[key] = Entry(number, offset, length, size)
+
+    def _truncate_torn_tail(self, number: int) -> None:
+        """Drop bytes past the last indexed record, left by a crash between the two appends."""
+        path = self._segment_path(number)
+        if not path.exists():
+            return
+        end = max((entry.offset + entry.length for entry in self._index.values() if entry.segment == number),
+                  default=0)
+        if path.stat().st_size > end:
+            logger.warning(f"Truncating {path} from {path.stat().st_size} to {end} bytes after an interrupted write")
+            with open(path, "r+b") as file:
+                file.truncate(end)
+        index_path = self._index_path(number)
+        if index_path.exists() and index_path.stat().st_size % INDEX_ENTRY.size:
+            with open(index_path, "r+b") as file:
+                file.truncate(index_path.stat().st_size - index_path.stat().st_size % INDEX_ENTRY.size)
+
+    def _scan(self, number: int) -> Iterator[Tuple[str, str, Entry]]:
+        with open(self._segment_path(number), "rb") as file:
+            position = 0
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                magic, accession_len, name_len, length, size, _ = RECORD_HEADER.unpack(header)
+                if magic != RECORD_MAGIC:
+                    logger.error(f"Corrupt record at byte {position} of {self._segment_path(number)}")
+                    return
+                accession = file.read(accession_len).decode("utf-8")
+                file_name = file.read(name_len).decode("utf-8")
+                offset = position + RECORD_HEADER.size + accession_len + name_len
+                if len(file.read(length)) < length:
+                    return
+                yield accession, file_name, Entry(number, offset, length, size)
+                position = offset + length
+
+    def rebuild_index(self, number: int) -> int:
+        """Recreate a segment's .idx file from the record headers in the segment itself."""
+        count = 0
+        with open(self._index_path(number), "wb") as index_file:
+            for accession, file_name, entry in self._scan(number):
+                index_file.write(INDEX_ENTRY.pack(document_key(accession, file_name), entry.offset,
+                                                  entry.length, entry.size))
+                count += 1
+        logger.info(f"Rebuilt the index of {self._segment_path(number)} ({count} documents)")
+        return count
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return document_key(*key) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def location(self, accession: str, file_name: str) -> str:
+        """The string stored in a manifest's file_path for a document kept in this store."""
+        return f"{self.root}{LOCATION_SEPARATOR}{accession}/{file_name}"
+
+    def put(self, accession: str, file_name: str, data: bytes) -> str:
+        """Compress and append a document unless it is already stored; returns its location."""
+        key = document_key(accession, file_name)
+        payload = zlib.compress(data, COMPRESSION_LEVEL)
+        names = accession.encode("utf-8") + file_name.encode("utf-8")
+        with self._lock:
+            if key in self._index:
+                return self.location(accession, file_name)
+            if self._writer.tell() and self._writer.tell() + len(payload) > self.segment_size:
+                self._roll()
+            header = RECORD_HEADER.pack(RECORD_MAGIC, len(accession.encode("utf-8")), len(file_name.encode("utf-8")),
+                                        len(payload), len(data), zlib.crc32(data))
+            offset = self._writer.tell() + len(header) + len(names)
+            self._writer.write(header + names + payload)
+            self._writer.flush()
+            # The index entry is written last, so a crash never indexes a partial record
+            self._index_writer.write(INDEX_ENTRY.pack(key, offset, len(payload), len(data)))
+            self._index_writer.flush()
+            self._index[key] = Entry(self._active, offset, len(payload), len(data))
+        return self.location(accession, file_name)
+
+    def temp_path(self, suffix: str = ".tmp") -> str:
+        """A scratch path for a download that put_file will pack."""
+        return str(self.root / f".{uuid.uuid4().hex}{suffix}")
+
+    def put_file(self, accession: str, file_name: str, src_path) -> str:
+        """Pack a downloaded file into the store and remove the loose copy."""
+        location = self.put(accession, file_name, Path(src_path).read_bytes())
+        os.remove(src_path)
+        return location
+
+    def _roll(self) -> None:
+        self._writer.close()
+        self._index_writer.close()
+        self._active += 1
+        self._writer = open(self._segment_path(self._active), "ab")
+        self._index_writer = open(self._index_path(self._active), "ab")
+        logger.info(f"Started segment {self._segment_path(self._active)}")
+
+    def _map(self, entry: Entry) -> mmap.mmap:
+        mapped = self._maps.get(entry.segment)
+        # The active segment grows after it is mapped; remap to see the new records
+        if mapped is None or len(mapped) < entry.offset + entry.length:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(entry.segment), "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[entry.segment] = mapped
+        return mapped
+
+    def read(self, accession: str, file_name: str) -> Optional[bytes]:
+        """Return a document's bytes, or None if it is not stored."""
+        entry = self._index.get(document_key(accession, file_name))
+        if entry is None:
+            return None
+        header_offset = entry.offset - len(accession.encode("utf-8")) - len(file_name.encode("utf-8")) - RECORD_HEADER.size
+        with self._lock:
+            self._writer.flush()
+            mapped = self._map(entry)
+            header = RECORD_HEADER.unpack_from(mapped, header_offset)
+            payload = mapped[entry.offset:entry.offset + entry.length]
+        data = zlib.decompress(payload)
+        if header[0] != RECORD_MAGIC or len(data) != entry.size or zlib.crc32(data) != header[5]:
+            raise ValueError(f"Stored copy of {accession}/{file_name} is corrupt")
+        return data
+
+    def read_location(self, location: str) -> Optional[bytes]:
+        """Read a document by the location string a manifest holds in its file_path column."""
+        _, _, key = location.partition(LOCATION_SEPARATOR)
+        accession, _, file_name = key.partition("/")
+        return self.read(accession, file_name)
+
+    def export(self, accession: str, file_name: str, dest) -> bool:
+        """Write a stored document out as a regular file (e.g. to render it to PDF)."""
+        data = self.read(accession, file_name)
+        if data is None:
+            return False
+        Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        Path(dest).write_bytes(data)
+        return True
+
+    def sync(self) -> None:
+        """fsync the active segment and its index, e.g. before deleting the loose copies just packed."""
+        with self._lock:
+            for file in (self._writer, self._index_writer):
+                file.flush()
+                os.fsync(file.fileno())
+
+    def stats(self) -> Dict[str, float]:
+        segments = sorted(self.root.glob("segment-*.seg"))
+        stored = sum(path.stat().st_size for path in segments)
+        original = sum(entry.size for entry in self._index.values())
+        return {"documents": len(self._index), "segments": len(segments), "stored_bytes": stored,
+                "original_bytes": original, "ratio": round(original / stored, 2) if stored else 0.0}
+
+    def close(self) -> None:
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+            self._writer.close()
+            self._index_writer.close()
+
+
+def is_location(file_path: str) -> bool:
+    return LOCATION_SEPARATOR in (file_path or "")
+
+
+def _replace_manifest(manifest: Path, new_manifest: Path) -> None:
+    # A Parquet manifest is a directory, which os.replace cannot swap over a non-empty one
+    if manifest.is_dir():
+        old = manifest.with_name(f".{manifest.name}.old")
+        os.replace(manifest, old)
+        os.replace(new_manifest, manifest)
+        shutil.rmtree(old)
+    else:
+        os.replace(new_manifest, manifest)
+
+
+def pack_manifest(store: SegmentStore, manifest, remove: bool = False) -> int:
+    """Pack the loose documents listed in an updated manifest into the store.
+
+    The manifest is rewritten to a temporary file with the packed rows' file_path
+    pointing into the store, then swapped into place. Loose copies are only deleted
+    (with remove) after that, so every row always points at a file that exists.
+    """
+    manifest = Path(manifest)
+    output_format = manifest.suffix.lstrip(".") or "csv"
+    new_manifest = manifest.with_name(f".{manifest.name}.packing")
+    packed = 0
+    loose = []
+    sink = None
+    try:
+        for row in read_rows(manifest):
+            if sink is None:
+                sink = create_sink(new_manifest, list(row), output_format, batch_size=1000, truncate=True)
+            path = Path(row.get("file_path") or "")
+            key = accession_from_url(row.get("file_url") or "")
+            if key is not None and not is_location(row.get("file_path")) and path.is_file():
+                accession, file_name = key
+                if path.suffix == ".pdf" and not file_name.endswith(".pdf"):
+                    file_name = f"{file_name}.pdf"
+                row["file_path"] = store.put(accession, file_name, path.read_bytes())
+                loose.append(path)
+                packed += 1
+            sink.write(row)
+    finally:
+        if sink is not None:
+            sink.close()
+    if packed:
+        store.sync()
+        _replace_manifest(manifest, new_manifest)
+    elif sink is not None:
+        shutil.rmtree(new_manifest) if new_manifest.is_dir() else new_manifest.unlink()
+    if remove:
+        for path in loose:
+            path.unlink(missing_ok=True)
+    logger.info(f"Packed {packed} documents from {manifest}")
+    return packed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack downloaded documents into compressed segment files")
+    parser.add_argument("--root", default="sec_gov/segments")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="pack the loose documents listed in a manifest")
+    pack.add_argument("--manifest", default="Updated_Master_file.csv")
+    pack.add_argument("--remove", action="store_true", help="delete the loose files once they are packed and the manifest points into the store")
+    get = commands.add_parser("get", help="write one stored document to a file")
+    get.add_argument("accession")
+    get.add_argument("file_name")
+    get.add_argument("dest")
+    commands.add_parser("stats", help="document count and compression ratio")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = SegmentStore(args.root)
+    try:
+        if args.command == "pack":
+            pack_manifest(store, args.manifest, args.remove)
+        elif args.command == "get":
+            if not store.export(args.accession, args.file_name, args.dest):
+                logger.error(f"{args.accession}/{args.file_name} is not stored in {args.root}")
+        print(store.stats())
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
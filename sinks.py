@@ -0,0 +1,270 @@
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = ("filed", "reporting_for")
+LIST_FIELDS = ("file_number", "firm_number")
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value.strip()) if value else None
+    except ValueError:
+        return None
+
+
+def _parse_ciks(value: Optional[str]) -> List[int]:
+    ciks = []
+    for token in (value or "").replace("CIK", " ").split():
+        if token.isdigit():
+            ciks.append(int(token))
+    return ciks
+
+
+def typed_record(row: Dict) -> Dict:
+    """Convert a manifest row of strings into typed columns.
+
+    Dates become date objects, the CIK an int (all CIKs of multi-filer rows are kept
+    in `ciks`) and the space separated file/film numbers become lists.
+    """
+    record = dict(row)
+    for field in DATE_FIELDS:
+        if field in record:
+            record[field] = _parse_date(record[field])
+    if "cik" in record:
+        ciks = _parse_ciks(record["cik"])
+        record["cik"] = ciks[0] if ciks else None
+        record["ciks"] = ciks
+    for field in LIST_FIELDS:
+        if field in record:
+            record[field] = (record[field] or "").split()
+    return record
+
+
+def flat_record(record: Dict) -> Dict:
+    """Inverse of typed_record: turn typed columns back into the CSV string form."""
+    row = dict(record)
+    for field in DATE_FIELDS:
+        if isinstance(row.get(field), date):
+            row[field] = row[field].isoformat()
+    if "ciks" in row:
+        ciks = row.pop("ciks") or ([row["cik"]] if row.get("cik") is not None else [])
+        row["cik"] = " ".join(f"{int(cik):010d}" for cik in ciks)
+    for field in LIST_FIELDS:
+        if isinstance(row.get(field), list):
+            row[field] = " ".join(row[field])
+    return {key: "" if value is None else value for key, value in row.items()}
+
+
+class RowSink:
+    """Buffered manifest writer; rows are written in batches instead of one open() per row.
+
+    A batch is written once `batch_size` rows are buffered or `flush_interval` seconds
+    have passed since the last write, and always on flush()/close(). A background
+    thread flushes on that interval too, so rows buffered before a quiet spell (slow
+    discovery, throttling) do not wait for the next write. Each batch is flushed and
+    fsynced before it is dropped from the buffer, so a crash loses at most the rows of
+    the last flush_interval.
+    """
+
+    extension = ""
+
+    def __init__(self, path, fieldnames: Sequence[str], batch_size: int = 100,
+                 flush_interval: float = 5.0, truncate: bool = False):
+        self.path = Path(path)
+        self.fieldnames = list(fieldnames)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._buffer: List[Dict] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        # Started by the first write, once subclasses have finished setting up
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        if truncate:
+            self._truncate()
+
+    def _truncate(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+    def write(self, row: Dict) -> None:
+        with self._lock:
+            self._buffer.append({field: row.get(field, "") for field in self.fieldnames})
+            if (len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+            elif self._flusher is None and self.flush_interval > 0:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True,
+                                                 name=f"flush-{self.path.name}")
+                self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        try:
+            self._write_batch(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+        except Exception as e:
+            logger.error(f"Failed to write {len(self._buffer)} rows to {self.path}: {e}")
+
+    def _write_batch(self, rows: List[Dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _append_durably(path: Path, text: str) -> None:
+        # One write call per batch, then fsync so the batch survives a crash or power loss
+        with open(path, mode="a", newline="", encoding="utf-8") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class CSVSink(RowSink):
+    extension = ".csv"
+
+    def _write_batch(self, rows: List[Dict]) -> None:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.fieldnames)
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            writer.writeheader()
+        writer.writerows(rows)
+        self._append_durably(self.path, buffer.getvalue())
+
+
+class JSONLSink(RowSink):
+    extension = ".jsonl"
+
+    def _write_batch(self, rows: List[Dict]) -> None:
+        lines = []
+        for row in rows:
+            record = typed_record(row)
+            for field in DATE_FIELDS:
+                if isinstance(record.get(field), date):
+                    record[field] = record[field].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        self._append_durably(self.path, "\n".join(lines) + "\n")
+
+
+class ParquetSink(RowSink):
+    """Writes each batch as its own part file inside a dataset directory.
+
+    Parquet files cannot be appended to, so crash safety comes from writing every part
+    to a temporary name and renaming it into place; readers never see a partial part.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, path, fieldnames: Sequence[str], batch_size: int = 5000,
+                 flush_interval: float = 60.0, truncate: bool = False):
+        if pa is None:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        super().__init__(path, fieldnames, batch_size, flush_interval, truncate)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.schema = self._schema()
+        self._part = len(list(self.path.glob("part-*.parquet")))
+
+    def _truncate(self) -> None:
+        if self.path.exists():
+            for part in self.path.glob("part-*.parquet"):
+                part.unlink()
+
+    def _schema(self):
+        fields = []
+        for name in self.fieldnames:
+            if name in DATE_FIELDS:
+                fields.append(pa.field(name, pa.date32()))
+            elif name == "cik":
+                fields.append(pa.field(name, pa.int64()))
+                fields.append(pa.field("ciks", pa.list_(pa.int64())))
+            elif name in LIST_FIELDS:
+                fields.append(pa.field(name, pa.list_(pa.string())))
+            else:
+                fields.append(pa.field(name, pa.string()))
+        return pa.schema(fields)
+
+    def _write_batch(self, rows: List[Dict]) -> None:
+        table = pa.Table.from_pylist([typed_record(row) for row in rows], schema=self.schema)
+        part_path = self.path / f"part-{self._part:06d}.parquet"
+        # Dot-prefixed so dataset readers skip a part that is still being written
+        tmp_path = self.path / f".{part_path.name}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, part_path)
+        self._part += 1
+
+
+SINKS = {"csv": CSVSink, "jsonl": JSONLSink, "parquet": ParquetSink}
+
+
+def output_path(base: str, output_format: str) -> Path:
+    """Swap the extension of a manifest path for the one the chosen format writes."""
+    return Path(base).with_suffix(SINKS[output_format].extension)
+
+
+def create_sink(path, fieldnames: Sequence[str], output_format: Optional[str] = None, **kwargs) -> RowSink:
+    """Create the sink for a format, inferring it from the path's extension when not given."""
+    if output_format is None:
+        output_format = Path(path).suffix.lstrip(".") or "csv"
+    if output_format not in SINKS:
+        raise ValueError(f"Unsupported output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    return SINKS[output_format](path, fieldnames, **kwargs)
+
+
+def read_rows(path) -> Iterator[Dict]:
+    """Read a manifest written by any sink back as rows of strings, as csv.DictReader would."""
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield flat_record(json.loads(line))
+    elif path.suffix == ".parquet":
+        if pq is None:
+            raise ImportError("Reading Parquet manifests requires pyarrow (pip install pyarrow)")
+        for record in pq.read_table(path).to_pylist():
+            yield flat_record(record)
+    else:
+        with open(path, mode="r", newline="", encoding="utf-8") as file:
+            yield from csv.DictReader(file)
@@ -0,0 +1,305 @@
+import argparse
+import logging
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import http_cache
+from checkpoint import CrawlCheckpoint
+from doc_store import DocumentStore
+from efts import (ARCHIVES_BASE_URL, EFTS_BASE_URL, PAGE_SIZE, EFTSClient, archive_url,
+                  search_params_from_url)
+from http_client import RETRYABLE_ERRORS, create_session, stream_to_file, timed_get
+from metrics import metrics
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from sinks import OUTPUT_FORMATS
+import sec
+import sec_doc
+
+logger = logging.getLogger(__name__)
+
+DAILY_INDEX_BASE_URL = "https://www.sec.gov/Archives/edgar/daily-index"
+SYNC_SOURCES = ("efts", "index")
+# Search parameters a sync replaces with [watermark, until]
+WINDOW_PARAMS = ("dateRange", "startdt", "enddt")
+# Daily index files kept in memory, so the form groups of one run share each day's fetch
+RECENT_INDEX_DAYS = 7
+
+
+def daily_index_path(day: date) -> str:
+    """Path of a day's form index below the daily-index root, e.g. 2024/QTR4/form.20241101.idx."""
+    return f"{day.year}/QTR{(day.month - 1) // 3 + 1}/form.{day:%Y%m%d}.idx"
+
+
+def parse_form_index(text: str, archives_base: str = ARCHIVES_BASE_URL) -> List[Dict]:
+    """Parse a daily form.YYYYMMDD.idx file into rows shaped like efts.hit_to_row.
+
+    The file is a fixed-width table under a dashed rule. Form types ("SC 13G/A") and
+    company names both contain spaces, so the form type is cut at the header's
+    "Company Name" column and the last three fields are split off from the right.
+    """
+    lines = text.splitlines()
+    company_column = None
+    start = None
+    for index, line in enumerate(lines):
+        if line.startswith("Form Type") and "Company Name" in line:
+            company_column = line.index("Company Name")
+        elif line.startswith("---"):
+            start = index + 1
+            break
+    if start is None or company_column is None:
+        return []
+
+    rows = []
+    for line in lines[start:]:
+        fields = line[company_column:].rsplit(None, 3)
+        if len(fields) != 4:
+            continue
+        company, cik, filed, file_name = fields
+        if not (cik.isdigit() and filed.isdigit() and len(filed) == 8):
+            continue
+        # edgar/data/320193/0000320193-24-000123.txt: the full submission of the filing
+        accession = Path(file_name).stem
+        row = {
+            "file_name": f"{accession}.txt",
+            "file_number": "",
+            "film_number": "",
+            "form_file_name": line[:company_column].strip(),
+            "incorporate": "",
+            "location": "",
+            "filed": f"{filed[:4]}-{filed[4:6]}-{filed[6:]}",
+            "end_date": "",
+            "entity_name": company.strip(),
+            "cik_number": cik,
+            "accession": accession,
+        }
+        row["file_url"] = archive_url(row, archives_base)
+        rows.append(row)
+    return rows
+
+
+class DailyIndexSource:
+    """Reads EDGAR daily form index files from sec.gov or from a local directory of fixtures."""
+
+    def __init__(self, base: str = DAILY_INDEX_BASE_URL, archives_base: str = ARCHIVES_BASE_URL,
+                 rate_limiter: Optional[RateLimiter] = None, session=None):
+        self.base = base.rstrip("/")
+        self.archives_base = archives_base
+        self.is_remote = self.base.startswith(("http://", "https://"))
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = session or (create_session() if self.is_remote else None)
+        self._recent: Dict[date, Optional[str]] = {}
+
+    def fetch(self, day: date, form_type: Optional[str] = None) -> Optional[str]:
+        """Return the text of a day's form index, or None for days without one (weekends, holidays).
+
+        form_type names the forms the index is fetched for and labels its retry counters.
+        """
+        if day not in self._recent:
+            if len(self._recent) >= RECENT_INDEX_DAYS:
+                self._recent.pop(next(iter(self._recent)))
+            self._recent[day] = self._fetch(day, form_type)
+        return self._recent[day]
+
+    def _fetch(self, day: date, form_type: Optional[str] = None) -> Optional[str]:
+        if not self.is_remote:
+            path = Path(self.base) / daily_index_path(day)
+            return path.read_text(encoding="latin-1") if path.exists() else None
+        url = f"{self.base}/{daily_index_path(day)}"
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                response = timed_get(self.session, url, self.rate_limiter, 60)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.rate_limiter.max_retries:
+                    raise
+                logger.warning(f"Fetching {url} stalled ({e}), retrying")
+                metrics.inc("retries_total", status="timeout", form_type=form_type)
+                continue
+            if self.rate_limiter.record_response(response.status_code, response.headers, attempt, form_type) is None:
+                break
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content.decode("latin-1")
+
+    def iter_rows(self, start: date, end: date, forms: List[str]) -> Iterator[Dict]:
+        """Yield every indexed filing of the given form types filed between start and end inclusive."""
+        day = start
+        while day <= end:
+            text = self.fetch(day, ",".join(forms) or None)
+            if text is not None:
+                rows = parse_form_index(text, self.archives_base)
+                logger.info(f"Daily index {day} lists {len(rows)} filings")
+                for row in rows:
+                    if not forms or row["form_file_name"] in forms:
+                        yield row
+            day += timedelta(days=1)
+
+    def close(self) -> None:
+        if self.session is not None:
+            self.session.close()
+
+
+def sync_window(checkpoint: CrawlCheckpoint, url: str, since: date) -> date:
+    """First filed date to request for a query.
+
+    The watermark's own day is requested again, because filings accepted later that day
+    appear after the previous sync; rows already captured are dropped by accession.
+    """
+    mark = checkpoint.watermark(url)
+    return date.fromisoformat(mark[0]) if mark else since
+
+
+def form_queries(forms: List[str]) -> Dict[str, List[str]]:
+    """URL groups of one keywordless search per form type, e.g. for syncing every 8-K from the daily index."""
+    return {form: [f"https://www.sec.gov/edgar/search/#/filter_forms={form}"] for form in forms}
+
+
+def group_queries(url_groups: Dict[str, List[str]]) -> List[Tuple[str, List[str]]]:
+    """(url_type, urls) per distinct search of each form type, ignoring the URLs' date windows.
+
+    The URL_GROUPS queries of a form differ only in their date range, which a sync
+    replaces with [watermark, until]; grouping them fetches each window once.
+    """
+    groups: Dict[Tuple, Tuple[str, List[str]]] = {}
+    for url_type, urls in url_groups.items():
+        for url in urls:
+            params = search_params_from_url(url)
+            key = (url_type,) + tuple(sorted((k, v) for k, v in params.items() if k not in WINDOW_PARAMS))
+            groups.setdefault(key, (url_type, []))[1].append(url)
+    return list(groups.values())
+
+
+def iter_new_rows(url: str, source, start: date, end: date) -> Iterator[Dict]:
+    params = search_params_from_url(url)
+    if isinstance(source, DailyIndexSource):
+        forms = [form for form in params.get("forms", "").split(",") if form]
+        yield from source.iter_rows(start, end, forms)
+    else:
+        # A narrow custom date range keeps the nightly delta to a page or two per query
+        params.update({"dateRange": "custom", "startdt": start.isoformat(), "enddt": end.isoformat()})
+        for _, rows in source.iter_search(params):
+            yield from rows
+
+
+def store_document(store: DocumentStore, session, rate_limiter: RateLimiter, url_type: str, row: Dict) -> None:
+    manifest_row = {"file_url": row["file_url"], "form_file_name": url_type}
+    if sec_doc.store_key(manifest_row) is None or sec_doc.resolve_from_store(store, manifest_row):
+        return
+    tmp_path = store.temp_path()
+    if stream_to_file(session, row["file_url"], tmp_path, rate_limiter, form_type=url_type):
+        sec_doc.add_to_store(store, manifest_row, tmp_path)
+
+
+def sync_query(scraper: sec.SECDocumentScraper, source, urls: List[str], url_type: str, since: date, until: date,
+               store: Optional[DocumentStore] = None, session=None) -> int:
+    """Append the filings of a group of queries newer than their watermarks, then advance them.
+
+    The group (see group_queries) is fetched once from its oldest watermark, and every
+    query's watermark moves to the newest filing seen. Watermarks only move once every
+    new row has been flushed to the manifest, so an interrupted sync is simply repeated
+    from the old marks next time.
+    """
+    checkpoint = scraper.checkpoint
+    url = urls[0]
+    keywords = search_params_from_url(url).get("q")
+    if isinstance(source, DailyIndexSource) and keywords:
+        # The index would list every filing of the form and move the watermark past days never searched
+        logger.warning(f"Skipping {len(urls)} {url_type} queries for {keywords!r}: the daily index carries "
+                       f"no document text, sync keyword queries with --source efts")
+        return 0
+    start = min(sync_window(checkpoint, query, since) for query in urls)
+    marks = [checkpoint.watermark(query) for query in urls]
+    mark = max((m for m in marks if m is not None), key=lambda m: (m[0], m[1] or ""), default=None)
+    count = 0
+    for row in iter_new_rows(url, source, start, until):
+        if scraper._already_captured(row):
+            continue
+        if not row.get("file_url"):
+            logger.warning(f"Could not build document URL for {row.get('accession')}")
+            continue
+        scraper.write_details(row["file_url"], url_type, row)
+        scraper._record_captured(row)
+        if store is not None:
+            store_document(store, session, scraper.rate_limiter, url_type, row)
+        if mark is None or (row["filed"], row["accession"] or "") > (mark[0], mark[1] or ""):
+            mark = (row["filed"], row["accession"])
+        count += 1
+        if count % PAGE_SIZE == 0:
+            scraper.finish_page(url, None)
+    scraper.finish_page(url, None)
+    # A query without any filings yet still records the window it covered
+    for query in urls:
+        checkpoint.set_watermark(query, *(mark or (start.isoformat(), None)))
+    logger.info(f"Synced {count} new documents for {len(urls)} {url_type} queries since {start}")
+    return count
+
+
+def run_sync(scraper: sec.SECDocumentScraper, source, url_groups: Dict[str, List[str]], since: date, until: date,
+             store: Optional[DocumentStore] = None) -> int:
+    session = create_session() if store is not None else None
+    total = 0
+    try:
+        for url_type, urls in group_queries(url_groups):
+            try:
+                total += sync_query(scraper, source, urls, url_type, since, until, store, session)
+            except Exception as e:
+                logger.error(f"Failed to sync {url_type} queries {urls}: {e}")
+    finally:
+        if session is not None:
+            session.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append filings newer than each query's watermark to the manifest")
+    parser.add_argument("--source", choices=SYNC_SOURCES, default="efts",
+                        help="full-text search restricted to the new dates, or EDGAR's daily form index files "
+                             "(queries without keywords only)")
+    parser.add_argument("--efts-url", default=EFTS_BASE_URL, help="base URL of the full-text search endpoint")
+    parser.add_argument("--index-url", default=DAILY_INDEX_BASE_URL,
+                        help="daily-index root, either a URL or a local directory of form.YYYYMMDD.idx files")
+    parser.add_argument("--archives-url", default=ARCHIVES_BASE_URL, help="base URL used to build document links")
+    parser.add_argument("--forms", nargs="+", default=None, metavar="FORM",
+                        help="sync every filing of these form types instead of the URL_GROUPS keyword queries")
+    parser.add_argument("--since", type=date.fromisoformat, default=date.today() - timedelta(days=1),
+                        help="first filed date for queries that have never been synced (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, default=date.today(),
+                        help="last filed date to request (YYYY-MM-DD)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="ceiling on requests per second sent to sec.gov")
+    parser.add_argument("--checkpoint", default="crawl_checkpoint.db")
+    parser.add_argument("--store", action="store_true",
+                        help="also download the new documents into the deduplicated document store")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None)
+    parser.add_argument("--http-cache", default=None, metavar="DIR",
+                        help="cache responses on disk; Archives documents are then never fetched twice")
+    parser.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB,
+                        help="size cap of the HTTP cache; least recently used responses are evicted past it")
+    args = parser.parse_args()
+    http_cache.enable(args.http_cache, args.http_cache_mb)
+
+    rate_limiter = RateLimiter(args.rate)
+    checkpoint = CrawlCheckpoint(args.checkpoint)
+    scraper = sec.SECDocumentScraper(rate_limiter=rate_limiter, checkpoint=checkpoint,
+                                     output_format=args.output_format)
+    if args.source == "index":
+        source = DailyIndexSource(args.index_url, args.archives_url, rate_limiter)
+    else:
+        source = EFTSClient(base_url=args.efts_url, archives_base=args.archives_url, rate_limiter=rate_limiter)
+    store = DocumentStore("sec_gov") if args.store else None
+    try:
+        url_groups = form_queries(args.forms) if args.forms else sec.URL_GROUPS
+        total = run_sync(scraper, source, url_groups, args.since, args.until, store)
+        logging.info(f"Appended {total} new documents to {scraper.csv_file}")
+    finally:
+        source.close()
+        scraper.close()
+        checkpoint.close()
+        if store:
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import sec
+from checkpoint import CrawlCheckpoint
+from fixture_server import FixtureConfig, start_server, synthetic_form_index
+from rate_limit import RateLimiter
+from sinks import read_rows
+from sync import DailyIndexSource, form_queries, parse_form_index, run_sync
+
+
+def _filings(days, form):
+    rows = [row for day in days for row in parse_form_index(synthetic_form_index(day, 20).decode("latin-1"))]
+    return [row for row in rows if row["form_file_name"] == form]
+
+
+@pytest.fixture
+def edgar():
+    server = start_server(FixtureConfig(filings_per_day=20))
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = CrawlCheckpoint(str(tmp_path / "crawl_checkpoint.db"))
+    scraper = sec.SECDocumentScraper(csv_file=str(tmp_path / "Master_file.csv"), checkpoint=checkpoint,
+                                     rate_limiter=RateLimiter(10))
+    yield scraper
+    scraper.close()
+    checkpoint.close()
+
+
+def _sync(scraper, edgar, url_groups, since, until):
+    source = DailyIndexSource(f"{edgar}/Archives/edgar/daily-index", f"{edgar}/Archives/edgar/data",
+                              RateLimiter(10))
+    try:
+        return run_sync(scraper, source, url_groups, since, until)
+    finally:
+        source.close()
+        scraper.sink.flush()
+
+
+def test_second_sync_appends_only_the_delta(scraper, edgar):
+    url_groups = form_queries(["8-K"])
+    url = url_groups["8-K"][0]
+    # Monday and Tuesday, then through Thursday; Tuesday is requested again but already captured
+    first_days = [date(2024, 11, 4), date(2024, 11, 5)]
+    later_days = [date(2024, 11, 6), date(2024, 11, 7)]
+    first, later = _filings(first_days, "8-K"), _filings(later_days, "8-K")
+    assert first and later
+
+    assert _sync(scraper, edgar, url_groups, first_days[0], first_days[-1]) == len(first)
+    newest = max((row["filed"], row["accession"]) for row in first)
+    assert scraper.checkpoint.watermark(url) == newest
+
+    assert _sync(scraper, edgar, url_groups, first_days[0], later_days[-1]) == len(later)
+    file_urls = [row["file_url"] for row in read_rows(scraper.csv_file)]
+    assert len(file_urls) == len(set(file_urls)) == len(first) + len(later)
+    assert scraper.checkpoint.watermark(url) == max((row["filed"], row["accession"]) for row in later)
+
+
+def test_index_source_skips_keyword_queries(scraper, edgar):
+    url = "https://www.sec.gov/edgar/search/#/q=oil&filter_forms=8-K"
+    assert _sync(scraper, edgar, {"8-K": [url]}, date(2024, 11, 4), date(2024, 11, 5)) == 0
+    assert scraper.checkpoint.watermark(url) is None
@@ -0,0 +1,369 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+try:
+    import redis
+except ImportError:  # Only the Redis backend needs it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VISIBILITY_TIMEOUT = 300.0
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class WorkItem(NamedTuple):
+    id: str
+    kind: str
+    payload: Dict
+    attempts: int
+    lease_token: str
+
+
+class WorkQueue:
+    """Shared queue of work units claimed under visibility-timeout leases.
+
+    `claim` hands a unit to one worker until its lease expires; the worker extends the
+    lease with `heartbeat` while it runs and finishes with `ack` (done) or `fail` (back
+    to the queue). A unit whose lease runs out, because its worker crashed or lost its
+    host, is claimable again. After `max_attempts` claims it is parked as dead instead.
+    Units are deduplicated by key, so re-seeding a queue or enqueuing the same next
+    page from two workers adds it once.
+    """
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+
+    def put(self, kind: str, payload: Dict, key: Optional[str] = None) -> bool:
+        return self.put_many(kind, [(payload, key)]) == 1
+
+    def put_many(self, kind: str, items: Iterable[Tuple[Dict, Optional[str]]]) -> int:
+        """Enqueue (payload, dedupe key) pairs; returns how many were new."""
+        raise NotImplementedError
+
+    def claim(self, worker: str, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> Optional[WorkItem]:
+        raise NotImplementedError
+
+    def heartbeat(self, item: WorkItem, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        """Extend a lease; False means it was lost (expired and claimed elsewhere)."""
+        raise NotImplementedError
+
+    def ack(self, item: WorkItem) -> bool:
+        raise NotImplementedError
+
+    def fail(self, item: WorkItem, error: str) -> None:
+        raise NotImplementedError
+
+    def counts(self) -> Dict[str, int]:
+        """Units per state: ready, leased, done, dead."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT UNIQUE,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, lease_expires);
+"""
+
+
+class SQLiteQueue(WorkQueue):
+    """Queue in one SQLite file, e.g. on a filesystem every node mounts.
+
+    Claims run in IMMEDIATE transactions, so two workers never lease the same unit. The
+    default rollback journal is used because WAL does not work across network mounts.
+    """
+
+    def __init__(self, path: str = "work_queue.db", max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        super().__init__(max_attempts)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(SQLITE_SCHEMA)
+        # The heartbeat thread and the worker share the connection
+        self._lock = threading.Lock()
+
+    def put_many(self, kind: str, items: Iterable[Tuple[Dict, Optional[str]]]) -> int:
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO work_items (kind, dedupe_key, payload, updated_at) VALUES (?, ?, ?, ?)",
+                ((kind, key, json.dumps(payload), now) for payload, key in items),
+            )
+            added = self.conn.total_changes - before
+            self.conn.execute("COMMIT")
+        return added
+
+    def claim(self, worker: str, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> Optional[WorkItem]:
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases that used up their attempts are parked rather than retried forever
+                self.conn.execute(
+                    "UPDATE work_items SET state = 'dead', last_error = 'lease expired', updated_at = ? "
+                    "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self.conn.execute(
+                    "SELECT id, kind, payload, attempts FROM work_items "
+                    "WHERE state = 'ready' OR (state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                token = uuid.uuid4().hex
+                self.conn.execute(
+                    "UPDATE work_items SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                    "lease_token = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (worker, token, now + visibility_timeout, now, row[0]),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return WorkItem(str(row[0]), row[1], json.loads(row[2]), row[3] + 1, token)
+
+    def _update_leased(self, item: WorkItem, assignments: str, params: tuple) -> bool:
+        with self._lock:
+            cursor = self.conn.execute(
+                f"UPDATE work_items SET {assignments}, updated_at = ? "
+                f"WHERE id = ? AND state = 'leased' AND lease_token = ?",
+                params + (time.time(), int(item.id), item.lease_token),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, item: WorkItem, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        return self._update_leased(item, "lease_expires = ?", (time.time() + visibility_timeout,))
+
+    def ack(self, item: WorkItem) -> bool:
+        return self._update_leased(item, "state = 'done', lease_token = NULL", ())
+
+    def fail(self, item: WorkItem, error: str) -> None:
+        state = "dead" if item.attempts >= self.max_attempts else "ready"
+        self._update_leased(item, "state = ?, lease_token = NULL, last_error = ?", (state, error[:2000]))
+
+    def counts(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT CASE WHEN state = 'leased' AND lease_expires < ? THEN 'ready' ELSE state END, COUNT(*) "
+                "FROM work_items GROUP BY 1", (now,)
+            ).fetchall()
+        return {"ready": 0, "leased": 0, "done": 0, "dead": 0, **dict(rows)}
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+# Every Redis operation runs as one Lua script, so a worker dying between two commands
+# can never leave a unit in neither the ready list nor the leased set.
+# KEYS: dedupe set, id counter, items hash, ready list; ARGV: dedupe key ('' for none), item JSON, ...
+REDIS_PUT = """
+local added = 0
+for i = 1, #ARGV, 2 do
+    if ARGV[i] == '' or redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        local id = redis.call('INCR', KEYS[2])
+        redis.call('HSET', KEYS[3], id, ARGV[i + 1])
+        redis.call('RPUSH', KEYS[4], id)
+        added = added + 1
+    end
+end
+return added
+"""
+# KEYS: ready list, leased set, leases hash, attempts hash, items hash, dead hash
+# ARGV: now, lease expiry, lease value, max attempts
+REDIS_CLAIM = """
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 100)) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('HDEL', KEYS[3], id)
+    if tonumber(redis.call('HGET', KEYS[4], id) or '0') >= tonumber(ARGV[4]) then
+        redis.call('HSET', KEYS[6], id, 'lease expired')
+    else
+        redis.call('RPUSH', KEYS[1], id)
+    end
+end
+local id = redis.call('LPOP', KEYS[1])
+if not id then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+redis.call('HSET', KEYS[3], id, ARGV[3])
+local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+return {id, attempts, redis.call('HGET', KEYS[5], id)}
+"""
+# Prefix of the lease scripts: KEYS[1] leases hash, KEYS[2] leased set; ARGV[1] item id, ARGV[2] ':' + lease token
+REDIS_OWNS = """
+local lease = redis.call('HGET', KEYS[1], ARGV[1])
+if not lease or string.sub(lease, -string.len(ARGV[2])) ~= ARGV[2] then
+    return 0
+end
+"""
+# ARGV[3]: new lease expiry; ZADD XX never resurrects a swept lease
+REDIS_HEARTBEAT = REDIS_OWNS + """
+redis.call('ZADD', KEYS[2], 'XX', ARGV[3], ARGV[1])
+return 1
+"""
+# KEYS[3] items hash, KEYS[4] attempts hash, KEYS[5] done counter
+REDIS_ACK = REDIS_OWNS + """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+redis.call('INCR', KEYS[5])
+return 1
+"""
+# KEYS[3] attempts hash, KEYS[4] ready list, KEYS[5] dead hash; ARGV[3] max attempts, ARGV[4] error
+REDIS_FAIL = REDIS_OWNS + """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0') >= tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[5], ARGV[1], ARGV[4])
+else
+    redis.call('RPUSH', KEYS[4], ARGV[1])
+end
+return 1
+"""
+# Units enqueued per script call, so one call never blocks the server for long
+REDIS_PUT_BATCH = 500
+
+
+class RedisQueue(WorkQueue):
+    """Queue in a Redis-compatible server with Lua scripting (Redis, Valkey, KeyDB).
+
+    Keys under `namespace`: an items hash (id -> JSON), a ready list, a leased sorted set
+    scored by lease expiry, a lease-token hash, an attempts hash, a dedupe set, a done
+    counter and a dead hash. Each operation is one server-side script, so it is atomic:
+    a claim moves a unit from the ready list to the leased set in one step, and expired
+    leases are swept back onto the ready list by whichever worker claims next.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", namespace: str = "sec",
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, client=None):
+        super().__init__(max_attempts)
+        if client is None:
+            if redis is None:
+                raise ImportError("The Redis queue backend requires redis (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ns = namespace
+        self._put = client.register_script(REDIS_PUT)
+        self._claim = client.register_script(REDIS_CLAIM)
+        self._heartbeat = client.register_script(REDIS_HEARTBEAT)
+        self._ack = client.register_script(REDIS_ACK)
+        self._fail = client.register_script(REDIS_FAIL)
+
+    def _key(self, name: str) -> str:
+        return f"{self.ns}:{name}"
+
+    def _keys(self, *names: str) -> list:
+        return [self._key(name) for name in names]
+
+    def put_many(self, kind: str, items: Iterable[Tuple[Dict, Optional[str]]]) -> int:
+        added = 0
+        batch = []
+        for payload, key in items:
+            batch += [key or "", json.dumps({"kind": kind, "payload": payload})]
+            if len(batch) >= 2 * REDIS_PUT_BATCH:
+                added += self._put(keys=self._keys("keys", "next_id", "items", "ready"), args=batch)
+                batch = []
+        if batch:
+            added += self._put(keys=self._keys("keys", "next_id", "items", "ready"), args=batch)
+        return added
+
+    def claim(self, worker: str, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> Optional[WorkItem]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        claimed = self._claim(keys=self._keys("ready", "leased", "leases", "attempts", "items", "dead"),
+                              args=[now, now + visibility_timeout, f"{worker}:{token}", self.max_attempts])
+        if not claimed:
+            return None
+        item_id, attempts, raw = claimed
+        data = json.loads(raw)
+        return WorkItem(str(item_id), data["kind"], data["payload"], int(attempts), token)
+
+    def heartbeat(self, item: WorkItem, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        return self._heartbeat(keys=self._keys("leases", "leased"),
+                               args=[item.id, f":{item.lease_token}", time.time() + visibility_timeout]) == 1
+
+    def ack(self, item: WorkItem) -> bool:
+        return self._ack(keys=self._keys("leases", "leased", "items", "attempts", "done"),
+                         args=[item.id, f":{item.lease_token}"]) == 1
+
+    def fail(self, item: WorkItem, error: str) -> None:
+        self._fail(keys=self._keys("leases", "leased", "attempts", "ready", "dead"),
+                   args=[item.id, f":{item.lease_token}", self.max_attempts, error[:2000]])
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "ready": self.client.llen(self._key("ready")),
+            "leased": self.client.zcard(self._key("leased")),
+            "done": int(self.client.get(self._key("done")) or 0),
+            "dead": self.client.hlen(self._key("dead")),
+        }
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def open_queue(url: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> WorkQueue:
+    """Open a queue from redis://host:port/db[#namespace], or a SQLite file path (sqlite:/// prefix optional)."""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        url, _, namespace = url.partition("#")
+        return RedisQueue(url, namespace or "sec", max_attempts)
+    return SQLiteQueue(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url, max_attempts)
+
+
+class Heartbeat:
+    """Keeps a claimed unit's lease alive from a background thread while the worker runs it."""
+
+    def __init__(self, queue: WorkQueue, item: WorkItem, visibility_timeout: float):
+        self.queue = queue
+        self.item = item
+        self.visibility_timeout = visibility_timeout
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{item.id}", daemon=True)
+
+    def _run(self) -> None:
+        # Renew at a third of the timeout so one missed beat never lets the lease lapse
+        while not self._stop.wait(self.visibility_timeout / 3):
+            try:
+                if not self.queue.heartbeat(self.item, self.visibility_timeout):
+                    logger.warning(f"Lost the lease on work item {self.item.id}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat for work item {self.item.id} failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
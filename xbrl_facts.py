@@ -0,0 +1,514 @@
+import argparse
+import json
+import logging
+import uuid
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+import http_cache
+from efts import accession_from_url
+from http_client import create_session, timed_get
+from metrics import metrics
+from rate_limit import DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from sinks import read_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # The fact store is optional
+    pa = None
+    pc = None
+    ds = None
+
+try:
+    import pandas
+except ImportError:  # Only frame() needs it
+    pandas = None
+
+logger = logging.getLogger(__name__)
+
+COMPANYFACTS_BASE_URL = "https://data.sec.gov/api/xbrl/companyfacts"
+DEFAULT_FORMS = ("10-K", "10-Q")
+# Facts buffered before a write; each write adds one file per (form type, fiscal year) partition
+WRITE_BATCH = 1_000_000
+# Facts are held as Python values only this many at a time, then packed into an Arrow record batch
+RECORD_BATCH_ROWS = 64 * 1024
+# Large row groups of concept-sorted rows let a concept filter skip most of a file from its statistics
+MIN_ROWS_PER_GROUP = 128 * 1024
+MAX_ROWS_PER_GROUP = 512 * 1024
+# Columns identifying one reported value; repeats across filings are comparatives or restatements
+FACT_KEY = ["cik", "taxonomy", "concept", "unit", "period_start", "period_end"]
+# Fact columns; form_type and fiscal_year are the hive partition keys
+FACT_COLUMNS = ("cik", "accession", "form_type", "fiscal_year", "fiscal_period", "taxonomy", "concept",
+                "unit", "period_start", "period_end", "value", "filed", "source")
+
+
+def fact_schema():
+    return pa.schema([
+        pa.field("cik", pa.int64()),
+        pa.field("accession", pa.string()),
+        pa.field("form_type", pa.string()),
+        pa.field("fiscal_year", pa.int32()),
+        pa.field("fiscal_period", pa.string()),
+        pa.field("taxonomy", pa.string()),
+        pa.field("concept", pa.string()),
+        pa.field("unit", pa.string()),
+        pa.field("period_start", pa.date32()),
+        pa.field("period_end", pa.date32()),
+        pa.field("value", pa.float64()),
+        pa.field("filed", pa.date32()),
+        # "companyfacts" or "inline" (parsed from the filing document itself)
+        pa.field("source", pa.string()),
+    ])
+
+
+class Filing(NamedTuple):
+    cik: int
+    accession: str
+    form_type: str
+    file_url: str
+    file_path: str
+    filed: str
+
+
+def _date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value.strip()[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def filings_from_manifest(manifest, forms: Sequence[str] = DEFAULT_FORMS) -> Dict[int, Dict[str, Filing]]:
+    """Filings of the given form groups in a manifest, by filer CIK and accession number.
+
+    The CIK is read from the document URL, which names the filer whose folder holds it.
+    A filing with several documents in the manifest is listed once.
+    """
+    filings: Dict[int, Dict[str, Filing]] = defaultdict(dict)
+    for row in read_rows(manifest):
+        if row.get('form_file_name') not in forms:
+            continue
+        key = accession_from_url(row.get('file_url') or "")
+        if key is None:
+            continue
+        cik = int(row['file_url'].rstrip("/").split("/")[-3])
+        filings[cik].setdefault(key[0], Filing(cik, key[0], row['form_file_name'], row['file_url'],
+                                               row.get('file_path') or "", row.get('filed') or ""))
+    return filings
+
+
+def facts_from_companyfacts(data: Dict, filings: Dict[str, Filing]) -> Iterator[Dict]:
+    """Facts of a companyfacts document that were reported in the given filings (by accession)."""
+    cik = int(data.get("cik") or 0)
+    for taxonomy, concepts in (data.get("facts") or {}).items():
+        for concept, body in concepts.items():
+            for unit, facts in (body.get("units") or {}).items():
+                for fact in facts:
+                    filing = filings.get(fact.get("accn"))
+                    if filing is None or fact.get("val") is None:
+                        continue
+                    end = _date(fact.get("end"))
+                    yield {
+                        "cik": cik or filing.cik, "accession": filing.accession, "form_type": filing.form_type,
+                        "fiscal_year": fact.get("fy") or (end.year if end else None),
+                        "fiscal_period": fact.get("fp") or "", "taxonomy": taxonomy, "concept": concept,
+                        "unit": unit, "period_start": _date(fact.get("start")), "period_end": end,
+                        "value": float(fact["val"]), "filed": _date(fact.get("filed") or filing.filed),
+                        "source": "companyfacts",
+                    }
+
+
+class _InlineXBRLParser(HTMLParser):
+    """Collects the numeric facts, contexts and units of an inline XBRL (iXBRL) document."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.facts: List[Dict] = []
+        self.contexts: Dict[str, Dict] = {}
+        self.units: Dict[str, str] = {}
+        self.cover: Dict[str, str] = {}
+        self._fact: Optional[Dict] = None
+        self._cover: Optional[str] = None
+        self._context: Optional[Dict] = None
+        self._unit: Optional[Dict] = None
+        self._field: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        local = tag.rsplit(":", 1)[-1]
+        if tag == "ix:nonfraction":
+            self._fact = dict(attrs)
+            self._text = []
+        elif tag == "ix:nonnumeric" and attrs.get("name") in ("dei:DocumentFiscalYearFocus",
+                                                                "dei:DocumentFiscalPeriodFocus"):
+            self._cover = attrs["name"].split(":", 1)[1]
+            self._text = []
+        elif local == "context" and "id" in attrs:
+            self._context = {"id": attrs["id"], "dimensional": False}
+        elif self._context is not None and local in ("startdate", "enddate", "instant"):
+            self._field = local
+            self._text = []
+        elif self._context is not None and local in ("explicitmember", "typedmember"):
+            self._context["dimensional"] = True
+        elif local == "unit" and "id" in attrs:
+            self._unit = {"id": attrs["id"], "numerator": [], "denominator": [], "part": "numerator"}
+        elif self._unit is not None and local == "unitdenominator":
+            self._unit["part"] = "denominator"
+        elif self._unit is not None and local == "measure":
+            self._field = "measure"
+            self._text = []
+
+    def handle_endtag(self, tag):
+        local = tag.rsplit(":", 1)[-1]
+        if tag == "ix:nonfraction" and self._fact is not None:
+            self._fact["text"] = "".join(self._text)
+            self.facts.append(self._fact)
+            self._fact = None
+        elif tag == "ix:nonnumeric" and self._cover:
+            self.cover[self._cover] = " ".join("".join(self._text).split())
+            self._cover = None
+        elif self._field == "measure" and local == "measure":
+            self._unit[self._unit["part"]].append("".join(self._text).strip().rsplit(":", 1)[-1])
+            self._field = None
+        elif self._field and local == self._field:
+            self._context[self._field] = "".join(self._text).strip()
+            self._field = None
+        elif local == "context" and self._context is not None:
+            self.contexts[self._context["id"]] = self._context
+            self._context = None
+        elif local == "unit" and self._unit is not None:
+            unit = "*".join(self._unit["numerator"])
+            if self._unit["denominator"]:
+                unit += "/" + "*".join(self._unit["denominator"])
+            self.units[self._unit["id"]] = unit
+            self._unit = None
+
+    def handle_data(self, data):
+        if self._fact is not None or self._cover or self._field:
+            self._text.append(data)
+
+
+def _inline_value(fact: Dict) -> Optional[float]:
+    """Numeric value of an ix:nonFraction, applying its format, scale and sign."""
+    text = fact.get("text", "").strip()
+    if "zerodash" in (fact.get("format") or "") or text in ("-", "—", "–"):
+        return 0.0
+    if "numcommadecimal" in (fact.get("format") or ""):
+        text = text.replace(".", "").replace(" ", "").replace(",", ".")
+    else:
+        text = text.replace(",", "").replace(" ", "")
+    try:
+        value = float(text.strip("()"))
+    except ValueError:
+        return None
+    value *= 10 ** int(fact.get("scale") or 0)
+    return -value if fact.get("sign") == "-" else value
+
+
+def facts_from_inline_xbrl(html: str, filing: Filing) -> Iterator[Dict]:
+    """Non-dimensional numeric facts of an inline XBRL filing document."""
+    parser = _InlineXBRLParser()
+    parser.feed(html)
+    fiscal_year = parser.cover.get("DocumentFiscalYearFocus", "")
+    for fact in parser.facts:
+        context = parser.contexts.get(fact.get("contextref"))
+        value = _inline_value(fact)
+        if context is None or context["dimensional"] or value is None or ":" not in fact.get("name", ""):
+            continue
+        taxonomy, concept = fact["name"].split(":", 1)
+        end = _date(context.get("enddate") or context.get("instant"))
+        yield {
+            "cik": filing.cik, "accession": filing.accession, "form_type": filing.form_type,
+            "fiscal_year": int(fiscal_year) if fiscal_year.isdigit() else (end.year if end else None),
+            "fiscal_period": parser.cover.get("DocumentFiscalPeriodFocus", ""),
+            "taxonomy": taxonomy, "concept": concept, "unit": parser.units.get(fact.get("unitref"), ""),
+            "period_start": _date(context.get("startdate")), "period_end": end, "value": value,
+            "filed": _date(filing.filed), "source": "inline",
+        }
+
+
+class FactStore:
+    """XBRL facts in a Parquet dataset partitioned by form type and fiscal year (hive layout).
+
+    Queries go through pyarrow's dataset scanner, so filters on form type and fiscal
+    year skip whole partitions, filters on other columns are pushed into the Parquet
+    readers, and aggregations run in Arrow's vectorized compute kernels. `frame`
+    converts a result to pandas for anything further.
+    """
+
+    def __init__(self, root: str = "xbrl_facts"):
+        if pa is None:
+            raise ImportError("The XBRL fact store requires pyarrow (pip install pyarrow)")
+        self.root = Path(root)
+        self.schema = fact_schema()
+        self.partitioning = ds.partitioning(
+            pa.schema([self.schema.field("form_type"), self.schema.field("fiscal_year")]), flavor="hive")
+
+    def write(self, facts: Iterable[Dict]) -> int:
+        """Append facts in batches of WRITE_BATCH; returns how many were written.
+
+        Facts are collected into per-column lists and packed into an Arrow record batch
+        every RECORD_BATCH_ROWS, so a write batch is buffered in Arrow's compact columnar
+        form rather than as a million Python dicts.
+        """
+        count = 0
+        batches: List = []
+        buffered = 0
+        columns: Dict[str, List] = {name: [] for name in FACT_COLUMNS}
+        for fact in facts:
+            for name, values in columns.items():
+                values.append(fact.get(name))
+            if len(columns["cik"]) >= RECORD_BATCH_ROWS:
+                batches.append(self._record_batch(columns))
+                buffered += batches[-1].num_rows
+                if buffered >= WRITE_BATCH:
+                    count += self._write_batch(batches)
+                    batches, buffered = [], 0
+        if columns["cik"]:
+            batches.append(self._record_batch(columns))
+        if batches:
+            count += self._write_batch(batches)
+        return count
+
+    def _record_batch(self, columns: Dict[str, List]):
+        """Pack the buffered column lists into a record batch and empty them."""
+        batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+        for values in columns.values():
+            values.clear()
+        return batch
+
+    def _write_batch(self, batches: List) -> int:
+        table = pa.Table.from_batches(batches, schema=self.schema).sort_by(
+            [("taxonomy", "ascending"), ("concept", "ascending"), ("cik", "ascending")])
+        ds.write_dataset(table, self.root, format="parquet", partitioning=self.partitioning,
+                         basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore",
+                         min_rows_per_group=MIN_ROWS_PER_GROUP, max_rows_per_group=MAX_ROWS_PER_GROUP)
+        metrics.inc("xbrl_facts_total", table.num_rows)
+        return table.num_rows
+
+    def dataset(self):
+        if not self.root.exists():
+            return ds.dataset(pa.table({name: pa.array([], type=self.schema.field(name).type)
+                                        for name in FACT_COLUMNS}))
+        return ds.dataset(self.root, schema=self.schema, format="parquet", partitioning=self.partitioning)
+
+    def loaded_accessions(self) -> Set[str]:
+        """Accessions already in the store, so reruns only extract new filings."""
+        table = self.dataset().to_table(columns=["accession"])
+        return set(pc.unique(table.column("accession")).to_pylist())
+
+    def scan(self, concepts: Optional[Sequence[str]] = None, forms: Optional[Sequence[str]] = None,
+             years: Optional[Sequence[int]] = None, ciks: Optional[Sequence[int]] = None,
+             units: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None):
+        """Facts matching every given filter as an Arrow table; concepts may be 'taxonomy:Concept'."""
+        conditions = []
+        if concepts:
+            names = [concept.split(":", 1)[-1] for concept in concepts]
+            conditions.append(pc.field("concept").isin(names))
+            taxonomies = {concept.split(":", 1)[0] for concept in concepts if ":" in concept}
+            if taxonomies:
+                conditions.append(pc.field("taxonomy").isin(sorted(taxonomies)))
+        for column, values in (("form_type", forms), ("fiscal_year", years), ("cik", ciks), ("unit", units)):
+            if values:
+                conditions.append(pc.field(column).isin(list(values)))
+        condition = None
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+        return self.dataset().to_table(columns=list(columns) if columns else None, filter=condition)
+
+    @staticmethod
+    def latest(table):
+        """Keep one value per fact: the one from the most recently filed accession.
+
+        Filings repeat prior periods as comparatives, so the same (company, concept,
+        unit, period) appears in several accessions, possibly restated. The fiscal year
+        kept is that of the earliest of them, the filing the period was current in.
+        """
+        ordered = table.sort_by([("filed", "descending"), ("accession", "descending")])
+        aggregations = [(name, "min" if name == "fiscal_year" else "first")
+                        for name in table.column_names if name not in FACT_KEY]
+        # Single-threaded grouping keeps the input order, so "first" is the latest filing
+        latest = ordered.group_by(FACT_KEY, use_threads=False).aggregate(aggregations)
+        return latest.rename_columns([name.rsplit("_", 1)[0] if name.endswith(("_first", "_min")) else name
+                                      for name in latest.column_names])
+
+    def aggregate(self, concept: str, by: Sequence[str] = ("fiscal_year",), agg: str = "sum",
+                  forms: Optional[Sequence[str]] = None, years: Optional[Sequence[int]] = None,
+                  unit: Optional[str] = "USD", dedupe: bool = True):
+        """Aggregate one concept across companies, e.g. total revenue per fiscal year.
+
+        Returns an Arrow table with the `by` columns, value_<agg> and the number of companies.
+        """
+        # Only the columns the grouping needs are read
+        columns = set(by) | {"cik", "value"}
+        if dedupe:
+            columns |= set(FACT_KEY) | {"filed", "accession", "fiscal_year"}
+        table = self.scan([concept], forms, years, units=[unit] if unit else None, columns=sorted(columns))
+        if dedupe:
+            table = self.latest(table)
+        return table.group_by(list(by)).aggregate([("value", agg), ("cik", "count_distinct")]).sort_by(
+            [(name, "ascending") for name in by])
+
+    @staticmethod
+    def frame(table):
+        if pandas is None:
+            raise ImportError("frame() requires pandas (pip install pandas)")
+        return table.to_pandas()
+
+
+class XBRLExtractor:
+    """Loads the XBRL facts of manifest filings into a FactStore.
+
+    Each filer's companyfacts document (from data.sec.gov, or a local copy of SEC's
+    companyfacts.zip bulk file or its extracted directory) is read once and the facts
+    of the manifest's accessions are kept. Filings missing from it, such as ones filed
+    after the companyfacts snapshot, are parsed from their inline XBRL document instead.
+    """
+
+    def __init__(self, store: FactStore, rate_limiter: Optional[RateLimiter] = None,
+                 companyfacts: Optional[str] = None, facts_url: str = COMPANYFACTS_BASE_URL,
+                 concurrency: int = 4):
+        self.store = store
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.companyfacts = Path(companyfacts) if companyfacts else None
+        self._archive = zipfile.ZipFile(self.companyfacts) if self.companyfacts and \
+            self.companyfacts.suffix == ".zip" else None
+        self.facts_url = facts_url.rstrip("/")
+        self.concurrency = max(concurrency, 1)
+        self.session = create_session(pool_size=self.concurrency)
+
+    def _get(self, url: str):
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if not http_cache.served_offline(url):
+                self.rate_limiter.wait()
+            response = timed_get(self.session, url, self.rate_limiter, 60)
+            if self.rate_limiter.record_response(response.status_code, response.headers, attempt) is None:
+                break
+        return response
+
+    def load_companyfacts(self, cik: int) -> Optional[Dict]:
+        name = f"CIK{cik:010d}.json"
+        if self._archive is not None:
+            try:
+                return json.loads(self._archive.read(name))
+            except KeyError:
+                return None
+        if self.companyfacts is not None:
+            path = self.companyfacts / name
+            return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+        with metrics.span("companyfacts"):
+            response = self._get(f"{self.facts_url}/{name}")
+        if response.status_code != 200:
+            # 404 means the filer has no XBRL financial data
+            logger.info(f"No companyfacts for CIK {cik}: Status Code {response.status_code}")
+            return None
+        return response.json()
+
+    def load_document(self, filing: Filing) -> Optional[str]:
+        if filing.file_path and Path(filing.file_path).suffix.lower() in (".htm", ".html"):
+            path = Path(filing.file_path)
+            if path.exists():
+                return path.read_text(encoding="utf-8", errors="replace")
+        with metrics.span("inline_xbrl"):
+            response = self._get(filing.file_url)
+        if response.status_code != 200:
+            logger.error(f"Failed to load {filing.file_url}: Status Code {response.status_code}")
+            return None
+        return response.text
+
+    def facts_for(self, cik: int, filings: Dict[str, Filing]) -> List[Dict]:
+        data = self.load_companyfacts(cik)
+        facts = list(facts_from_companyfacts(data, filings)) if data else []
+        found = {fact["accession"] for fact in facts}
+        for accession, filing in filings.items():
+            if accession in found:
+                continue
+            html = self.load_document(filing)
+            inline = list(facts_from_inline_xbrl(html, filing)) if html else []
+            if not inline:
+                metrics.inc("failures_total", form_type=filing.form_type, stage="xbrl")
+                logger.warning(f"No XBRL facts found for {accession}")
+            facts.extend(inline)
+        return facts
+
+    def extract(self, filings: Dict[int, Dict[str, Filing]]) -> int:
+        """Load the facts of every filing not already in the store; returns the facts written."""
+        loaded = self.store.loaded_accessions()
+        pending = {cik: {accession: filing for accession, filing in by_accession.items() if accession not in loaded}
+                   for cik, by_accession in filings.items()}
+        pending = {cik: by_accession for cik, by_accession in pending.items() if by_accession}
+        logger.info(f"Extracting {sum(len(v) for v in pending.values())} filings of {len(pending)} companies")
+
+        def facts():
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = {executor.submit(self.facts_for, cik, by_accession): cik
+                           for cik, by_accession in pending.items()}
+                for future in as_completed(futures):
+                    try:
+                        yield from future.result()
+                    except Exception as e:
+                        metrics.inc("failures_total", stage="xbrl")
+                        logger.error(f"Failed to extract facts of CIK {futures[future]}: {e}")
+
+        return self.store.write(facts())
+
+    def close(self) -> None:
+        self.session.close()
+        if self._archive is not None:
+            self._archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract XBRL facts of 10-K/10-Q filings into a Parquet fact store")
+    parser.add_argument("--root", default="xbrl_facts", help="directory of the partitioned Parquet dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser("extract", help="load the facts of a manifest's filings")
+    extract.add_argument("--input", default="Master_file.csv", help="manifest (Updated_Master_file.csv reuses downloads)")
+    extract.add_argument("--forms", nargs="+", default=list(DEFAULT_FORMS), help="form groups of the manifest to load")
+    extract.add_argument("--companyfacts", default=None, metavar="PATH",
+                         help="local companyfacts.zip or its extracted directory instead of data.sec.gov")
+    extract.add_argument("--facts-url", default=COMPANYFACTS_BASE_URL)
+    extract.add_argument("--concurrency", type=int, default=4)
+    extract.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND)
+    extract.add_argument("--http-cache", default=None, metavar="DIR")
+    extract.add_argument("--http-cache-mb", type=float, default=http_cache.DEFAULT_MAX_MB)
+
+    query = commands.add_parser("query", help="aggregate a concept across companies")
+    query.add_argument("concept", help="e.g. us-gaap:Revenues")
+    query.add_argument("--by", nargs="+", default=["fiscal_year"], help="columns to group by")
+    query.add_argument("--agg", default="sum", choices=["sum", "mean", "min", "max", "count", "approximate_median"])
+    query.add_argument("--forms", nargs="+", default=None)
+    query.add_argument("--years", nargs="+", type=int, default=None)
+    query.add_argument("--unit", default="USD")
+    query.add_argument("--all-values", action="store_true",
+                       help="keep every filing's value of a period instead of only the latest")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = FactStore(args.root)
+    if args.command == "extract":
+        http_cache.enable(args.http_cache, args.http_cache_mb)
+        extractor = XBRLExtractor(store, RateLimiter(args.rate), args.companyfacts, args.facts_url, args.concurrency)
+        try:
+            count = extractor.extract(filings_from_manifest(args.input, args.forms))
+            logger.info(f"Wrote {count} facts to {args.root}")
+        finally:
+            extractor.close()
+    else:
+        result = store.aggregate(args.concept, args.by, args.agg, args.forms, args.years, args.unit or None,
+                                 dedupe=not args.all_values)
+        for row in result.to_pylist():
+            print("  ".join(f"{name}={value}" for name, value in row.items()))
+
+
+if __name__ == "__main__":
+    main()